@@ -20,9 +20,24 @@ from CTkMessagebox import CTkMessagebox
 from config import SETTINGS_FILE, AI_PROFILES, SERVICE_NAME, KEY_USERNAME
 from database import (
     get_user_data_path, load_documents_from_db, delete_document_from_db,
-    extract_text_from_file, save_document_to_db, search_knowledge_base,
     save_history_to_file, load_history_from_file
 )
+from ingestion import ingest_files_parallel
+from gemini_integration import reset_gemini_client
+
+def iter_sse_events(response):
+    """Lê uma resposta HTTP em streaming no formato 'server-sent events' e gera (evento, dados)."""
+    event, data_lines = "message", []
+    for line in response.iter_lines(decode_unicode=True):
+        if line:
+            field, _, value = line.partition(":")
+            if field == "event":
+                event = value.strip()
+            elif field == "data":
+                data_lines.append(value[1:] if value.startswith(" ") else value)
+        elif data_lines:
+            yield event, json.loads("\n".join(data_lines))
+            event, data_lines = "message", []
 
 # --- CLASSES AUXILIARES DA UI ---
 
@@ -83,6 +98,7 @@ class ApiKeySetupWindow(customtkinter.CTk):
         if api_key:
             try:
                 keyring.set_password(SERVICE_NAME, KEY_USERNAME, api_key)
+                reset_gemini_client()
                 logging.info("Chave de API guardada com sucesso")
                 self.api_key_saved = True
                 self.destroy()
@@ -144,23 +160,11 @@ class KnowledgeBaseWindow(customtkinter.CTkToplevel):
             threading.Thread(target=self.process_documents, args=(file_paths,), daemon=True).start()
 
     def process_documents(self, file_paths):
-        total_files = len(file_paths)
-        success_count = 0
-        failed_files = []
-        
-        for i, path in enumerate(file_paths):
-            filename = os.path.basename(path)
-            
-            progress_value = (i + 1) / total_files
-            status_text = f"A processar {i+1}/{total_files}: {filename[:30]}..."
-            self.master.after(0, self.update_progress, progress_value, status_text)
-
-            text = extract_text_from_file(path)
-            if text and save_document_to_db(filename, text):
-                success_count += 1
-            else:
-                failed_files.append(filename)
-                
+        def on_progress(value, text):
+            # Já agrupado por ingest_files_parallel: no máximo uma atualização por intervalo
+            self.master.after(0, self.update_progress, value, text)
+
+        success_count, failed_files = ingest_files_parallel(file_paths, progress_callback=on_progress)
         self.master.after(0, self.on_processing_done, success_count, failed_files)
 
     def update_progress(self, value, text):
@@ -241,6 +245,7 @@ class App(customtkinter.CTk):
         
         self.history_data = load_history_from_file()
         self.current_chat_messages = []
+        self.session_id = None  # Sessão da conversa no servidor (None até ao primeiro turno)
         self.viewed_chat_messages = []
         self.is_viewing_history = False
         
@@ -431,17 +436,40 @@ class App(customtkinter.CTk):
         loading_widget = self.render_message(loading_message["sender"], loading_message["parts"])
         
         try:
-            # Simplificamos o payload, o servidor agora faz a busca na base de conhecimento
-            payload = {
-                "prompt": user_text,
-                "history": self.get_formatted_history(),
-                "user_name": self.user_name_var.get(),
-                "profile": self.selected_profile_var.get()
-            }
-            
-            response = requests.post("http://127.0.0.1:5000/chat", json=payload, timeout=90)
-            response.raise_for_status()
-            ai_data = response.json()
+            # O servidor faz a busca na base de conhecimento e guarda o histórico na sessão:
+            # basta enviar a mensagem nova. Sem sessão (primeiro turno, ou sessão expirada
+            # no servidor) vai o histórico completo, a partir do qual a sessão é criada.
+            for attempt in range(2):
+                payload = {
+                    "prompt": user_text,
+                    "session_id": self.session_id,
+                    "user_name": self.user_name_var.get(),
+                    "profile": self.selected_profile_var.get()
+                }
+                if self.session_id is None:
+                    # A última mensagem é a pergunta atual, que segue em "prompt"
+                    payload["history"] = self.get_formatted_history(self.current_chat_messages[:-1])
+
+                # A resposta chega em streaming: o texto vai aparecendo na bolha "A processar..."
+                ai_data = None
+                with requests.post("http://127.0.0.1:5000/chat/stream", json=payload, stream=True, timeout=90) as response:
+                    if response.status_code == 409 and self.session_id is not None:
+                        logging.info("Sessão expirada no servidor. A reenviar o histórico completo.")
+                        self.session_id = None
+                        continue
+                    response.raise_for_status()
+                    for event, data in iter_sse_events(response):
+                        if event == "delta":
+                            self.after(0, self.append_to_message, loading_widget, data["text"])
+                        elif event == "done":
+                            ai_data = data
+                break
+
+            if isinstance(ai_data, dict) and ai_data.get("session_id"):
+                self.session_id = ai_data["session_id"]
+
+            if ai_data is None:
+                raise Exception("A ligação ao servidor terminou antes do fim da resposta.")
 
             if isinstance(ai_data, dict) and "error" in ai_data:
                  raise Exception(ai_data["error"])
@@ -462,16 +490,21 @@ class App(customtkinter.CTk):
             self.current_chat_messages.append(error_message)
             self.render_message(error_message["sender"], error_message["parts"])
     
-    def get_formatted_history(self):
-        """Formata o histórico de mensagens para ser enviado à API."""
-        MAX_HISTORY_MESSAGES = 20 # Limita o histórico enviado para as últimas 20 trocas
-        recent_messages = self.current_chat_messages[-MAX_HISTORY_MESSAGES:]
-        
+    def get_formatted_history(self, messages):
+        """
+        Formata o histórico de mensagens para ser enviado à API. Vai a conversa inteira:
+        o servidor resume as mensagens antigas (de forma incremental, o que exige que o
+        início do histórico não mude de turno para turno) para caber no limite de tokens.
+        """
         history_for_payload = []
-        for msg in recent_messages:
+        for msg in messages:
             if msg.get('parts'):
                 sender_name = "Utilizador" if "Você" in msg['sender'] else "IA"
-                full_content = ' '.join(p['content'] for p in msg['parts'] if p.get('content'))
+                # O código vai entre ``` para o servidor o poder omitir no resumo
+                full_content = ' '.join(
+                    f"```\n{p['content']}\n```" if p.get('type') == 'code' else p['content']
+                    for p in msg['parts'] if p.get('content')
+                )
                 history_for_payload.append(f"{sender_name}: {full_content}")
         
         return "\n".join(history_for_payload)
@@ -497,6 +530,14 @@ class App(customtkinter.CTk):
         self.current_chat_messages.append(message)
         self.render_message(message["sender"], message["parts"])
 
+    def append_to_message(self, row, text):
+        """Acrescenta texto recebido em streaming a uma mensagem já desenhada (substitui o texto provisório)."""
+        if not row.winfo_exists() or row.text_label is None:
+            return
+        row.streamed_text = getattr(row, 'streamed_text', '') + text
+        row.text_label.configure(text=row.streamed_text)
+        self.chat_area._parent_canvas.yview_moveto(1.0)
+
     def render_message(self, sender, parts):
         # Esconde a mensagem de boas-vindas assim que a primeira mensagem for renderizada
         self.welcome_label.place_forget()
@@ -519,9 +560,12 @@ class App(customtkinter.CTk):
             avatar.pack(side="left", anchor="n", padx=(0,10))
             bubble.pack(side="left", anchor="w")
 
+        row.text_label = None # Primeira etiqueta de texto, usada por 'append_to_message'
         for part in parts:
             if part['type'] == 'normal':
-                customtkinter.CTkLabel(bubble, text=part['content'], font=self.active_font, text_color="white" if is_user else self.AI_TEXT_COLOR, wraplength=self.chat_area.winfo_width() * 0.7, justify="left").pack(padx=15, pady=12, fill="x", expand=True)
+                label = customtkinter.CTkLabel(bubble, text=part['content'], font=self.active_font, text_color="white" if is_user else self.AI_TEXT_COLOR, wraplength=self.chat_area.winfo_width() * 0.7, justify="left")
+                label.pack(padx=15, pady=12, fill="x", expand=True)
+                row.text_label = row.text_label or label
             elif part['type'] == 'code':
                 code_frame = customtkinter.CTkFrame(bubble, fg_color=("#2b2b2b", "#f5f5f5"), corner_radius=10)
                 code_frame.pack(fill="both", expand=True, padx=10, pady=10)
@@ -612,6 +656,7 @@ class App(customtkinter.CTk):
         if msg.get() == 'Sim':
             try:
                 keyring.delete_password(SERVICE_NAME, KEY_USERNAME)
+                reset_gemini_client()
                 logging.info("Chave de API removida.")
                 self.destroy()
                 sys.exit()
@@ -643,6 +688,7 @@ class App(customtkinter.CTk):
             self.update_history_sidebar()
 
         self.current_chat_messages = []
+        self.session_id = None
         self.clear_chat_area()
 
         self.is_viewing_history = False
@@ -656,6 +702,7 @@ class App(customtkinter.CTk):
         # Carrega a conversa selecionada para a sessão atual
         session_to_continue = self.history_data[session_index]
         self.current_chat_messages = session_to_continue["messages"]
+        self.session_id = None  # A primeira pergunta envia o histórico carregado para criar a sessão
         
         # Renderiza todas as mensagens da conversa carregada
         for message in self.current_chat_messages:
@@ -0,0 +1,366 @@
+# /benchmarks/chat_load_test.py
+"""
+Teste de carga (e offline) de '/chat' e '/chat/stream' com o modelo simulado.
+
+Por omissão arranca o servidor num processo próprio, com a pasta de dados da aplicação
+(DATA_DIR_ENV_VAR) numa pasta temporária e o backend do modelo trocado por um
+'FakeModelBackend' (latência log-normal, streaming, JSON inválido e erros 429 simulados),
+pelo que não gasta quota nem precisa de chave de API. Envia 'requests' pedidos (ou
+durante 'duration' segundos) com 'concurrency' clientes em paralelo e mede o débito, os
+percentis da latência (e do primeiro fragmento, em streaming) e os estados/erros. O
+resultado é um JSON, com o '/metrics' do servidor no fim do teste:
+
+    python benchmarks/chat_load_test.py --requests 500 --concurrency 20
+    python benchmarks/chat_load_test.py --endpoint stream --duration 30 --rate-limit-rate 0.05
+
+Com '--url' o teste corre contra um servidor já arrancado (ex.: com
+MODEL_BACKEND_ENV_VAR=fake) e as opções do modelo simulado são ignoradas. O limitador de
+pedidos do servidor arranca com um orçamento alto (DEFAULT_LIMITER_RPM), para medir o
+'/chat' e não a quota; '--limiter-rpm 15' reproduz GEMINI_REQUESTS_PER_MINUTE.
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import socket
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import urllib.error
+import urllib.request
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from config import (  # noqa: E402
+    DATA_DIR_ENV_VAR, MODEL_BACKEND_ENV_VAR, GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE,
+    FAKE_MODEL_LATENCY_SECONDS, FAKE_MODEL_LATENCY_SIGMA, FAKE_MODEL_STREAM_CHUNKS,
+    FAKE_MODEL_MALFORMED_RATE, FAKE_MODEL_RATE_LIMIT_RATE, FAKE_MODEL_RATE_LIMIT_RETRY_SECONDS,
+    FAKE_MODEL_QUOTA_PER_MINUTE
+)
+
+DEFAULT_REQUESTS = 200
+DEFAULT_CONCURRENCY = 10
+DEFAULT_SEED = 42
+DEFAULT_LIMITER_RPM = 1000000  # Orçamento do limitador no servidor de teste (na prática, sem limite)
+SERVER_START_TIMEOUT_SECONDS = 30
+REQUEST_TIMEOUT_SECONDS = 180
+ENDPOINTS = {"chat": "/chat", "stream": "/chat/stream"}
+PROMPT_TOPICS = (
+    "como configurar uma VLAN no comutador", "porque é que o serviço nginx não arranca",
+    "how to debug a BGP session stuck in Active", "como renovar o certificado TLS do servidor",
+    "what does error 0x80070005 mean during upgrade", "como abrir a porta 8443 na firewall",
+)
+
+
+# --- Servidor com o modelo simulado (num processo próprio) ---
+def serve(port, args):
+    """Corre o servidor com um FakeModelBackend configurado pelos argumentos (processo filho)."""
+    from database import init_db
+    from model_backends import FakeModelBackend
+    from gemini_integration import set_model_backend, rate_limiter
+    from server import run_server
+
+    set_model_backend(FakeModelBackend(
+        latency_seconds=args.latency, latency_sigma=args.latency_sigma, stream_chunks=args.stream_chunks,
+        malformed_rate=args.malformed_rate, rate_limit_rate=args.rate_limit_rate,
+        rate_limit_retry_seconds=args.rate_limit_retry, quota_per_minute=args.quota_rpm, seed=args.seed
+    ))
+    rate_limiter.reconfigure(args.limiter_rpm, GEMINI_TOKENS_PER_MINUTE)
+    init_db()
+    run_server(port=port)
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_for_server(base_url, process):
+    deadline = time.monotonic() + SERVER_START_TIMEOUT_SECONDS
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"O servidor terminou ao arrancar (código {process.returncode}).")
+        try:
+            with urllib.request.urlopen(base_url + "/metrics", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"O servidor não respondeu em {SERVER_START_TIMEOUT_SECONDS}s.")
+
+
+def _server_args(args):
+    names = ("latency", "latency_sigma", "stream_chunks", "malformed_rate", "rate_limit_rate",
+             "rate_limit_retry", "quota_rpm", "limiter_rpm", "seed")
+    command = []
+    for name in names:
+        value = getattr(args, name)
+        if value is not None:
+            command += [f"--{name.replace('_', '-')}", str(value)]
+    return command
+
+
+# --- Pedidos ---
+def _prompt(index, distinct_prompts):
+    number = index % distinct_prompts if distinct_prompts else index
+    return f"Pergunta {number}: {PROMPT_TOPICS[number % len(PROMPT_TOPICS)]}?"
+
+
+def _post(url, payload):
+    request = urllib.request.Request(
+        url, data=json.dumps(payload).encode("utf-8"), headers={"Content-Type": "application/json"}
+    )
+    return urllib.request.urlopen(request, timeout=REQUEST_TIMEOUT_SECONDS)
+
+
+def _read_stream(response, start):
+    """Lê os eventos SSE até ao 'done'. Retorna (resposta_final, tempo_até_ao_primeiro_delta)."""
+    time_to_first_token = None
+    event = None
+    for raw_line in response:
+        line = raw_line.decode("utf-8").rstrip("\n")
+        if line.startswith("event: "):
+            event = line[len("event: "):]
+        elif line.startswith("data: "):
+            if event == "delta" and time_to_first_token is None:
+                time_to_first_token = time.perf_counter() - start
+            elif event == "done":
+                return json.loads(line[len("data: "):]), time_to_first_token
+    return {"error": "Streaming terminado sem o evento 'done'."}, time_to_first_token
+
+
+def _error_kind(message):
+    """Agrupa as mensagens de erro (sem os detalhes variáveis depois de ':')."""
+    return str(message).split(":")[0][:120]
+
+
+def send_request(url, endpoint, payload):
+    """Envia um pedido e devolve um dict com o estado HTTP, a latência, o TTFT e o erro (se houver)."""
+    start = time.perf_counter()
+    time_to_first_token = None
+    try:
+        with _post(url + ENDPOINTS[endpoint], payload) as response:
+            status = response.status
+            if endpoint == "stream":
+                body, time_to_first_token = _read_stream(response, start)
+            else:
+                body = json.loads(response.read())
+    except urllib.error.HTTPError as e:
+        status = e.code
+        try:
+            body = json.loads(e.read())
+        except ValueError:
+            body = {"error": f"HTTP {e.code}"}
+    except Exception as e:
+        status = None
+        body = {"error": f"{type(e).__name__}: {e}"}
+    latency = time.perf_counter() - start
+    error = body.get("error") if isinstance(body, dict) else "Resposta inválida"
+    return {"status": status, "latency": latency, "ttft": time_to_first_token, "error": error}
+
+
+def run_load(url, endpoint, requests_count, duration, concurrency, distinct_prompts, profile=None):
+    """
+    Envia os pedidos com 'concurrency' clientes em paralelo: 'requests_count' pedidos no
+    total ou, se 'duration' for indicado, tantos quantos couberem nesses segundos.
+    """
+    lock = threading.Lock()
+    next_index = [0]
+    results = []
+    deadline = time.monotonic() + duration if duration else None
+
+    def take_index():
+        with lock:
+            if deadline is None and next_index[0] >= requests_count:
+                return None
+            if deadline is not None and time.monotonic() >= deadline:
+                return None
+            index = next_index[0]
+            next_index[0] += 1
+            return index
+
+    def client(worker):
+        while True:
+            index = take_index()
+            if index is None:
+                return
+            payload = {"prompt": _prompt(index, distinct_prompts), "user_name": f"carga-{worker}"}
+            if profile:
+                payload["profile"] = profile
+            result = send_request(url, endpoint, payload)
+            with lock:
+                results.append(result)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        for worker in range(concurrency):
+            executor.submit(client, worker)
+    elapsed = time.perf_counter() - start
+    return results, elapsed
+
+
+# --- Relatório ---
+def _percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99),
+        "mean_ms": sum(ordered) / len(ordered) * 1000, "max_ms": ordered[-1] * 1000,
+    }
+
+
+def summarize(results, elapsed):
+    ok = [r for r in results if r["status"] == 200 and not r["error"]]
+    errors = Counter(_error_kind(r["error"]) for r in results if r["error"])
+    return {
+        "requests": len(results),
+        "ok": len(ok),
+        "errors": sum(errors.values()),
+        "duration_seconds": elapsed,
+        "throughput_rps": len(results) / elapsed if elapsed else 0.0,
+        "ok_throughput_rps": len(ok) / elapsed if elapsed else 0.0,
+        "latency": _percentiles([r["latency"] for r in results]),
+        "ok_latency": _percentiles([r["latency"] for r in ok]),
+        "time_to_first_token": _percentiles([r["ttft"] for r in results if r["ttft"] is not None]),
+        "status": {str(status): count for status, count in Counter(r["status"] for r in results).items()},
+        "error_kinds": dict(errors.most_common()),
+    }
+
+
+def _server_metrics(base_url):
+    try:
+        with urllib.request.urlopen(base_url + "/metrics", timeout=10) as response:
+            report = json.loads(response.read())
+    except (OSError, ValueError) as e:
+        return {"error": str(e)}
+    keys = ("stages", "counters", "rate_limiter", "single_flight", "model_backend")
+    return {key: report.get(key) for key in keys}
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_load_test(args):
+    process = None
+    data_dir = None
+    base_url = args.url.rstrip("/") if args.url else None
+    try:
+        if base_url is None:
+            port = _free_port()
+            data_dir = tempfile.mkdtemp(prefix="aitechexpert_load_")
+            env = dict(os.environ, **{DATA_DIR_ENV_VAR: data_dir, MODEL_BACKEND_ENV_VAR: "fake"})
+            command = [sys.executable, os.path.abspath(__file__), "--serve", str(port)] + _server_args(args)
+            log_file = open(os.path.join(data_dir, "server.log"), "w", encoding="utf-8")
+            process = subprocess.Popen(command, env=env, stdout=log_file, stderr=subprocess.STDOUT)
+            log_file.close()
+            base_url = f"http://127.0.0.1:{port}"
+            _wait_for_server(base_url, process)
+
+        target = f"{args.duration}s" if args.duration else f"{args.requests} pedido(s)"
+        print(f"A enviar {target} para {base_url}{ENDPOINTS[args.endpoint]} "
+              f"com {args.concurrency} cliente(s)...", file=sys.stderr)
+        results, elapsed = run_load(
+            base_url, args.endpoint, args.requests, args.duration, args.concurrency,
+            args.distinct_prompts, args.profile
+        )
+        summary = summarize(results, elapsed)
+        server_metrics = _server_metrics(base_url)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=10)
+        if data_dir and not args.keep_data:
+            shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "benchmark": "chat_load",
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "endpoint": args.endpoint,
+            "concurrency": args.concurrency,
+            "requests": None if args.duration else args.requests,
+            "duration": args.duration,
+            "distinct_prompts": args.distinct_prompts,
+            "server": args.url or "fake",
+            "fake_model": None if args.url else {
+                "latency_seconds": args.latency, "latency_sigma": args.latency_sigma,
+                "stream_chunks": args.stream_chunks, "malformed_rate": args.malformed_rate,
+                "rate_limit_rate": args.rate_limit_rate, "quota_per_minute": args.quota_rpm,
+                "limiter_requests_per_minute": args.limiter_rpm,
+                "seed": args.seed,
+            },
+        },
+        "results": summary,
+        "server_metrics": server_metrics,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Teste de carga de '/chat' com o modelo simulado.")
+    parser.add_argument("--url", help="Servidor já arrancado (por omissão arranca um com o modelo simulado)")
+    parser.add_argument("--endpoint", choices=sorted(ENDPOINTS), default="chat")
+    parser.add_argument("--requests", type=int, default=DEFAULT_REQUESTS, help="Pedidos a enviar no total")
+    parser.add_argument("--duration", type=float, help="Segundos de teste (substitui --requests)")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_CONCURRENCY, help="Clientes em paralelo")
+    parser.add_argument("--distinct-prompts", type=int, default=0,
+                        help="Perguntas diferentes, repetidas em ciclo (0 = todas diferentes, sem cache)")
+    parser.add_argument("--profile", help="Perfil da IA usado nos pedidos")
+    parser.add_argument("--latency", type=float, default=FAKE_MODEL_LATENCY_SECONDS,
+                        help="Mediana da latência simulada do modelo, em segundos")
+    parser.add_argument("--latency-sigma", type=float, default=FAKE_MODEL_LATENCY_SIGMA,
+                        help="Dispersão da latência (log-normal)")
+    parser.add_argument("--stream-chunks", type=int, default=FAKE_MODEL_STREAM_CHUNKS)
+    parser.add_argument("--malformed-rate", type=float, default=FAKE_MODEL_MALFORMED_RATE,
+                        help="Fração das respostas com JSON inválido")
+    parser.add_argument("--rate-limit-rate", type=float, default=FAKE_MODEL_RATE_LIMIT_RATE,
+                        help="Fração das chamadas ao modelo que falham com 429")
+    parser.add_argument("--rate-limit-retry", type=float, default=FAKE_MODEL_RATE_LIMIT_RETRY_SECONDS,
+                        help="Atraso (segundos) indicado nos 429 simulados")
+    parser.add_argument("--quota-rpm", type=int, default=FAKE_MODEL_QUOTA_PER_MINUTE,
+                        help="Quota simulada do modelo em pedidos por minuto (0 = sem quota)")
+    parser.add_argument("--limiter-rpm", type=int, default=DEFAULT_LIMITER_RPM,
+                        help=f"Orçamento do limitador do servidor em pedidos por minuto "
+                             f"(a aplicação usa {GEMINI_REQUESTS_PER_MINUTE})")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--output", help="Ficheiro JSON onde guardar os resultados (por omissão, stdout)")
+    parser.add_argument("--keep-data", action="store_true", help="Não apaga a pasta de dados temporária")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve is not None:
+        serve(args.serve, args)
+        return
+
+    report = run_load_test(args)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Resultados guardados em '{args.output}'.", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
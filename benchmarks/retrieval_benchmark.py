@@ -0,0 +1,368 @@
+# /benchmarks/retrieval_benchmark.py
+"""
+Benchmark reprodutível (e offline) da pesquisa e da ingestão na base de conhecimento.
+
+Para cada tamanho pedido (em fragmentos), gera um corpus técnico sintético em português
+e inglês, importa-o com 'ingest_document' (extração do TXT + gravação em lotes) e mede:
+débito da ingestão, latência das pesquisas (fria, morna sem cache e com a cache de
+pesquisa) em cada modo, pico de memória e tamanho da base de dados.
+
+Cada tamanho corre num processo próprio, com a pasta de dados da aplicação apontada
+(DATA_DIR_ENV_VAR) para uma pasta temporária, para que as medições não se misturem nem
+toquem nos dados do utilizador. O resultado é um JSON, comparável entre commits:
+
+    python benchmarks/retrieval_benchmark.py --sizes 1000,10000,100000 --output atual.json
+    python benchmarks/retrieval_benchmark.py --sizes 1000,10000 --compare atual.json
+"""
+
+import os
+import sys
+import json
+import time
+import math
+import random
+import shutil
+import argparse
+import platform
+import tempfile
+import subprocess
+import tracemalloc
+
+try:
+    import resource
+except ImportError:  # Windows: sem getrusage, o pico de RSS fica por medir
+    resource = None
+
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT_DIR)
+
+from config import (  # noqa: E402
+    DATA_DIR_ENV_VAR, DB_NAME, VECTOR_INDEX_FILE, RETRIEVAL_MODES,
+    CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, SEARCH_CANDIDATE_LIMIT
+)
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_QUERIES = 50
+DEFAULT_SEED = 42
+CHUNKS_PER_DOCUMENT = 200
+# Caracteres novos por fragmento (a sobreposição repete CHUNK_OVERLAP_TOKENS de cada anterior)
+CHARS_PER_CHUNK = (CHUNK_MAX_TOKENS - CHUNK_OVERLAP_TOKENS) * 4
+
+# --- Corpus sintético ---
+PT_WORDS = (
+    "a o de da do que para com uma um na no os as em por se não mais como ao pela pelo "
+    "configuração configurar interface endereço rede servidor firewall regra porta protocolo "
+    "encaminhamento sub-rede máscara utilizador permissões ficheiro diretório serviço arranque "
+    "pacote instalação atualização cópia segurança certificado chave autenticação registo erro "
+    "ligação tráfego largura banda comutador encaminhador tabela rota política cliente"
+).split()
+EN_WORDS = (
+    "the of to and a in is for on with that by this be are as from at or an it not "
+    "router switch vlan bgp ospf dns dhcp ssh tls nginx docker container systemctl iptables "
+    "kubernetes backup latency throughput packet timeout gateway subnet mask kernel module "
+    "service daemon config install upgrade certificate key login error network bridge tunnel"
+).split()
+# Cauda longa de termos raros: modelos de equipamento, interfaces, códigos de erro
+RARE_PREFIXES = ("rb", "eth", "err", "vlan", "ccr", "ge-0/0/", "cve-2024-", "port")
+RARE_TERMS = 5000
+ZIPF_EXPONENT = 1.1
+
+
+def _zipf_cum_weights(count):
+    total = 0.0
+    cum_weights = []
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** ZIPF_EXPONENT
+        cum_weights.append(total)
+    return cum_weights
+
+
+class CorpusGenerator:
+    """Gera documentos e perguntas deterministicamente a partir da 'seed'."""
+
+    def __init__(self, seed):
+        self.random = random.Random(seed)
+        rare = [f"{RARE_PREFIXES[i % len(RARE_PREFIXES)]}{i}" for i in range(RARE_TERMS)]
+        self.vocabularies = {"pt": PT_WORDS + rare, "en": EN_WORDS + rare}
+        self.cum_weights = {lang: _zipf_cum_weights(len(words)) for lang, words in self.vocabularies.items()}
+
+    def _sentence(self, lang):
+        words = self.random.choices(
+            self.vocabularies[lang], cum_weights=self.cum_weights[lang], k=self.random.randint(8, 20)
+        )
+        return " ".join(words).capitalize() + self.random.choice((".", ".", ".", "?", ":"))
+
+    def document(self, index, target_chars):
+        lang = "pt" if index % 2 == 0 else "en"
+        sentences = [f"Documento {index} ({lang})."]
+        size = len(sentences[0])
+        while size < target_chars:
+            sentence = self._sentence(lang)
+            sentences.append(sentence)
+            size += len(sentence) + 1
+        return " ".join(sentences)
+
+    def queries(self, count):
+        """Perguntas com 2 a 4 termos do vocabulário (alguns raros), em português ou inglês."""
+        queries = []
+        for _ in range(count):
+            lang = self.random.choice(("pt", "en"))
+            words = self.vocabularies[lang]
+            terms = self.random.choices(words, cum_weights=self.cum_weights[lang], k=self.random.randint(1, 3))
+            terms.append(self.random.choice(words[-RARE_TERMS:]))
+            prefix = "como configurar" if lang == "pt" else "how to configure"
+            queries.append(f"{prefix} {' '.join(terms)}?")
+        return queries
+
+
+# --- Medição (num processo por tamanho) ---
+def _percentiles(samples):
+    ordered = sorted(samples)
+    if not ordered:
+        return {}
+
+    def at(fraction):
+        return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * 1000
+
+    return {
+        "p50_ms": at(0.50), "p95_ms": at(0.95), "p99_ms": at(0.99),
+        "mean_ms": sum(ordered) / len(ordered) * 1000, "max_ms": ordered[-1] * 1000,
+    }
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024  # Linux indica KB
+
+
+def _data_files_bytes(data_dir):
+    names = (DB_NAME, DB_NAME + "-wal", DB_NAME + "-shm", VECTOR_INDEX_FILE)
+    return {name: os.path.getsize(os.path.join(data_dir, name))
+            for name in names if os.path.exists(os.path.join(data_dir, name))}
+
+
+def run_one(size, query_count, seed, modes):
+    """Mede um tamanho de corpus. Espera DATA_DIR_ENV_VAR já definido (pasta vazia)."""
+    import database
+
+    data_dir = os.environ[DATA_DIR_ENV_VAR]
+    corpus_dir = os.path.join(data_dir, "corpus")
+    os.makedirs(corpus_dir, exist_ok=True)
+    generator = CorpusGenerator(seed)
+
+    # Corpus em ficheiros TXT (a geração não conta para o débito)
+    documents = max(1, math.ceil(size / CHUNKS_PER_DOCUMENT))
+    chars_per_document = min(size, CHUNKS_PER_DOCUMENT) * CHARS_PER_CHUNK
+    generation_start = time.perf_counter()
+    paths = []
+    for index in range(documents):
+        path = os.path.join(corpus_dir, f"doc_{index:06d}.txt")
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(generator.document(index, chars_per_document))
+        paths.append(path)
+    generation_seconds = time.perf_counter() - generation_start
+    corpus_bytes = sum(os.path.getsize(path) for path in paths)
+
+    database.init_db()
+    ingest_start = time.perf_counter()
+    failed = sum(1 for path in paths if database.ingest_document(path) is None)
+    ingest_seconds = time.perf_counter() - ingest_start
+    peak_rss_after_ingest = _peak_rss_bytes()
+
+    cursor = database.get_connection().cursor()
+    cursor.execute("SELECT COUNT(*) FROM chunks")
+    chunks = cursor.fetchone()[0]
+    shutil.rmtree(corpus_dir)
+    database.compact_database()
+
+    def reset_search_state():
+        # Ligação nova (cache de páginas do SQLite vazia), memmap dos vetores por abrir e
+        # cache de pesquisa vazia. A cache de ficheiros do sistema operativo fica quente.
+        database.close_connection()
+        database._vector_index = None
+        database.search_cache.clear()
+
+    queries = generator.queries(query_count)
+    latency = {}
+    for mode in modes:
+        # Fria: cada pergunta começa sem nenhum estado de pesquisa do processo
+        cold = []
+        for query in queries:
+            reset_search_state()
+            start = time.perf_counter()
+            database.search_knowledge_snippets(query, mode)
+            cold.append(time.perf_counter() - start)
+        # Morna: as mesmas perguntas, páginas do SQLite já em memória, sem cache de pesquisa
+        warm = []
+        for query in queries:
+            database.search_cache.clear()
+            start = time.perf_counter()
+            database.search_knowledge_snippets(query, mode)
+            warm.append(time.perf_counter() - start)
+        # Com cache: repetição servida pela cache de pesquisa (preenchida numa passagem prévia)
+        for query in queries:
+            database.search_knowledge_snippets(query, mode)
+        cached = []
+        for query in queries:
+            start = time.perf_counter()
+            database.search_knowledge_snippets(query, mode)
+            cached.append(time.perf_counter() - start)
+        latency[mode] = {"cold": _percentiles(cold), "warm": _percentiles(warm), "cached": _percentiles(cached)}
+
+    # Pico de memória Python de uma passagem sem cache (à parte, o tracemalloc atrasa as medições)
+    tracemalloc.start()
+    for mode in modes:
+        for query in queries:
+            database.search_cache.clear()
+            database.search_knowledge_snippets(query, mode)
+    _, query_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    storage = database.get_storage_report()
+    files = _data_files_bytes(data_dir)
+    return {
+        "target_chunks": size,
+        "chunks": chunks,
+        "documents": documents,
+        "failed_documents": failed,
+        "corpus_bytes": corpus_bytes,
+        "generation_seconds": generation_seconds,
+        "ingest": {
+            "seconds": ingest_seconds,
+            "chunks_per_second": chunks / ingest_seconds if ingest_seconds else None,
+            "mb_per_second": corpus_bytes / 1048576 / ingest_seconds if ingest_seconds else None,
+        },
+        "queries": len(queries),
+        "latency": latency,
+        "memory": {
+            "peak_rss_after_ingest_bytes": peak_rss_after_ingest,
+            "peak_rss_bytes": _peak_rss_bytes(),
+            "query_tracemalloc_peak_bytes": query_peak,
+        },
+        "storage": {"files_bytes": files, "total_bytes": sum(files.values()), "report": storage},
+    }
+
+
+# --- Orquestração e comparação ---
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_benchmark(sizes, query_count, seed, modes, keep_data=False):
+    results = []
+    for size in sizes:
+        data_dir = tempfile.mkdtemp(prefix=f"aitechexpert_bench_{size}_")
+        env = dict(os.environ, **{DATA_DIR_ENV_VAR: data_dir})
+        command = [
+            sys.executable, os.path.abspath(__file__), "--run-one", str(size),
+            "--queries", str(query_count), "--seed", str(seed), "--modes", ",".join(modes),
+        ]
+        print(f"A medir {size} fragmento(s)...", file=sys.stderr)
+        try:
+            completed = subprocess.run(command, env=env, capture_output=True, text=True)
+            if completed.returncode != 0:
+                print(completed.stderr, file=sys.stderr)
+                results.append({"target_chunks": size, "error": completed.stderr.strip().splitlines()[-1:]})
+                continue
+            results.append(json.loads(completed.stdout.strip().splitlines()[-1]))
+        finally:
+            if not keep_data:
+                shutil.rmtree(data_dir, ignore_errors=True)
+
+    return {
+        "meta": {
+            "benchmark": "retrieval",
+            "commit": _git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "seed": seed,
+            "queries": query_count,
+            "modes": list(modes),
+            "config": {
+                "CHUNK_MAX_TOKENS": CHUNK_MAX_TOKENS,
+                "CHUNK_OVERLAP_TOKENS": CHUNK_OVERLAP_TOKENS,
+                "SEARCH_CANDIDATE_LIMIT": SEARCH_CANDIDATE_LIMIT,
+            },
+        },
+        "results": results,
+    }
+
+
+def _comparable_metrics(result):
+    """Métricas principais de um resultado, como {nome: (valor, maior_é_melhor)}."""
+    metrics = {
+        "ingest.chunks_per_second": (result["ingest"]["chunks_per_second"], True),
+        "memory.peak_rss_bytes": (result["memory"]["peak_rss_bytes"], False),
+        "storage.total_bytes": (result["storage"]["total_bytes"], False),
+    }
+    for mode, phases in result["latency"].items():
+        for phase, summary in phases.items():
+            for name in ("p50_ms", "p95_ms"):
+                if name in summary:
+                    metrics[f"latency.{mode}.{phase}.{name}"] = (summary[name], False)
+    return metrics
+
+
+def compare(baseline, current):
+    """Imprime a variação de cada métrica principal face a um resultado anterior."""
+    baseline_by_size = {r["target_chunks"]: r for r in baseline["results"] if "error" not in r}
+    print(f"Comparação: {baseline['meta'].get('commit')} -> {current['meta'].get('commit')}")
+    for result in current["results"]:
+        previous = baseline_by_size.get(result["target_chunks"])
+        if previous is None or "error" in result:
+            continue
+        print(f"\n{result['target_chunks']} fragmento(s):")
+        previous_metrics = _comparable_metrics(previous)
+        for name, (value, higher_is_better) in _comparable_metrics(result).items():
+            old_value = previous_metrics.get(name, (None,))[0]
+            if not old_value or value is None:
+                continue
+            change = (value - old_value) / old_value * 100
+            better = change > 0 if higher_is_better else change < 0
+            marker = "melhor" if better else "pior" if abs(change) >= 5 else ""
+            print(f"  {name:40} {old_value:14.3f} -> {value:14.3f} ({change:+6.1f}%) {marker}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark da pesquisa e da ingestão na base de conhecimento.")
+    parser.add_argument("--sizes", default=",".join(map(str, DEFAULT_SIZES)),
+                        help="Tamanhos do corpus em fragmentos, separados por vírgulas (ex.: 1000,10000,1000000)")
+    parser.add_argument("--queries", type=int, default=DEFAULT_QUERIES, help="Perguntas por modo de pesquisa")
+    parser.add_argument("--seed", type=int, default=DEFAULT_SEED)
+    parser.add_argument("--modes", default=",".join(RETRIEVAL_MODES), help="Modos de pesquisa a medir")
+    parser.add_argument("--output", help="Ficheiro JSON onde guardar os resultados (por omissão, stdout)")
+    parser.add_argument("--compare", help="Resultado JSON anterior com que comparar")
+    parser.add_argument("--keep-data", action="store_true", help="Não apaga as pastas de dados temporárias")
+    parser.add_argument("--run-one", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    modes = [mode for mode in args.modes.split(",") if mode in RETRIEVAL_MODES]
+    if args.run_one is not None:
+        print(json.dumps(run_one(args.run_one, args.queries, args.seed, modes)))
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",") if size.strip()]
+    report = run_benchmark(sizes, args.queries, args.seed, modes, args.keep_data)
+    output = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output + "\n")
+        print(f"Resultados guardados em '{args.output}'.", file=sys.stderr)
+    else:
+        print(output)
+
+    if args.compare:
+        with open(args.compare, "r", encoding="utf-8") as f:
+            compare(json.load(f), report)
+
+
+if __name__ == "__main__":
+    main()
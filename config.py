@@ -8,6 +8,106 @@ SETTINGS_FILE = "settings.json"
 HISTORY_FILE = "history.txt"
 LOG_FILE = "app_log.log"
 MAX_HISTORY_TOKENS = 3000  # Estimativa de tokens para o histórico
+DATA_DIR_ENV_VAR = "AITECHEXPERT_DATA_DIR"  # Variável de ambiente que substitui a pasta de dados (ex.: benchmarks)
+
+# --- Ligações SQLite ---
+DB_BUSY_TIMEOUT_SECONDS = 30  # Tempo que uma escrita espera pelo lock de outra
+DB_MMAP_SIZE = 256 * 1024 * 1024  # Bytes da base de dados lidos via mmap
+DB_CACHE_SIZE_KB = 64 * 1024  # Cache de páginas por ligação
+
+# --- Fragmentação da Base de Conhecimento ---
+CHUNK_MAX_TOKENS = 256  # Tamanho máximo (estimado) de cada fragmento indexado
+CHUNK_OVERLAP_TOKENS = 32  # Sobreposição entre fragmentos consecutivos
+CHUNK_MIN_RATIO = 0.75  # A partir desta fração do máximo, o fragmento pode terminar numa fronteira de conteúdo
+CHUNK_BOUNDARY_DIVISOR = 16  # Uma palavra é fronteira quando crc32(palavra) % DIVISOR == 0
+INGEST_BATCH_CHUNKS = 256  # Fragmentos escritos por transação durante a ingestão
+INGEST_BATCH_PAGES = 50  # Páginas escritas por transação durante a ingestão
+TEXT_BLOCK_CHARS = 16384  # Tamanho de cada "página" lida de um ficheiro TXT
+DOCUMENT_COMPRESSION_LEVEL = 6  # Nível zlib do texto original guardado (0-9)
+INGEST_WORKERS = 0  # Processos de extração em paralelo (0 = número de CPUs)
+INGEST_FILE_TIMEOUT_SECONDS = 300  # Tempo máximo de extração de um único ficheiro
+INGEST_PROGRESS_INTERVAL_SECONDS = 0.1  # Intervalo mínimo entre atualizações de progresso
+SEARCH_CANDIDATE_LIMIT = 200  # Máximo de fragmentos candidatos avaliados por pesquisa
+
+# --- Ranking BM25 ---
+BM25_K1 = 1.2  # Saturação da frequência do termo
+BM25_B = 0.75  # Peso da normalização pelo comprimento do fragmento
+BM25_PREFIX_EXPANSIONS = 10  # Termos indexados considerados por cada palavra-chave (pesquisa por prefixo)
+
+# --- Pesquisa Semântica Local ---
+VECTOR_INDEX_FILE = "knowledge_base.vectors"  # Matriz float16 memory-mapped, ao lado da base de dados
+VECTOR_DIM = 384  # Dimensão dos vetores (feature hashing)
+RETRIEVAL_MODES = ("keyword", "semantic", "hybrid")
+RETRIEVAL_MODE = "keyword"  # Modo de pesquisa por omissão
+
+# --- Cache de Pesquisa ---
+SEARCH_CACHE_SIZE = 256  # Número máximo de pesquisas em cache
+SEARCH_CACHE_TTL_SECONDS = 600  # Validade de cada entrada
+
+# --- Cache de Respostas da IA ---
+RESPONSE_CACHE_MAX_ENTRIES = 5000  # Respostas guardadas (as menos usadas são removidas primeiro)
+RESPONSE_CACHE_TTL_SECONDS = 7 * 24 * 3600  # Validade de cada resposta guardada
+RESPONSE_CACHE_HISTORY_MESSAGES = 4  # Últimas mensagens do histórico que fazem parte da chave
+RESPONSE_CACHE_BYPASS_PROFILES = ()  # Perfis cujas respostas nunca são guardadas
+
+# --- Servidor ---
+GEMINI_REQUESTS_PER_MINUTE = 15  # Orçamento de pedidos ao modelo (ajustar ao plano da chave)
+GEMINI_TOKENS_PER_MINUTE = 1000000  # Orçamento de tokens de entrada por minuto
+CHAT_WAIT_TIMEOUT_SECONDS = 150  # Espera máxima de cada pedido pela resposta da IA (partilhada ou não)
+BATCH_CONCURRENCY = 4  # Perguntas de um lote respondidas em paralelo (por omissão)
+BATCH_MAX_CONCURRENCY = 16  # Limite do paralelismo que um pedido de lote pode pedir
+BATCH_MAX_ITEMS = 1000  # Perguntas por pedido a '/chat/batch'
+
+# --- Estimativa de Tokens ---
+TOKEN_ESTIMATE_CACHE_SIZE = 20000  # Linhas de prompt com contagem em cache
+TOKEN_ESTIMATE_SAFETY_MARGIN = 0.15  # Abaixo de (1 - margem) do limite, a estimativa local basta
+TOKEN_CALIBRATION_INTERVAL = 50  # Pedidos entre contagens reais (em segundo plano) para calibrar
+
+# --- Contexto do Prompt ---
+MAX_PROMPT_TOKENS = 1000000  # Limite seguro, um pouco abaixo do máximo real de 1,048,575
+CONTEXT_TOKEN_BUDGET = 2048  # Tokens máximos do contexto da base de conhecimento em cada prompt
+CONTEXT_CANDIDATES = 12  # Trechos pedidos à pesquisa, por ordem de relevância, antes de empacotar
+CONTEXT_MIN_SNIPPET_TOKENS = 40  # Abaixo disto não vale a pena incluir um trecho cortado
+
+# --- Histórico da Conversa ---
+HISTORY_SUMMARY_TOKENS = 1000  # Parte de MAX_HISTORY_TOKENS reservada ao resumo das mensagens antigas
+HISTORY_SUMMARY_LINE_TOKENS = 60  # Tokens máximos de cada mensagem antiga dentro do resumo
+HISTORY_SUMMARY_CACHE_SIZE = 512  # Resumos de conversas guardados para atualização incremental
+
+# --- Sessões de Chat ---
+SESSION_MEMORY_BUDGET_BYTES = 64 * 1024 * 1024  # Memória (estimada) para as sessões guardadas no servidor
+SESSION_IDLE_TTL_SECONDS = 2 * 3600  # Uma sessão sem pedidos durante este tempo é removida
+
+# --- Métricas ---
+METRICS_RECENT_SAMPLES = 2000  # Amostras recentes por etapa (e perfil) usadas nos percentis de '/metrics'
+METRICS_FLUSH_INTERVAL_SECONDS = 2.0  # Intervalo entre gravações do escritor de métricas em segundo plano
+METRICS_BATCH_SIZE = 500  # Registos gravados, no máximo, por transação
+METRICS_QUEUE_SIZE = 10000  # Registos à espera de gravação (acima disto são descartados)
+METRICS_RETENTION_DAYS = 30  # Métricas e etapas mais antigas do que isto são apagadas da base de dados
+METRICS_PRUNE_INTERVAL_SECONDS = 3600  # Intervalo entre limpezas das métricas antigas
+
+# --- Perfilagem de Pedidos ---
+PROFILING_ENABLED = False  # Perfila todos os pedidos a '/chat' (para uma sessão de diagnóstico)
+PROFILING_SAMPLE_RATE = 0.0  # Fração dos pedidos perfilados ao acaso (ex.: 0.01 em uso contínuo)
+PROFILING_MODE = "sampling"  # "sampling" (pilhas amostradas, formato collapsed) ou "cprofile" (pstats)
+PROFILING_SAMPLE_INTERVAL_SECONDS = 0.005  # Intervalo entre amostras do perfilador por amostragem
+PROFILING_HEADER = "X-Profile-Request"  # Cabeçalho que pede a perfilagem de um pedido ("1", "sampling" ou "cprofile")
+PROFILING_QUERY_FLAG = "profile_request"  # Parâmetro do URL com o mesmo efeito do cabeçalho
+PROFILES_DIR = "profiles"  # Pasta, nos dados do utilizador, onde os perfis são guardados
+PROFILING_MAX_FILES = 200  # Perfis guardados (os mais antigos são apagados)
+
+# --- Backend do Modelo ---
+MODEL_BACKEND = "gemini"  # "gemini" (API real) ou "fake" (modelo simulado, offline, para testes de carga)
+MODEL_BACKEND_ENV_VAR = "AITECHEXPERT_MODEL_BACKEND"  # Variável de ambiente que substitui MODEL_BACKEND
+FAKE_MODEL_LATENCY_SECONDS = 0.8  # Mediana da latência simulada de cada resposta
+FAKE_MODEL_LATENCY_SIGMA = 0.5  # Dispersão da latência (distribuição log-normal)
+FAKE_MODEL_STREAM_CHUNKS = 8  # Fragmentos de cada resposta simulada em streaming
+FAKE_MODEL_RESPONSE_WORDS = 120  # Palavras de cada resposta simulada
+FAKE_MODEL_MALFORMED_RATE = 0.0  # Fração das respostas simuladas com JSON inválido
+FAKE_MODEL_RATE_LIMIT_RATE = 0.0  # Fração das chamadas simuladas que falham com 429
+FAKE_MODEL_RATE_LIMIT_RETRY_SECONDS = 1.0  # Atraso indicado nesses 429
+FAKE_MODEL_QUOTA_PER_MINUTE = 0  # Quota simulada de pedidos por minuto (0 = sem quota)
+FAKE_MODEL_COUNT_TOKENS_SECONDS = 0.05  # Latência simulada de cada contagem de tokens
 
 # --- Perfis e Prompts da IA ---
 
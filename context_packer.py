@@ -0,0 +1,126 @@
+# /context_packer.py
+
+import re
+
+from config import (
+    MAX_PROMPT_TOKENS, MAX_HISTORY_TOKENS, CONTEXT_TOKEN_BUDGET, CONTEXT_MIN_SNIPPET_TOKENS
+)
+from database import format_snippet
+
+# Fim de frase: pontuação final seguida de espaço (os fragmentos têm os espaços normalizados)
+_SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s+')
+# Acrescentado ao conteúdo de um trecho cortado, para a IA saber que não está completo
+TRIM_MARKER = " [...]"
+SNIPPET_SEPARATOR = "\n\n"
+
+
+def trim_to_sentences(snippet, budget_tokens, count_tokens):
+    """
+    Corta o conteúdo do trecho na última fronteira de frase que deixa o bloco formatado
+    dentro de 'budget_tokens'. Retorna (bloco, tokens), ou (None, 0) se nem a primeira
+    frase couber. As frases são contadas uma a uma (o espaço entre elas não conta).
+    """
+    sentences = _SENTENCE_END_RE.split(snippet['content'])
+    overhead = count_tokens(format_snippet({**snippet, 'content': TRIM_MARKER.strip()}))
+    kept_count = 0
+    tokens = overhead
+    # A última "frase" é o conteúdo completo, que já se sabe não caber
+    for sentence in sentences[:-1]:
+        sentence_tokens = count_tokens(sentence)
+        if tokens + sentence_tokens > budget_tokens:
+            break
+        tokens += sentence_tokens
+        kept_count += 1
+
+    if kept_count == 0:
+        return None, 0
+    content = " ".join(sentences[:kept_count]) + TRIM_MARKER
+    return format_snippet({**snippet, 'content': content}), tokens
+
+
+def pack_context(snippets, budget_tokens, count_tokens, min_snippet_tokens=CONTEXT_MIN_SNIPPET_TOKENS):
+    """
+    Empacota os trechos (já ordenados do mais para o menos relevante) no orçamento de
+    tokens: cada trecho entra inteiro se couber; se não couber, entra cortado nas
+    fronteiras de frase, desde que a parte que cabe tenha pelo menos 'min_snippet_tokens'.
+    Um trecho que não cabe não impede que um seguinte, mais curto, entre.
+    Retorna um dict com 'text', 'tokens', 'included' e 'trimmed'.
+    """
+    separator_tokens = count_tokens(SNIPPET_SEPARATOR)
+    blocks = []
+    used_tokens = 0
+    trimmed = 0
+
+    for snippet in snippets:
+        remaining = budget_tokens - used_tokens - (separator_tokens if blocks else 0)
+        if remaining < min_snippet_tokens:
+            break
+
+        block = format_snippet(snippet)
+        block_tokens = count_tokens(block)
+        if block_tokens > remaining:
+            block, block_tokens = trim_to_sentences(snippet, remaining, count_tokens)
+            if block is None or block_tokens < min_snippet_tokens:
+                continue
+            trimmed += 1
+
+        if blocks:
+            used_tokens += separator_tokens
+        blocks.append(block)
+        used_tokens += block_tokens
+
+    return {
+        "text": SNIPPET_SEPARATOR.join(blocks),
+        "tokens": used_tokens,
+        "included": len(blocks),
+        "trimmed": trimmed,
+    }
+
+
+def trim_history(history, budget_tokens, count_tokens):
+    """Mantém as linhas mais recentes do histórico que cabem em 'budget_tokens'. Retorna (texto, tokens)."""
+    if not history or budget_tokens <= 0:
+        return "", 0
+    kept = []
+    used_tokens = 0
+    for line in reversed(history.split("\n")):
+        # Cada linha conta mais um token pela quebra de linha (como em TokenEstimator.count_raw)
+        line_tokens = count_tokens(line) + 1
+        if used_tokens + line_tokens > budget_tokens:
+            break
+        kept.append(line)
+        used_tokens += line_tokens
+    return "\n".join(reversed(kept)), used_tokens
+
+
+def pack_prompt(instructions_tokens, prompt_tokens, history, snippets, count_tokens,
+                max_tokens=MAX_PROMPT_TOKENS, history_budget=MAX_HISTORY_TOKENS,
+                context_budget=CONTEXT_TOKEN_BUDGET):
+    """
+    Distribui o orçamento de tokens do prompt pelas suas secções, para que seja construído
+    à primeira dentro do limite. As instruções (perfil e modelo do prompt) e a pergunta
+    são fixas; o histórico fica com as mensagens mais recentes até 'history_budget'; o
+    contexto da base de conhecimento fica com o que sobra, até 'context_budget'.
+    Retorna um dict com 'history', 'knowledge_context', 'snippets_included',
+    'snippets_trimmed' e 'token_usage' (tokens estimados por secção e 'total').
+    """
+    fixed_tokens = instructions_tokens + prompt_tokens
+    history_text, history_tokens = trim_history(
+        history, min(history_budget, max_tokens - fixed_tokens), count_tokens
+    )
+    packed = pack_context(
+        snippets, min(context_budget, max_tokens - fixed_tokens - history_tokens), count_tokens
+    )
+    return {
+        "history": history_text,
+        "knowledge_context": packed["text"],
+        "snippets_included": packed["included"],
+        "snippets_trimmed": packed["trimmed"],
+        "token_usage": {
+            "instructions": instructions_tokens,
+            "prompt": prompt_tokens,
+            "history": history_tokens,
+            "knowledge_context": packed["tokens"],
+            "total": fixed_tokens + history_tokens + packed["tokens"],
+        },
+    }
@@ -3,14 +3,31 @@
 import sqlite3
 import os
 import sys
+import threading
+from contextlib import contextmanager
 from datetime import datetime
 import logging
-from functools import lru_cache
 import PyPDF2
 import json
 import re
+import math
+import zlib
+import hashlib
+import unicodedata
+from collections import Counter
 
-from config import DB_NAME, HISTORY_FILE, LOG_FILE
+from config import (
+    DB_NAME, HISTORY_FILE, LOG_FILE, DATA_DIR_ENV_VAR,
+    DB_BUSY_TIMEOUT_SECONDS, DB_MMAP_SIZE, DB_CACHE_SIZE_KB,
+    CHUNK_MAX_TOKENS, CHUNK_OVERLAP_TOKENS, CHUNK_MIN_RATIO, CHUNK_BOUNDARY_DIVISOR,
+    SEARCH_CANDIDATE_LIMIT,
+    INGEST_BATCH_CHUNKS, INGEST_BATCH_PAGES, TEXT_BLOCK_CHARS, DOCUMENT_COMPRESSION_LEVEL,
+    BM25_K1, BM25_B, BM25_PREFIX_EXPANSIONS,
+    VECTOR_INDEX_FILE, RETRIEVAL_MODE, RETRIEVAL_MODES,
+    SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL_SECONDS
+)
+from vector_index import VectorIndex, embed_terms
+from search_cache import SearchCache
 
 # --- Configuração de Logging ---
 def setup_logging():
@@ -25,212 +42,1130 @@ def setup_logging():
     )
 
 def get_user_data_path(file_name):
-    """Obtém caminho seguro para armazenamento de dados do utilizador."""
-    home = os.path.expanduser("~")
-    app_name = "AITechExpert"
-    app_support_path = os.path.join(home, app_name)
+    """
+    Obtém caminho seguro para armazenamento de dados do utilizador. A pasta pode ser
+    substituída pela variável de ambiente DATA_DIR_ENV_VAR (ex.: para benchmarks).
+    """
+    app_support_path = os.environ.get(DATA_DIR_ENV_VAR)
+    if not app_support_path:
+        home = os.path.expanduser("~")
+        app_name = "AITechExpert"
+        app_support_path = os.path.join(home, app_name)
     os.makedirs(app_support_path, exist_ok=True)
     return os.path.join(app_support_path, file_name)
 
+# --- Fragmentação de Documentos ---
+def estimate_tokens(text):
+    """Estimativa rápida de tokens (aprox. 4 caracteres por token)."""
+    return max(1, len(text) // 4)
+
+def _is_chunk_boundary(word):
+    return zlib.crc32(word.encode('utf-8')) % CHUNK_BOUNDARY_DIVISOR == 0
+
+def iter_chunks(texts, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Gera janelas sobrepostas limitadas por tokens a partir de uma sequência de textos
+    (por exemplo, páginas), com o espaço em branco normalizado. As janelas atravessam os
+    limites entre textos e só é mantida em memória a janela atual.
+
+    Depois de atingir CHUNK_MIN_RATIO do tamanho máximo, uma janela termina na primeira
+    palavra-fronteira (definida pelo conteúdo). Assim, uma edição num documento só altera
+    os fragmentos à sua volta: as fronteiras seguintes voltam a coincidir com as anteriores.
+    Gera tuplos (texto, estimativa_de_tokens).
+    """
+    min_tokens = int(max_tokens * CHUNK_MIN_RATIO)
+    words = []
+    word_tokens = []
+    buffered_tokens = 0
+    has_new_words = False
+    for text in texts:
+        for word in text.split():
+            tokens = estimate_tokens(word + " ")
+            words.append(word)
+            word_tokens.append(tokens)
+            buffered_tokens += tokens
+            has_new_words = True
+            if buffered_tokens < max_tokens and not (
+                buffered_tokens >= min_tokens and _is_chunk_boundary(word)
+            ):
+                continue
+
+            chunk = " ".join(words)
+            yield chunk, estimate_tokens(chunk)
+
+            # Mantém as últimas palavras para que a próxima janela se sobreponha a esta
+            keep = 0
+            kept_tokens = 0
+            while keep < len(words) - 1 and kept_tokens < overlap_tokens:
+                keep += 1
+                kept_tokens += word_tokens[-keep]
+            words = words[len(words) - keep:]
+            word_tokens = word_tokens[len(word_tokens) - keep:]
+            buffered_tokens = kept_tokens
+            has_new_words = False
+
+    if has_new_words:
+        chunk = " ".join(words)
+        yield chunk, estimate_tokens(chunk)
+
+def split_into_chunks(text, max_tokens=CHUNK_MAX_TOKENS, overlap_tokens=CHUNK_OVERLAP_TOKENS):
+    """
+    Divide o texto em janelas sobrepostas limitadas por tokens. Não depende de linhas
+    em branco, pelo que funciona com o texto do PyPDF2.
+    Retorna uma lista de tuplos (texto, estimativa_de_tokens).
+    """
+    return list(iter_chunks([text], max_tokens, overlap_tokens))
+
+def hash_text(text):
+    """Hash do conteúdo de um texto (identifica fragmentos e documentos repetidos)."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+def file_content_hash(file_path):
+    """Hash do conteúdo de um ficheiro, lido em blocos para não o carregar todo em memória."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def compress_text(text):
+    """Comprime o texto original de uma página para guardar na base de dados."""
+    return zlib.compress(text.encode('utf-8'), DOCUMENT_COMPRESSION_LEVEL)
+
+def decompress_text(data):
+    """Inverso de 'compress_text'. Aceita também texto ainda não migrado."""
+    if isinstance(data, str):
+        return data
+    return zlib.decompress(data).decode('utf-8')
+
+def tokenize_terms(text):
+    """
+    Converte o texto nos termos usados pelo índice (minúsculas, sem acentos), seguindo
+    as mesmas regras do tokenizador 'unicode61 remove_diacritics' do FTS5.
+    """
+    decomposed = unicodedata.normalize('NFKD', text.lower())
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return re.findall(r'[^\W_]+', stripped)
+
+# --- Gestão de Ligações ---
+_db_path = None
+_thread_local = threading.local()
+
+def _get_db_path():
+    global _db_path
+    if _db_path is None:
+        _db_path = get_user_data_path(DB_NAME)
+    return _db_path
+
+def get_connection():
+    """
+    Devolve a ligação SQLite da thread atual, criando-a na primeira utilização.
+    As ligações vivem enquanto a thread viver e usam WAL, para que as leituras
+    (servidor, interface) não fiquem bloqueadas por uma ingestão em curso.
+    """
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(_get_db_path(), timeout=DB_BUSY_TIMEOUT_SECONDS)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+        conn.execute(f"PRAGMA cache_size=-{int(DB_CACHE_SIZE_KB)}")
+        conn.execute("PRAGMA temp_store=MEMORY")
+        _thread_local.conn = conn
+    return conn
+
+def close_connection():
+    """Fecha a ligação da thread atual (útil para threads de trabalho de longa duração)."""
+    conn = getattr(_thread_local, 'conn', None)
+    if conn is not None:
+        conn.close()
+        _thread_local.conn = None
+
+@contextmanager
+def transaction():
+    """
+    Executa um bloco numa transação da ligação da thread, com rollback em caso de erro.
+    As alterações a ficheiros registadas com '_after_commit' só são feitas depois do commit.
+    """
+    conn = get_connection()
+    _thread_local.after_commit = []
+    try:
+        yield conn.cursor()
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        _thread_local.after_commit = None
+        raise
+    callbacks, _thread_local.after_commit = _thread_local.after_commit, None
+    for callback in callbacks:
+        try:
+            callback()
+        except Exception as e:
+            logging.error(f"Erro ao aplicar uma alteração após o commit: {e}")
+
+def _after_commit(callback):
+    """Adia 'callback' até ao commit da transação em curso (fora de uma transação, corre já)."""
+    callbacks = getattr(_thread_local, 'after_commit', None)
+    if callbacks is None:
+        callback()
+    else:
+        callbacks.append(callback)
+
+# --- Geração da Base de Conhecimento ---
+_kb_generation = 0
+_generation_lock = threading.Lock()
+search_cache = SearchCache(SEARCH_CACHE_SIZE, SEARCH_CACHE_TTL_SECONDS)
+
+def get_kb_generation():
+    """Contador incrementado por cada escrita na base de conhecimento."""
+    return _kb_generation
+
+def _bump_kb_generation():
+    global _kb_generation
+    with _generation_lock:
+        _kb_generation += 1
+
 # --- Funções do Banco de Dados ---
-def init_db():
-    """Inicializa o banco de dados SQLite com as tabelas 'documents' e 'metrics'."""
-    db_path = get_user_data_path(DB_NAME)
+FTS_AVAILABLE = False  # Definido em init_db consoante o suporte a FTS5 do SQLite
+_vector_index = None
+
+def get_vector_index():
+    """Devolve o índice vetorial local, guardado ao lado de 'knowledge_base.db'."""
+    global _vector_index
+    if _vector_index is None:
+        _vector_index = VectorIndex(get_user_data_path(VECTOR_INDEX_FILE))
+    return _vector_index
+
+def _update_term_stats(cursor, df_delta, chunk_delta, terms_delta):
+    """
+    Aplica incrementalmente as alterações às estatísticas do BM25: frequência de
+    documentos por termo ('term_stats'), número de fragmentos e total de termos ('kb_stats').
+    """
+    increments = [(term, df) for term, df in df_delta.items() if df > 0]
+    decrements = [(-df, term) for term, df in df_delta.items() if df < 0]
+    if increments:
+        cursor.executemany(
+            "INSERT INTO term_stats (term, df) VALUES (?, ?) "
+            "ON CONFLICT(term) DO UPDATE SET df = df + excluded.df",
+            increments
+        )
+    if decrements:
+        cursor.executemany("UPDATE term_stats SET df = df - ? WHERE term = ?", decrements)
+        cursor.executemany(
+            "DELETE FROM term_stats WHERE term = ? AND df <= 0",
+            [(term,) for _, term in decrements]
+        )
+    cursor.executemany(
+        "INSERT INTO kb_stats (key, value) VALUES (?, ?) "
+        "ON CONFLICT(key) DO UPDATE SET value = value + excluded.value",
+        [('chunk_count', chunk_delta), ('total_terms', terms_delta)]
+    )
+
+def _insert_chunk_rows(cursor, doc_id, chunks):
+    """
+    Insere fragmentos já calculados, dados como tuplos (ordinal, texto, tokens, hash), e
+    atualiza o índice vetorial e as estatísticas do BM25.
+    """
+    rows = []
+    vectors = []
+    df_delta = Counter()
+    total_terms = 0
+    for ordinal, chunk, tokens, chunk_hash in chunks:
+        terms = tokenize_terms(chunk)
+        df_delta.update(set(terms))
+        total_terms += len(terms)
+        vectors.append(embed_terms(terms))
+        rows.append([doc_id, ordinal, chunk, tokens, len(terms), chunk_hash])
+
+    # Os vetores são calculados uma única vez, na ingestão, e só escritos no ficheiro
+    # depois do commit (num rollback, as linhas reservadas ficam a zero)
+    index = get_vector_index()
+    first_row = index.reserve(len(vectors))
+    for offset, row in enumerate(rows):
+        row.append(first_row + offset)
+    _after_commit(lambda: index.write_rows(first_row, vectors))
+
+    cursor.executemany(
+        "INSERT INTO chunks (doc_id, ordinal, text, token_estimate, term_count, chunk_hash, vector_row) "
+        "VALUES (?, ?, ?, ?, ?, ?, ?)",
+        rows
+    )
+    _update_term_stats(cursor, df_delta, len(rows), total_terms)
+    return len(rows)
+
+def _insert_chunks(cursor, doc_id, content):
+    """Fragmenta o conteúdo e insere os fragmentos do documento na tabela 'chunks'."""
+    chunks = [
+        (ordinal, chunk, tokens, hash_text(chunk))
+        for ordinal, (chunk, tokens) in enumerate(split_into_chunks(content))
+    ]
+    return _insert_chunk_rows(cursor, doc_id, chunks)
+
+def _forget_chunks(cursor, chunk_ids):
+    """
+    Remove fragmentos, retirando-os antes das estatísticas do BM25 e do índice vetorial
+    (as linhas do índice só são zeradas depois do commit).
+    """
+    df_delta = Counter()
+    chunk_count = 0
+    total_terms = 0
+    vector_rows = []
+    chunk_ids = list(chunk_ids)
+    for start in range(0, len(chunk_ids), 500):
+        batch = chunk_ids[start:start + 500]
+        placeholders = ", ".join("?" for _ in batch)
+        cursor.execute(
+            f"SELECT text, term_count, vector_row FROM chunks WHERE id IN ({placeholders})",
+            batch
+        )
+        for text, term_count, vector_row in cursor.fetchall():
+            df_delta.subtract(set(tokenize_terms(text)))
+            chunk_count += 1
+            total_terms += term_count
+            vector_rows.append(vector_row)
+        cursor.execute(f"DELETE FROM chunks WHERE id IN ({placeholders})", batch)
+    _update_term_stats(cursor, df_delta, -chunk_count, -total_terms)
+    index = get_vector_index()
+    _after_commit(lambda: index.clear_rows(vector_rows))
+
+def _forget_document_chunks(cursor, doc_id):
+    """Remove todos os fragmentos de um documento prestes a ser removido."""
+    cursor.execute("SELECT id FROM chunks WHERE doc_id = ?", (doc_id,))
+    _forget_chunks(cursor, [chunk_id for (chunk_id,) in cursor.fetchall()])
+
+def _ensure_column(cursor, table, column, declaration):
+    """Migração: acrescenta uma coluna a uma tabela existente, se ainda não existir."""
+    cursor.execute(f"PRAGMA table_info({table})")
+    if column not in [row[1] for row in cursor.fetchall()]:
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+        return True
+    return False
+
+def _rebuild_term_stats(cursor):
+    """
+    Migração única: calcula o comprimento de cada fragmento existente e as estatísticas
+    do BM25. Depois disso, as estatísticas são apenas atualizadas incrementalmente.
+    """
+    cursor.execute("DELETE FROM term_stats")
+    cursor.execute("DELETE FROM kb_stats")
+    cursor.execute("SELECT id, text FROM chunks")
+    df_delta = Counter()
+    lengths = []
+    for chunk_id, text in cursor.fetchall():
+        terms = tokenize_terms(text)
+        df_delta.update(set(terms))
+        lengths.append((len(terms), chunk_id))
+    cursor.executemany("UPDATE chunks SET term_count = ? WHERE id = ?", lengths)
+    _update_term_stats(cursor, df_delta, len(lengths), sum(length for length, _ in lengths))
+    if lengths:
+        logging.info(f"Estatísticas BM25 calculadas para {len(lengths)} fragmento(s) existente(s).")
+
+def _init_chunks(cursor):
+    """
+    Cria a tabela 'chunks' e as tabelas de estatísticas do BM25, e fragmenta os documentos
+    que ainda não tenham fragmentos (migração de bases de dados criadas antes da fragmentação).
+    """
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS chunks (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            doc_id INTEGER NOT NULL REFERENCES documents(id),
+            ordinal INTEGER NOT NULL,
+            text TEXT NOT NULL,
+            token_estimate INTEGER NOT NULL,
+            term_count INTEGER NOT NULL DEFAULT 0,
+            chunk_hash TEXT,
+            vector_row INTEGER
+        )
+    """)
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_doc ON chunks(doc_id, ordinal)")
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS term_stats (
+            term TEXT PRIMARY KEY,
+            df INTEGER NOT NULL
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS kb_stats (
+            key TEXT PRIMARY KEY,
+            value REAL NOT NULL
+        )
+    """)
+
+    _ensure_column(cursor, 'chunks', 'term_count', "INTEGER NOT NULL DEFAULT 0")
+    _ensure_column(cursor, 'chunks', 'vector_row', "INTEGER")
+    if _ensure_column(cursor, 'chunks', 'chunk_hash', "TEXT"):
+        cursor.execute("SELECT id, text FROM chunks")
+        cursor.executemany(
+            "UPDATE chunks SET chunk_hash = ? WHERE id = ?",
+            [(hash_text(text), chunk_id) for chunk_id, text in cursor.fetchall()]
+        )
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_vector_row ON chunks(vector_row)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_chunks_hash ON chunks(doc_id, chunk_hash)")
+
+    cursor.execute("SELECT 1 FROM kb_stats WHERE key = 'chunk_count'")
+    if cursor.fetchone() is None:
+        _rebuild_term_stats(cursor)
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS documents_chunks_ad AFTER DELETE ON documents BEGIN
+            DELETE FROM chunks WHERE doc_id = old.id;
+        END
+    """)
+
+    cursor.execute("""
+        SELECT id, content FROM documents
+        WHERE NOT EXISTS (SELECT 1 FROM chunks WHERE chunks.doc_id = documents.id)
+    """)
+    pending = cursor.fetchall()
+    for doc_id, content in pending:
+        _insert_chunks(cursor, doc_id, content)
+    if pending:
+        logging.info(f"{len(pending)} documento(s) existente(s) fragmentado(s) na migração.")
+
+    _init_vector_index(cursor)
+
+def _init_vector_index(cursor):
+    """
+    Reconstrói o ficheiro de vetores quando há fragmentos sem vetor (migração), quando o
+    ficheiro não corresponde à base de dados, ou quando mais de metade das linhas foram removidas.
+    """
+    index = get_vector_index()
+    cursor.execute("SELECT COUNT(*), COUNT(vector_row), MAX(vector_row) FROM chunks")
+    total_chunks, with_vectors, max_row = cursor.fetchone()
+    file_rows = index.row_count()
+    missing_rows = max_row is not None and max_row >= file_rows
+    if total_chunks == with_vectors and not missing_rows and file_rows <= 2 * max(total_chunks, 1):
+        return
+
+    chunk_ids = []
+
+    def iter_vectors():
+        # Percorre o cursor sem carregar todo o texto da base em memória
+        for chunk_id, text in cursor.execute("SELECT id, text FROM chunks ORDER BY id"):
+            chunk_ids.append(chunk_id)
+            yield embed_terms(tokenize_terms(text))
+
+    tmp_path = index.write_replacement(iter_vectors())
+    _after_commit(lambda: index.install_replacement(tmp_path))
+    cursor.executemany(
+        "UPDATE chunks SET vector_row = ? WHERE id = ?",
+        [(row, chunk_id) for row, chunk_id in enumerate(chunk_ids)]
+    )
+    logging.info(f"Índice vetorial reconstruído com {len(chunk_ids)} fragmento(s).")
+
+def _init_fts_index(cursor):
+    """
+    Cria o índice invertido FTS5 sobre a tabela 'chunks', mantido em sincronia
+    por triggers. Se o índice ainda não existia, faz o backfill dos fragmentos atuais.
+    """
+    global FTS_AVAILABLE
+    # O índice antigo sobre o texto integral dos documentos foi substituído pelo dos fragmentos.
+    # Sem 'executescript', que faria commit a meio da migração de 'init_db'
+    cursor.execute("DROP TRIGGER IF EXISTS documents_fts_ai")
+    cursor.execute("DROP TRIGGER IF EXISTS documents_fts_ad")
+    cursor.execute("DROP TRIGGER IF EXISTS documents_fts_au")
+    cursor.execute("DROP TABLE IF EXISTS documents_fts")
+
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chunks_fts'")
+    needs_backfill = cursor.fetchone() is None
     try:
-        conn = sqlite3.connect(db_path)
-        cursor = conn.cursor()
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS documents (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                filename TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TEXT NOT NULL
-            )
-        """)
         cursor.execute("""
-            CREATE TABLE IF NOT EXISTS metrics (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp TEXT NOT NULL,
-                response_time REAL,
-                used_knowledge_base BOOLEAN,
-                profile_used TEXT
+            CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(
+                text,
+                content='chunks',
+                content_rowid='id',
+                tokenize='unicode61 remove_diacritics 2'
             )
         """)
-        conn.commit()
-        logging.info(f"Banco de dados inicializado em: {db_path}")
+    except sqlite3.OperationalError as e:
+        FTS_AVAILABLE = False
+        logging.warning(f"FTS5 não disponível neste SQLite ({e}). A pesquisa usará LIKE.")
+        return
+
+    # Expõe as ocorrências de cada termo por fragmento (frequência do termo para o BM25)
+    cursor.execute("CREATE VIRTUAL TABLE IF NOT EXISTS chunks_vocab USING fts5vocab(chunks_fts, 'instance')")
+
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_ai AFTER INSERT ON chunks BEGIN
+            INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+        END
+    """)
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS chunks_fts_ad AFTER DELETE ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+        END
+    """)
+    cursor.execute("DROP TRIGGER IF EXISTS chunks_fts_au")
+    cursor.execute("""
+        CREATE TRIGGER chunks_fts_au AFTER UPDATE OF text ON chunks BEGIN
+            INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.id, old.text);
+            INSERT INTO chunks_fts(rowid, text) VALUES (new.id, new.text);
+        END
+    """)
+
+    if needs_backfill:
+        # Migração: indexa os fragmentos que já existiam antes do índice
+        cursor.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        logging.info("Índice FTS5 criado e preenchido com os fragmentos existentes.")
+    FTS_AVAILABLE = True
+
+def _compress_document_storage(cursor):
+    """
+    Migração: move o texto integral ainda guardado em 'documents.content' para páginas
+    comprimidas e comprime as páginas gravadas como texto. Só os fragmentos indexados
+    ficam por comprimir. Retorna o número de bytes de texto migrados (0 se nada mudou).
+    """
+    raw_bytes = 0
+    stored_bytes = 0
+
+    cursor.execute("SELECT id FROM documents WHERE content != ''")
+    for (doc_id,) in cursor.fetchall():
+        cursor.execute("SELECT content FROM documents WHERE id = ?", (doc_id,))
+        text = cursor.fetchone()[0]
+        compressed = compress_text(text)
+        raw_bytes += len(text.encode('utf-8'))
+        stored_bytes += len(compressed)
+        cursor.execute(
+            "INSERT OR REPLACE INTO document_pages (doc_id, page_number, content) VALUES (?, 1, ?)",
+            (doc_id, compressed)
+        )
+        cursor.execute("UPDATE documents SET content = '' WHERE id = ?", (doc_id,))
+
+    cursor.execute("SELECT doc_id, page_number FROM document_pages WHERE typeof(content) = 'text'")
+    for doc_id, page_number in cursor.fetchall():
+        cursor.execute(
+            "SELECT content FROM document_pages WHERE doc_id = ? AND page_number = ?",
+            (doc_id, page_number)
+        )
+        text = cursor.fetchone()[0]
+        compressed = compress_text(text)
+        raw_bytes += len(text.encode('utf-8'))
+        stored_bytes += len(compressed)
+        cursor.execute(
+            "UPDATE document_pages SET content = ? WHERE doc_id = ? AND page_number = ?",
+            (compressed, doc_id, page_number)
+        )
+
+    if raw_bytes:
+        logging.info(
+            f"Texto dos documentos comprimido na migração: {raw_bytes / 1048576:.1f} MB -> "
+            f"{stored_bytes / 1048576:.1f} MB ({100 * (1 - stored_bytes / raw_bytes):.0f}% poupado)."
+        )
+    return raw_bytes
+
+def _iter_document_pages(cursor, doc_id):
+    """Gera o texto descomprimido de cada página de um documento, pela ordem."""
+    cursor.execute("SELECT content FROM document_pages WHERE doc_id = ? ORDER BY page_number", (doc_id,))
+    for (page,) in cursor:
+        yield decompress_text(page)
+
+def _backfill_text_hashes(cursor):
+    """
+    Migração: calcula o 'text_hash' (hash do texto extraído) dos documentos importados
+    antes de existir, para que uma nova importação do mesmo texto seja reconhecida.
+    """
+    cursor.execute("SELECT id FROM documents WHERE text_hash IS NULL")
+    doc_ids = [doc_id for (doc_id,) in cursor.fetchall()]
+    for doc_id in doc_ids:
+        digest = hashlib.sha256()
+        for index, text in enumerate(_iter_document_pages(cursor, doc_id)):
+            digest.update((("\n" if index else "") + text).encode('utf-8'))
+        cursor.execute("UPDATE documents SET text_hash = ? WHERE id = ?", (digest.hexdigest(), doc_id))
+    if doc_ids:
+        logging.info(f"Hash do texto calculado para {len(doc_ids)} documento(s) já existentes.")
+
+def get_storage_report():
+    """
+    Relatório do espaço ocupado: texto original (descomprimido e guardado), fragmentos
+    indexados e tamanho da base de dados em disco (incluindo o WAL), em bytes.
+    """
+    db_path = _get_db_path()
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT COUNT(*), COALESCE(SUM(length(content)), 0) FROM document_pages")
+    page_count, stored_bytes = cursor.fetchone()
+    raw_bytes = 0
+    cursor.execute("SELECT content FROM document_pages")
+    for (content,) in cursor:
+        raw_bytes += len(decompress_text(content).encode('utf-8'))
+    cursor.execute("SELECT COALESCE(SUM(length(CAST(text AS BLOB))), 0) FROM chunks")
+    chunk_bytes = cursor.fetchone()[0]
+    return {
+        "pages": page_count,
+        "document_text_bytes": raw_bytes,
+        "document_stored_bytes": stored_bytes,
+        "saved_bytes": raw_bytes - stored_bytes,
+        "chunk_text_bytes": chunk_bytes,
+        "database_file_bytes": sum(
+            os.path.getsize(path) for path in (db_path, db_path + "-wal", db_path + "-shm") if os.path.exists(path)
+        ),
+    }
+
+def compact_database():
+    """
+    Executa VACUUM para devolver ao sistema o espaço libertado (por exemplo, após a
+    migração para texto comprimido). Retorna (tamanho_antes, tamanho_depois) em bytes.
+    """
+    db_path = _get_db_path()
+    conn = get_connection()
+    try:
+        # Passa o WAL para o ficheiro principal para que os tamanhos medidos sejam reais
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        size_before = os.path.getsize(db_path)
+        conn.execute("VACUUM")
+        conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+    except sqlite3.Error as e:
+        logging.error(f"Erro ao compactar a base de dados: {e}")
+        size = os.path.getsize(db_path)
+        return size, size
+    size_after = os.path.getsize(db_path)
+    logging.info(
+        f"Base de dados compactada: {size_before / 1048576:.1f} MB -> {size_after / 1048576:.1f} MB."
+    )
+    return size_before, size_after
+
+def init_db():
+    """
+    Inicializa o banco de dados SQLite com as tabelas 'documents', 'document_pages',
+    'chunks', 'metrics', 'metric_spans' e 'response_cache'.
+    """
+    try:
+        with transaction() as cursor:
+            # O módulo sqlite3 só abre a transação antes de INSERT/UPDATE/DELETE: sem este
+            # BEGIN, as alterações ao esquema seriam gravadas uma a uma
+            cursor.execute("BEGIN")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS documents (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    filename TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    content_hash TEXT,
+                    text_hash TEXT,
+                    source_path TEXT
+                )
+            """)
+            _ensure_column(cursor, 'documents', 'content_hash', "TEXT")
+            _ensure_column(cursor, 'documents', 'text_hash', "TEXT")
+            _ensure_column(cursor, 'documents', 'source_path', "TEXT")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_hash ON documents(content_hash)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_text_hash ON documents(text_hash)")
+            cursor.execute("DROP INDEX IF EXISTS idx_documents_filename")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_documents_source_path ON documents(source_path)")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS document_pages (
+                    doc_id INTEGER NOT NULL REFERENCES documents(id),
+                    page_number INTEGER NOT NULL,
+                    content BLOB NOT NULL,
+                    PRIMARY KEY (doc_id, page_number)
+                )
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS documents_pages_ad AFTER DELETE ON documents BEGIN
+                    DELETE FROM document_pages WHERE doc_id = old.id;
+                END
+            """)
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS metrics (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp TEXT NOT NULL,
+                    response_time REAL,
+                    used_knowledge_base BOOLEAN,
+                    profile_used TEXT,
+                    time_to_first_token REAL
+                )
+            """)
+            _ensure_column(cursor, 'metrics', 'time_to_first_token', "REAL")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS metric_spans (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    timestamp REAL NOT NULL,
+                    stage TEXT NOT NULL,
+                    profile TEXT,
+                    duration REAL NOT NULL
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_metric_spans_stage ON metric_spans(stage, timestamp)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_metric_spans_timestamp ON metric_spans(timestamp)")
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS response_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    profile TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    last_hit_at REAL NOT NULL,
+                    hit_count INTEGER NOT NULL DEFAULT 0
+                )
+            """)
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_response_cache_last_hit ON response_cache(last_hit_at)")
+            _init_chunks(cursor)
+            _init_fts_index(cursor)
+            migrated_bytes = _compress_document_storage(cursor)
+            _backfill_text_hashes(cursor)
+        _bump_kb_generation()
+        if migrated_bytes:
+            compact_database()
+        logging.info(f"Banco de dados inicializado em: {_get_db_path()}")
     except sqlite3.Error as e:
         logging.error(f"Erro ao inicializar o banco de dados: {e}")
-    finally:
-        if conn:
-            conn.close()
 
 
-def log_metric(response_time, used_knowledge_base, profile_used):
-    """Registra uma métrica de uso no banco de dados."""
-    db_path = get_user_data_path(DB_NAME)
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    try:
+def write_metrics_batch(request_rows, span_rows):
+    """
+    Grava de uma vez, numa só transação, as métricas acumuladas pelo escritor em segundo
+    plano ('metrics.py'): linhas (timestamp, response_time, used_knowledge_base,
+    profile_used, time_to_first_token) e etapas (timestamp, stage, profile, duration).
+    """
+    with transaction() as cursor:
+        if request_rows:
+            cursor.executemany(
+                "INSERT INTO metrics (timestamp, response_time, used_knowledge_base, profile_used, time_to_first_token) VALUES (?, ?, ?, ?, ?)",
+                request_rows
+            )
+        if span_rows:
+            cursor.executemany(
+                "INSERT INTO metric_spans (timestamp, stage, profile, duration) VALUES (?, ?, ?, ?)",
+                span_rows
+            )
+
+def prune_metrics(max_age_seconds):
+    """Apaga as métricas e etapas mais antigas do que 'max_age_seconds'. Retorna o número de linhas apagadas."""
+    cutoff = datetime.now().timestamp() - max_age_seconds
+    with transaction() as cursor:
+        cursor.execute("DELETE FROM metric_spans WHERE timestamp < ?", (cutoff,))
+        deleted = cursor.rowcount
         cursor.execute(
-            "INSERT INTO metrics (timestamp, response_time, used_knowledge_base, profile_used) VALUES (?, ?, ?, ?)",
-            (timestamp, response_time, used_knowledge_base, profile_used)
+            "DELETE FROM metrics WHERE timestamp < ?",
+            (datetime.fromtimestamp(cutoff).strftime("%Y-%m-%d %H:%M:%S"),)
         )
-        conn.commit()
-    except Exception as e:
-        logging.error(f"Erro ao registrar métrica: {e}")
-    finally:
-        conn.close()
+        return deleted + cursor.rowcount
+
+def find_document_by_hash(content_hash):
+    """Devolve o ID de um documento já importado com este conteúdo, ou None."""
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT id FROM documents WHERE content_hash = ? LIMIT 1", (content_hash,))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def ingest_document(file_path, progress_callback=None):
+    """
+    Ingestão em streaming: extrai o ficheiro página a página e grava as páginas e os
+    fragmentos em transações por lotes, à medida que são produzidos. A memória usada fica
+    limitada a uma página e a um lote de fragmentos, independentemente do tamanho do ficheiro.
+    'progress_callback(pagina, total_paginas)' é chamado após cada página.
+    Retorna o ID do documento, ou None em caso de falha.
+    """
+    try:
+        content_hash = file_content_hash(file_path)
+    except OSError as e:
+        logging.error(f"Erro ao ler '{os.path.basename(file_path)}': {e}")
+        return None
+    return ingest_pages(
+        os.path.basename(file_path),
+        iter_pages_from_file(file_path),
+        progress_callback,
+        content_hash=content_hash,
+        source_path=os.path.abspath(file_path)
+    )
+
+def _find_document_by_text_hash(text_hash, exclude_id):
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT id FROM documents WHERE text_hash = ? AND id != ? LIMIT 1", (text_hash, exclude_id))
+    row = cursor.fetchone()
+    return row[0] if row else None
+
+def ingest_pages(filename, pages, progress_callback=None, content_hash=None, source_path=None):
+    """
+    Grava um documento a partir de um iterável de tuplos (página, total_de_páginas, texto),
+    por exemplo produzido por outro processo. Ver 'ingest_document'.
+
+    Se já existir um documento com o mesmo 'content_hash', nada é feito. Se existir um
+    documento importado do mesmo 'source_path' com outro conteúdo, é atualizado: os
+    fragmentos cujo hash não mudou são mantidos (apenas reordenados) e só os restantes são
+    inseridos ou removidos. Um ficheiro novo cujo texto já existe noutro documento (ex.:
+    importado antes dos hashes) não é duplicado: fica o documento existente.
+    """
+    if content_hash:
+        existing_id = find_document_by_hash(content_hash)
+        if existing_id is not None:
+            logging.info(f"Documento '{filename}' já importado e sem alterações (ID {existing_id}).")
+            return existing_id
 
-def save_document_to_db(filename, content):
-    """Guarda um documento na base de dados."""
-    db_path = get_user_data_path(DB_NAME)
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    cursor = get_connection().cursor()
+    row = None
+    if source_path:
+        cursor.execute("SELECT id FROM documents WHERE source_path = ? ORDER BY id DESC LIMIT 1", (source_path,))
+        row = cursor.fetchone()
+    is_update = row is not None
+    reusable_chunks = {}
+    if is_update:
+        doc_id = row[0]
+        cursor.execute("SELECT chunk_hash, id FROM chunks WHERE doc_id = ?", (doc_id,))
+        for chunk_hash, chunk_id in cursor.fetchall():
+            reusable_chunks.setdefault(chunk_hash, []).append(chunk_id)
+    else:
+        with transaction() as cursor:
+            cursor.execute(
+                "INSERT INTO documents (filename, content, timestamp, source_path) VALUES (?, '', ?, ?)",
+                (filename, timestamp, source_path)
+            )
+            doc_id = cursor.lastrowid
+
+    pending_pages = []
+    pending_chunks = []
+    pending_reorders = []
+    kept_chunk_ids = set()
+    chunk_count = 0
+    inserted_count = 0
+    last_page = 0
+    text_digest = hashlib.sha256()
+
+    def flush():
+        nonlocal inserted_count
+        if not pending_pages and not pending_chunks and not pending_reorders:
+            return
+        with transaction() as cursor:
+            cursor.executemany(
+                "INSERT OR REPLACE INTO document_pages (doc_id, page_number, content) VALUES (?, ?, ?)",
+                [(doc_id, page_number, compress_text(text)) for doc_id, page_number, text in pending_pages]
+            )
+            cursor.executemany("UPDATE chunks SET ordinal = ? WHERE id = ?", pending_reorders)
+            inserted_count += _insert_chunk_rows(cursor, doc_id, pending_chunks)
+        _bump_kb_generation()
+        pending_pages.clear()
+        pending_chunks.clear()
+        pending_reorders.clear()
+
+    def iter_page_texts():
+        nonlocal last_page
+        for page_number, total_pages, text in pages:
+            pending_pages.append((doc_id, page_number, text))
+            # O mesmo texto que 'get_document_content' junta (e que '_backfill_text_hashes' usa)
+            text_digest.update((("\n" if last_page else "") + text).encode('utf-8'))
+            last_page = page_number
+            yield text
+            if len(pending_pages) >= INGEST_BATCH_PAGES:
+                flush()
+            if progress_callback:
+                progress_callback(page_number, total_pages)
+
     try:
-        cursor.execute(
-            "INSERT INTO documents (filename, content, timestamp) VALUES (?, ?, ?)",
-            (filename, content, timestamp)
-        )
-        conn.commit()
-        logging.info(f"Documento '{filename}' guardado com sucesso.")
-        return True
+        for ordinal, (chunk, tokens) in enumerate(iter_chunks(iter_page_texts())):
+            chunk_count += 1
+            chunk_hash = hash_text(chunk)
+            if reusable_chunks.get(chunk_hash):
+                # Fragmento inalterado: mantém o índice, o vetor e as estatísticas atuais
+                chunk_id = reusable_chunks[chunk_hash].pop()
+                kept_chunk_ids.add(chunk_id)
+                pending_reorders.append((ordinal, chunk_id))
+            else:
+                pending_chunks.append((ordinal, chunk, tokens, chunk_hash))
+            if len(pending_chunks) + len(pending_reorders) >= INGEST_BATCH_CHUNKS:
+                flush()
+        flush()
+
+        if chunk_count == 0:
+            raise ValueError("nenhum texto extraído")
+
+        text_hash = text_digest.hexdigest()
+        duplicate_id = None if is_update else _find_document_by_text_hash(text_hash, doc_id)
+        if duplicate_id is not None:
+            delete_document_from_db(doc_id)
+            with transaction() as cursor:
+                # O documento existente passa a ser reconhecido logo pelo hash do ficheiro
+                cursor.execute(
+                    "UPDATE documents SET content_hash = COALESCE(?, content_hash), "
+                    "source_path = COALESCE(source_path, ?) WHERE id = ?",
+                    (content_hash, source_path, duplicate_id)
+                )
+            logging.info(f"Documento '{filename}' tem o mesmo texto do documento ID {duplicate_id}; não foi duplicado.")
+            return duplicate_id
+
+        with transaction() as cursor:
+            # Remove os fragmentos e páginas que deixaram de existir na nova versão
+            stale_chunk_ids = [chunk_id for ids in reusable_chunks.values() for chunk_id in ids]
+            _forget_chunks(cursor, stale_chunk_ids)
+            cursor.execute(
+                "DELETE FROM document_pages WHERE doc_id = ? AND page_number > ?",
+                (doc_id, last_page)
+            )
+            cursor.execute(
+                "UPDATE documents SET content = '', content_hash = ?, text_hash = ?, timestamp = ? WHERE id = ?",
+                (content_hash, text_hash, timestamp, doc_id)
+            )
+        _bump_kb_generation()
     except Exception as e:
-        logging.error(f"Erro ao guardar documento: {e}")
-        return False
-    finally:
-        conn.close()
+        logging.error(f"Erro ao processar '{filename}': {e}")
+        if not is_update:
+            delete_document_from_db(doc_id)
+        # Numa atualização falhada o documento mantém o hash antigo, pelo que a próxima
+        # importação volta a comparar os fragmentos e remove o que tiver ficado a mais
+        return None
+
+    if is_update:
+        logging.info(
+            f"Documento '{filename}' atualizado: {len(kept_chunk_ids)} fragmento(s) mantido(s), "
+            f"{inserted_count} novo(s), {len(stale_chunk_ids)} removido(s)."
+        )
+    else:
+        logging.info(f"Documento '{filename}' guardado com sucesso ({chunk_count} fragmento(s)).")
+    return doc_id
+
+def get_document_content(doc_id):
+    """
+    Devolve o texto integral de um documento. O texto original está guardado comprimido
+    e só é descomprimido aqui, quando é realmente pedido (a pesquisa usa os fragmentos).
+    """
+    cursor = get_connection().cursor()
+    cursor.execute("SELECT 1 FROM documents WHERE id = ?", (doc_id,))
+    if cursor.fetchone() is None:
+        return None
+    return "\n".join(_iter_document_pages(cursor, doc_id))
 
 def load_documents_from_db():
     """Carrega todos os documentos da base de dados."""
-    db_path = get_user_data_path(DB_NAME)
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+    cursor = get_connection().cursor()
     cursor.execute("SELECT id, filename, timestamp FROM documents ORDER BY timestamp DESC")
-    documents = cursor.fetchall()
-    conn.close()
-    return documents
+    return cursor.fetchall()
 
 def delete_document_from_db(doc_id):
     """Remove um documento da base de dados."""
-    db_path = get_user_data_path(DB_NAME)
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
     try:
-        cursor.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
-        conn.commit()
+        with transaction() as cursor:
+            _forget_document_chunks(cursor, doc_id)
+            cursor.execute("DELETE FROM documents WHERE id = ?", (doc_id,))
+        _bump_kb_generation()
         logging.info(f"Documento ID {doc_id} removido.")
         return True
     except Exception as e:
         logging.error(f"Erro ao remover documento: {e}")
         return False
-    finally:
-        conn.close()
 
-@lru_cache(maxsize=100)
-def search_knowledge_base(query_text):
+def _expand_query_terms(cursor, keywords):
     """
-    Pesquisa na base de conhecimento, retornando apenas os trechos mais relevantes.
+    Resolve cada palavra-chave nos termos indexados que começam por ela (pesquisa por
+    prefixo sobre 'term_stats') e devolve um dicionário termo -> IDF do BM25.
     """
-    logging.info(f"A iniciar pesquisa na base de conhecimento para: '{query_text}'")
-    
-    keywords = set(re.findall(r'\b\w{3,}\b', query_text.lower()))
-    if not keywords:
-        logging.info("Nenhuma palavra-chave válida encontrada na pergunta.")
-        return ""
+    cursor.execute("SELECT value FROM kb_stats WHERE key = 'chunk_count'")
+    row = cursor.fetchone()
+    total_chunks = row[0] if row else 0
+    if total_chunks <= 0:
+        return {}
 
-    logging.info(f"Palavras-chave extraídas: {keywords}")
+    idf_by_term = {}
+    for keyword in keywords:
+        cursor.execute(
+            "SELECT term, df FROM term_stats WHERE term >= ? AND term < ? ORDER BY df DESC LIMIT ?",
+            (keyword, keyword + '\uffff', BM25_PREFIX_EXPANSIONS)
+        )
+        for term, df in cursor.fetchall():
+            idf_by_term[term] = math.log(1 + (total_chunks - df + 0.5) / (df + 0.5))
+    return idf_by_term
 
-    db_path = get_user_data_path(DB_NAME)
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
+def _average_chunk_length(cursor):
+    cursor.execute("SELECT key, value FROM kb_stats WHERE key IN ('chunk_count', 'total_terms')")
+    stats = dict(cursor.fetchall())
+    if not stats.get('chunk_count'):
+        return 1.0
+    return max(stats.get('total_terms', 0) / stats['chunk_count'], 1.0)
 
-    query_parts = []
-    params = []
-    for keyword in keywords:
-        query_parts.append("content LIKE ?")
-        params.append(f"%{keyword}%")
-    
-    if not query_parts:
-        return ""
+def rank_chunks_bm25(cursor, idf_by_term, limit):
+    """
+    Classifica em lote, numa única consulta SQL, todos os fragmentos que contêm algum
+    dos termos, usando as frequências do índice FTS5 e as estatísticas persistidas.
+    Retorna uma lista de tuplos (chunk_id, pontuação, termos_encontrados).
+    """
+    if not idf_by_term:
+        return []
+    terms = list(idf_by_term)
+    query_values = ", ".join("(?, ?)" for _ in terms)
+    term_placeholders = ", ".join("?" for _ in terms)
+    sql_query = f"""
+        WITH query_terms(term, idf) AS (VALUES {query_values}),
+        term_freqs AS (
+            SELECT term, doc AS chunk_id, COUNT(*) AS tf
+            FROM chunks_vocab
+            WHERE term IN ({term_placeholders})
+            GROUP BY term, doc
+        )
+        SELECT tf.chunk_id,
+               SUM(q.idf * tf.tf * (? + 1) / (tf.tf + ? * (1 - ? + ? * c.term_count / ?))) AS score,
+               COUNT(*) AS matched_terms
+        FROM term_freqs tf
+        JOIN query_terms q ON q.term = tf.term
+        JOIN chunks c ON c.id = tf.chunk_id
+        GROUP BY tf.chunk_id
+        ORDER BY score DESC, matched_terms DESC
+        LIMIT ?
+    """
+    params = [value for term in terms for value in (term, idf_by_term[term])]
+    params += terms
+    params += [BM25_K1, BM25_K1, BM25_B, BM25_B, _average_chunk_length(cursor), limit]
+    cursor.execute(sql_query, params)
+    return cursor.fetchall()
+
+def _rank_candidates_python(cursor, idf_by_term, keywords, limit):
+    """Alternativa ao ranking em SQL quando o SQLite não tem FTS5: BM25 sobre candidatos LIKE."""
+    avgdl = _average_chunk_length(cursor)
+    query_parts = " OR ".join("text LIKE ?" for _ in keywords)
+    cursor.execute(
+        f"SELECT id, text, term_count FROM chunks WHERE {query_parts} LIMIT ?",
+        [f"%{keyword}%" for keyword in keywords] + [SEARCH_CANDIDATE_LIMIT]
+    )
+    ranked = []
+    for chunk_id, text, term_count in cursor.fetchall():
+        term_freqs = Counter(term for term in tokenize_terms(text) if term in idf_by_term)
+        score = sum(
+            idf_by_term[term] * tf * (BM25_K1 + 1)
+            / (tf + BM25_K1 * (1 - BM25_B + BM25_B * term_count / avgdl))
+            for term, tf in term_freqs.items()
+        )
+        if score > 0:
+            ranked.append((chunk_id, score, len(term_freqs)))
+    ranked.sort(key=lambda x: (x[1], x[2]), reverse=True)
+    return ranked[:limit]
+
+def _rank_chunks_semantic(cursor, query_text, limit):
+    """Pesquisa semântica local: um produto matriz-vetor sobre o índice memory-mapped."""
+    query_vector = embed_terms(tokenize_terms(query_text))
+    hits = get_vector_index().search(query_vector, limit)
+    if not hits:
+        return []
+    score_by_row = dict(hits)
+    placeholders = ", ".join("?" for _ in hits)
+    cursor.execute(
+        f"SELECT id, vector_row FROM chunks WHERE vector_row IN ({placeholders})",
+        [row for row, _ in hits]
+    )
+    ranked = [(chunk_id, score_by_row[vector_row], 0) for chunk_id, vector_row in cursor.fetchall()]
+    ranked.sort(key=lambda x: x[1], reverse=True)
+    return ranked
+
+def _fuse_rankings(rankings, limit, k=60):
+    """Combina várias listas ordenadas por Reciprocal Rank Fusion (modo 'hybrid')."""
+    fused = Counter()
+    for ranking in rankings:
+        for position, (chunk_id, _, _) in enumerate(ranking):
+            fused[chunk_id] += 1.0 / (k + position + 1)
+    return [(chunk_id, score, 0) for chunk_id, score in fused.most_common(limit)]
+
+def _search_top_snippets(query_text, keywords, mode, limit):
+    """Executa a pesquisa propriamente dita e devolve os 'limit' trechos mais relevantes."""
+    cursor = get_connection().cursor()
+    rankings = []
+    # Pede alguns candidatos a mais para compensar fragmentos repetidos entre documentos
+    candidate_limit = limit * 2 if mode != "hybrid" else max(20, limit * 2)
+    if mode in ("keyword", "hybrid") and keywords:
+        idf_by_term = _expand_query_terms(cursor, keywords)
+        if FTS_AVAILABLE:
+            rankings.append(rank_chunks_bm25(cursor, idf_by_term, candidate_limit))
+        else:
+            rankings.append(_rank_candidates_python(cursor, idf_by_term, keywords, candidate_limit))
+    if mode in ("semantic", "hybrid"):
+        rankings.append(_rank_chunks_semantic(cursor, query_text, candidate_limit))
 
-    sql_query = "SELECT filename, content FROM documents WHERE " + " OR ".join(query_parts)
+    ranked = _fuse_rankings(rankings, candidate_limit) if mode == "hybrid" else (rankings[0] if rankings else [])
+
+    top_snippets = []
+    seen_hashes = set()
+    for chunk_id, score, matched_terms in ranked:
+        cursor.execute(
+            "SELECT d.filename, c.text, c.chunk_hash FROM chunks c JOIN documents d ON d.id = c.doc_id WHERE c.id = ?",
+            (chunk_id,)
+        )
+        row = cursor.fetchone()
+        if row and row[2] not in seen_hashes:
+            seen_hashes.add(row[2])
+            top_snippets.append({'filename': row[0], 'content': row[1], 'score': score})
+            if len(top_snippets) == limit:
+                break
+    return top_snippets
+
+def format_snippet(snippet):
+    """Formata um trecho tal como aparece no contexto enviado à IA."""
+    return f"FICHEIRO: {snippet['filename']}\nTRECHO RELEVANTE:\n---\n{snippet['content']}\n---"
+
+def search_knowledge_snippets(query_text, mode=None, limit=3):
+    """
+    Pesquisa na base de conhecimento e devolve até 'limit' trechos, do mais relevante
+    para o menos relevante, como dicts {'filename', 'content', 'score'}.
+    O modo pode ser 'keyword' (BM25), 'semantic' (índice vetorial local) ou 'hybrid'.
+    Os resultados ficam em cache até a base de conhecimento mudar (ou expirar o TTL);
+    a lista devolvida é partilhada com a cache e não deve ser alterada.
+    """
+    mode = mode if mode in RETRIEVAL_MODES else RETRIEVAL_MODE
     
+    keywords = {
+        term for term in tokenize_terms(' '.join(re.findall(r'\b\w{3,}\b', query_text)))
+        if len(term) >= 3
+    }
+    if not keywords and mode == "keyword":
+        logging.info("Nenhuma palavra-chave válida encontrada na pergunta.")
+        return []
+
+    # A pesquisa por palavras-chave não depende da ordem; a semântica usa bigramas
+    if mode == "keyword":
+        cache_key = (mode, limit, tuple(sorted(keywords)))
+    else:
+        cache_key = (mode, limit, tuple(tokenize_terms(query_text)))
+    generation = get_kb_generation()
+    found, cached_snippets = search_cache.get(cache_key, generation)
+    if found:
+        logging.info(f"Trechos servidos pela cache de pesquisa para: '{query_text}'")
+        return cached_snippets
+
+    logging.info(f"A iniciar pesquisa ({mode}) na base de conhecimento para: '{query_text}'")
+    logging.info(f"Palavras-chave extraídas: {keywords}")
+
     try:
-        cursor.execute(sql_query, params)
-        relevant_docs = cursor.fetchall()
+        top_snippets = _search_top_snippets(query_text, keywords, mode, limit)
     except sqlite3.Error as e:
         logging.error(f"Erro na busca ao banco de dados: {e}")
-        return ""
-    finally:
-        conn.close()
-
-    if not relevant_docs:
-        logging.info("Nenhum documento relevante encontrado na base de conhecimento.")
-        return ""
+        return []
 
-    all_snippets = []
-    for filename, content in relevant_docs:
-        paragraphs = content.split('\n\n')
-        for para in paragraphs:
-            if not para.strip():
-                continue
-            
-            score = 0
-            found_keywords = set()
-            for keyword in keywords:
-                if keyword in para.lower():
-                    score += para.lower().count(keyword)
-                    found_keywords.add(keyword)
-            
-            if score > 0:
-                all_snippets.append({
-                    'filename': filename,
-                    'content': para.strip(),
-                    'score': score,
-                    'keyword_count': len(found_keywords)
-                })
-
-    if not all_snippets:
+    if not top_snippets:
         logging.info("Nenhum trecho relevante encontrado nos documentos.")
-        return ""
-
-    # Ordena pela pontuação e depois pelo número de palavras-chave únicas encontradas
-    all_snippets.sort(key=lambda x: (x['score'], x['keyword_count']), reverse=True)
-    # Pega os 3 trechos mais relevantes
-    top_snippets = all_snippets[:3]
-    
-    context_parts = [f"FICHEIRO: {s['filename']}\nTRECHO RELEVANTE:\n---\n{s['content']}\n---" for s in top_snippets]
-    final_context = "\n\n".join(context_parts)
-    logging.info(f"Contexto gerado para a IA com {len(top_snippets)} trecho(s).")
-    
-    return final_context
+    else:
+        logging.info(f"Pesquisa devolveu {len(top_snippets)} trecho(s).")
+    search_cache.put(cache_key, generation, top_snippets)
+    return top_snippets
 
 # --- Funções de Manipulação de Ficheiros ---
-def extract_text_from_file(file_path):
-    """Extrai texto de PDF ou TXT."""
+def iter_pages_from_file(file_path):
+    """
+    Lê um PDF ou TXT página a página, gerando tuplos (página, total_de_páginas, texto).
+    Os ficheiros TXT são lidos em blocos de TEXT_BLOCK_CHARS caracteres.
+    """
     ext = os.path.splitext(file_path)[1].lower()
     
     if ext == '.pdf':
-        try:
-            with open(file_path, 'rb') as f:
-                reader = PyPDF2.PdfReader(f)
-                return '\n'.join(page.extract_text() or '' for page in reader.pages)
-        except Exception as e:
-            logging.error(f"Erro ao ler PDF: {e}")
-            return None
+        with open(file_path, 'rb') as f:
+            reader = PyPDF2.PdfReader(f)
+            total_pages = len(reader.pages)
+            for page_number, page in enumerate(reader.pages, start=1):
+                yield page_number, total_pages, page.extract_text() or ''
             
     elif ext == '.txt':
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                return f.read()
-        except Exception as e:
-            logging.error(f"Erro ao ler TXT: {e}")
-            return None
-            
-    logging.warning(f"Formato não suportado: {ext}")
-    return None
+        # Estimativa do total de blocos a partir do tamanho (apenas para o progresso)
+        total_blocks = max(1, -(-os.path.getsize(file_path) // TEXT_BLOCK_CHARS))
+        with open(file_path, 'r', encoding='utf-8') as f:
+            block_number = 0
+            block = []
+            block_size = 0
+            for line in f:
+                block.append(line)
+                block_size += len(line)
+                if block_size >= TEXT_BLOCK_CHARS:
+                    block_number += 1
+                    yield block_number, max(total_blocks, block_number), ''.join(block)
+                    block = []
+                    block_size = 0
+            if block:
+                block_number += 1
+                yield block_number, max(total_blocks, block_number), ''.join(block)
+
+    else:
+        raise ValueError(f"Formato não suportado: {ext}")
 
 def save_history_to_file(history_data):
     """Salva todo o histórico de conversas num ficheiro JSON."""
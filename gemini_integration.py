@@ -2,37 +2,132 @@
 
 import google.generativeai as genai
 import logging
-import time
+import threading
 import keyring
 import json
 import re
-from config import SERVICE_NAME, KEY_USERNAME
+import os
+from config import (
+    SERVICE_NAME, KEY_USERNAME, GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE,
+    MODEL_BACKEND, MODEL_BACKEND_ENV_VAR
+)
+from rate_limiter import RateLimiter, is_rate_limit_error, retry_delay_from_error
+from model_backends import ModelBackend, FakeModelBackend
+from metrics import metrics
+
+GENERATION_MODEL = 'gemini-1.5-flash-latest'
+COUNTING_MODEL = 'gemini-1.5-flash'
+SAFETY_SETTINGS = {
+    'HARM_CATEGORY_DANGEROUS': 'BLOCK_NONE',
+    'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
+    'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE'
+}
 
 # --- Configuração e Geração de Resposta ---
 
+# Estado do cliente partilhado por todo o processo: a chave só é lida do keyring uma
+# vez e os modelos são reutilizados entre pedidos
+_client_lock = threading.Lock()
+_api_configured = False
+_models = {}
+
 def configure_gemini_api():
-    """Busca a chave de API e configura o SDK do Gemini."""
-    try:
-        api_key = keyring.get_password(SERVICE_NAME, KEY_USERNAME)
-        if not api_key:
-            logging.error("Chave de API do Gemini não encontrada no keyring.")
+    """
+    Busca a chave de API e configura o SDK do Gemini. Só consulta o keyring na primeira
+    chamada (ou depois de 'reset_gemini_client'); as seguintes não têm custo.
+    """
+    global _api_configured
+    with _client_lock:
+        if _api_configured:
+            return True
+        try:
+            api_key = keyring.get_password(SERVICE_NAME, KEY_USERNAME)
+            if not api_key:
+                logging.error("Chave de API do Gemini não encontrada no keyring.")
+                return False
+            genai.configure(api_key=api_key)
+            _models.clear()
+            _api_configured = True
+            return True
+        except Exception as e:
+            logging.error(f"Erro ao configurar a API do Gemini: {e}")
             return False
-        genai.configure(api_key=api_key)
-        return True
-    except Exception as e:
-        logging.error(f"Erro ao configurar a API do Gemini: {e}")
-        return False
 
-def generate_response_from_gemini(user_prompt, knowledge_context, history, user_name, profile_instruction):
+def reset_gemini_client():
+    """Esquece a configuração e os modelos em cache. Chamar sempre que a chave de API mudar."""
+    global _api_configured
+    with _client_lock:
+        _api_configured = False
+        _models.clear()
+    logging.info("Cliente do Gemini reiniciado; a chave será relida no próximo pedido.")
+
+def get_model(model_name=GENERATION_MODEL, safety_settings=None):
+    """Devolve o modelo em cache para (nome, definições de segurança), criando-o na primeira utilização."""
+    key = (model_name, tuple(sorted(safety_settings.items())) if safety_settings else None)
+    with _client_lock:
+        model = _models.get(key)
+        if model is None:
+            model = genai.GenerativeModel(model_name, safety_settings=safety_settings)
+            _models[key] = model
+        return model
+
+def _chunk_text(chunk):
+    # Um fragmento sem texto (ex.: só com o motivo de fim) faz '.text' levantar ValueError
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
+
+class GeminiBackend(ModelBackend):
+    """O modelo real: a API do Gemini através do SDK 'google.generativeai'."""
+
+    name = "gemini"
+
+    def configure(self):
+        return configure_gemini_api()
+
+    async def generate(self, prompt):
+        return (await get_model(GENERATION_MODEL, SAFETY_SETTINGS).generate_content_async(prompt)).text
+
+    async def stream(self, prompt):
+        response = await get_model(GENERATION_MODEL, SAFETY_SETTINGS).generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            text = _chunk_text(chunk)
+            if text:
+                yield text
+
+    async def count_tokens(self, prompt):
+        return (await get_model(COUNTING_MODEL).count_tokens_async(prompt)).total_tokens
+
+MODEL_BACKENDS = {"gemini": GeminiBackend, "fake": FakeModelBackend.from_config}
+_model_backend = None
+
+def get_model_backend():
     """
-    Gera uma resposta usando a API do Gemini, com lógica de retry automático
-    para lidar com limites de quota (erro 429).
+    Backend do modelo usado por todas as chamadas: o indicado em MODEL_BACKEND_ENV_VAR
+    ou em MODEL_BACKEND (por omissão, a API do Gemini), criado na primeira utilização.
     """
-    if not configure_gemini_api():
-        return {"error": "Falha ao configurar a API do Gemini. Verifique a sua chave."}
+    global _model_backend
+    with _client_lock:
+        if _model_backend is None:
+            name = os.environ.get(MODEL_BACKEND_ENV_VAR) or MODEL_BACKEND
+            if name not in MODEL_BACKENDS:
+                logging.error(f"Backend do modelo desconhecido '{name}'. A usar o Gemini.")
+                name = "gemini"
+            _model_backend = MODEL_BACKENDS[name]()
+            if name != "gemini":
+                logging.warning(f"A usar o backend do modelo '{name}' em vez da API do Gemini.")
+        return _model_backend
+
+def set_model_backend(backend):
+    """Substitui o backend do modelo (ex.: um FakeModelBackend configurado por um teste de carga)."""
+    global _model_backend
+    with _client_lock:
+        _model_backend = backend
 
-    # Constrói o prompt completo para a IA
-    full_prompt = f"""
+def build_full_prompt(user_prompt, knowledge_context, history, user_name, profile_instruction):
+    """Constrói o prompt completo enviado à IA."""
+    return f"""
 {profile_instruction.format(user_name=user_name)}
 
 Histórico da Conversa Atual:
@@ -47,46 +142,132 @@ Pergunta do Utilizador ({user_name}):
 "{user_prompt}"
 """
 
-    model = genai.GenerativeModel(
-        'gemini-1.5-flash-latest',
-        safety_settings={
-            'HARM_CATEGORY_DANGEROUS': 'BLOCK_NONE',
-            'HARM_CATEGORY_HARASSMENT': 'BLOCK_NONE',
-            'HARM_CATEGORY_HATE_SPEECH': 'BLOCK_NONE'
+def _parse_response_text(text):
+    """Limpa e tenta converter a resposta para JSON, com fallback para texto simples."""
+    try:
+        clean_text = re.sub(r'```json\s*|\s*```', '', text.strip(), flags=re.DOTALL)
+        return json.loads(clean_text)
+    except json.JSONDecodeError:
+        logging.warning("A resposta da IA não era um JSON válido. A usar fallback.")
+        return {
+            "solucao": text.strip(),
+            "codigo": "", "verificacao": "", "fonte_contexto": ""
         }
-    )
-    
-    # --- LÓGICA DE RETRY COM EXPONENTIAL BACKOFF ---
-    max_retries = 4
-    base_delay_seconds = 5
 
-    for attempt in range(max_retries):
+_PARTIAL_SOLUTION_RE = re.compile(r'"solucao"\s*:\s*"((?:[^"\\]|\\.)*)')
+
+def extract_partial_solution(raw_text):
+    """
+    Extrai de uma resposta ainda incompleta o texto que já pode ser mostrado: o valor
+    (parcial) do campo "solucao" se a IA estiver a responder em JSON, ou o próprio texto
+    se não estiver. Retorna None enquanto não houver nada para mostrar.
+    """
+    stripped = re.sub(r'^\s*```(?:json)?\s*', '', raw_text)
+    if not stripped or stripped.startswith('`'):
+        return None  # Ainda só chegou parte da marcação de bloco de código
+    if not stripped.startswith('{'):
+        return stripped
+    match = _PARTIAL_SOLUTION_RE.search(stripped)
+    if not match:
+        return None
+    value = match.group(1)
+    # Um escape ainda incompleto (ex.: "\u00") é descartado até chegar o resto
+    while value:
         try:
-            response = model.generate_content(full_prompt)
-            
-            # Limpa e tenta converter a resposta para JSON
-            try:
-                clean_text = re.sub(r'```json\s*|\s*```', '', response.text.strip(), flags=re.DOTALL)
-                json_response = json.loads(clean_text)
-                return json_response
-            except json.JSONDecodeError:
-                logging.warning("A resposta da IA não era um JSON válido. A usar fallback.")
-                return {
-                    "solucao": response.text.strip(),
-                    "codigo": "", "verificacao": "", "fonte_contexto": ""
-                }
+            return json.loads(f'"{value}"')
+        except json.JSONDecodeError:
+            value = value[:value.rfind('\\')] if '\\' in value else ''
+    return None
+
+# --- LÓGICA DE RETRY COM EXPONENTIAL BACKOFF ---
+MAX_RETRIES = 4
+BASE_DELAY_SECONDS = 5
+
+# Orçamento de pedidos e tokens partilhado por todas as chamadas assíncronas do servidor
+rate_limiter = RateLimiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE)
+
+def _retry_delay(e, attempt):
+    """Atraso antes de repetir após um 429: o indicado pelo servidor ou, na falta dele, exponencial."""
+    delay = retry_delay_from_error(e)
+    return delay if delay is not None else BASE_DELAY_SECONDS * (2 ** attempt)
+
+async def generate_response_from_gemini_async(full_prompt, user="", estimated_tokens=0):
+    """
+    Gera a resposta para o servidor: recebe o prompt já construído (e verificado quanto
+    a tokens) e espera pela API sem bloquear uma thread, pelo que os outros pedidos
+    continuam a ser atendidos, com retry automático nos erros de quota (429).
+
+    Cada tentativa passa primeiro pelo 'rate_limiter' (fila justa por 'user', com
+    'estimated_tokens' descontados do orçamento por minuto). Um 429 põe a fila inteira em
+    pausa pelo tempo indicado pelo servidor e a tentativa seguinte volta à fila.
+    O backend deve já estar configurado ('get_model_backend().configure').
+    """
+    backend = get_model_backend()
+
+    for attempt in range(MAX_RETRIES):
+        waited = await rate_limiter.acquire(user, estimated_tokens)
+        # A espera antes de uma nova tentativa inclui a pausa pedida pelo 429 (backoff)
+        metrics.record("backoff_wait" if attempt else "queue_wait", waited)
+        metrics.incr("model_attempts")
+        try:
+            with metrics.span("model_attempt"):
+                response_text = await backend.generate(full_prompt)
+            return _parse_response_text(response_text)
 
         except Exception as e:
-            if "429" in str(e) and "quota" in str(e).lower():
-                if attempt < max_retries - 1:
-                    delay = base_delay_seconds * (2 ** attempt)
-                    logging.warning(f"Quota da API excedida. A tentar novamente em {delay}s... (Tentativa {attempt + 1}/{max_retries})")
-                    time.sleep(delay)
+            if is_rate_limit_error(e):
+                metrics.incr("rate_limited_429")
+                if attempt < MAX_RETRIES - 1:
+                    metrics.incr("model_retries")
+                    rate_limiter.pause(_retry_delay(e, attempt))
+                    logging.warning(f"Quota da API excedida. Pedido de volta à fila... (Tentativa {attempt + 1}/{MAX_RETRIES})")
                 else:
-                    logging.error(f"Quota da API excedida após {max_retries} tentativas.")
+                    logging.error(f"Quota da API excedida após {MAX_RETRIES} tentativas.")
                     return {"error": "Limite de requisições à API atingido. Tente novamente num minuto."}
             else:
+                metrics.incr("model_errors")
                 logging.error(f"Erro inesperado na API Gemini: {e}")
                 return {"error": f"Erro na API Gemini: {e}"}
-    
+
     return {"error": "Não foi possível obter uma resposta da API após várias tentativas."}
+
+async def stream_response_from_gemini_async(full_prompt, user="", estimated_tokens=0):
+    """
+    Variante em streaming de 'generate_response_from_gemini_async'. Gera tuplos
+    ("texto", fragmento) à medida que o modelo escreve e termina com ("resposta", dict),
+    em que o dict tem o mesmo formato da resposta não-streaming (ou uma chave "error").
+    Um erro de quota só é repetido se ainda não tiver chegado nenhum texto.
+    """
+    backend = get_model_backend()
+
+    for attempt in range(MAX_RETRIES):
+        received = []
+        waited = await rate_limiter.acquire(user, estimated_tokens)
+        metrics.record("backoff_wait" if attempt else "queue_wait", waited)
+        metrics.incr("model_attempts")
+        try:
+            with metrics.span("model_attempt"):
+                async for text in backend.stream(full_prompt):
+                    received.append(text)
+                    yield "texto", text
+            yield "resposta", _parse_response_text("".join(received))
+            return
+
+        except Exception as e:
+            if is_rate_limit_error(e):
+                metrics.incr("rate_limited_429")
+            if is_rate_limit_error(e) and not received:
+                if attempt < MAX_RETRIES - 1:
+                    metrics.incr("model_retries")
+                    rate_limiter.pause(_retry_delay(e, attempt))
+                    logging.warning(f"Quota da API excedida. Pedido de volta à fila... (Tentativa {attempt + 1}/{MAX_RETRIES})")
+                    continue
+                logging.error(f"Quota da API excedida após {MAX_RETRIES} tentativas.")
+                yield "resposta", {"error": "Limite de requisições à API atingido. Tente novamente num minuto."}
+            else:
+                metrics.incr("model_errors")
+                logging.error(f"Erro inesperado na API Gemini: {e}")
+                yield "resposta", {"error": f"Erro na API Gemini: {e}"}
+            return
+
+    yield "resposta", {"error": "Não foi possível obter uma resposta da API após várias tentativas."}
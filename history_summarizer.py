@@ -0,0 +1,175 @@
+# /history_summarizer.py
+
+import re
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Início de uma mensagem no histórico formatado pela interface ("Utilizador: ..." / "IA: ...")
+_MESSAGE_START_RE = re.compile(r'^(?:Utilizador|IA): ', re.MULTILINE)
+_CODE_BLOCK_RE = re.compile(r'```.*?(?:```|$)', re.DOTALL)
+_SENTENCE_END_RE = re.compile(r'[.!?]$')
+SUMMARY_HEADER = "Resumo das mensagens anteriores:"
+RECENT_HEADER = "Mensagens recentes:"
+OMITTED_NOTE = " ({count} mensagem(ns) mais antiga(s) omitida(s))"
+CUT_MARKER = " [...]"
+
+
+def split_messages(history):
+    """
+    Divide o histórico em mensagens (uma mensagem pode ter várias linhas, p. ex. código).
+    Um histórico sem os prefixos da interface é dividido linha a linha.
+    """
+    starts = [match.start() for match in _MESSAGE_START_RE.finditer(history)]
+    if not starts:
+        return [line for line in history.split("\n") if line.strip()]
+    if starts[0] != 0:
+        starts.insert(0, 0)
+    bounds = starts[1:] + [len(history)]
+    return [history[start:end].rstrip("\n") for start, end in zip(starts, bounds) if history[start:end].strip()]
+
+
+def compress_message(message, max_tokens, count_tokens):
+    """
+    Reduz uma mensagem antiga a uma linha do resumo: sem blocos de código e cortada,
+    de preferência no fim de uma frase, em 'max_tokens'.
+    """
+    text = _CODE_BLOCK_RE.sub(" [código omitido] ", message)
+    text = re.sub(r'\s+', ' ', text).strip()
+    if count_tokens(text) <= max_tokens:
+        return text
+
+    budget = max_tokens - count_tokens(CUT_MARKER)
+    words = text.split(" ")
+    tokens = 0
+    kept = 0
+    last_sentence_end = 0
+    for word in words:
+        tokens += count_tokens(word)
+        if tokens > budget:
+            break
+        kept += 1
+        if _SENTENCE_END_RE.search(word):
+            last_sentence_end = kept
+    kept = last_sentence_end or kept
+    return " ".join(words[:kept]) + CUT_MARKER
+
+
+class _SummaryState:
+    """Resumo de um prefixo de uma conversa (imutável, partilhado através da cache)."""
+
+    __slots__ = ("lines", "tokens", "omitted")
+
+    def __init__(self, lines=(), tokens=0, omitted=0):
+        self.lines = lines
+        self.tokens = tokens
+        self.omitted = omitted
+
+
+class HistorySummarizer:
+    """
+    Comprime o histórico da conversa para caber em 'max_tokens': as mensagens mais
+    recentes seguem na íntegra e as mais antigas são dobradas, uma a uma, num resumo
+    de até 'summary_tokens' (cada mensagem reduzida a uma linha; se o resumo não couber,
+    saem as linhas mais antigas).
+
+    O resumo é incremental: o estado fica em cache (LRU) indexado por um hash encadeado
+    das mensagens já resumidas, pelo que em cada novo turno só são dobradas as mensagens
+    que saíram entretanto da parte recente.
+    """
+
+    def __init__(self, max_tokens, summary_tokens, line_tokens, cache_size):
+        self.max_tokens = max_tokens
+        self.summary_tokens = summary_tokens
+        self.line_tokens = line_tokens
+        self.cache_size = cache_size
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+        self.summarized = 0
+        self.folded_messages = 0
+        self.reused_messages = 0
+
+    def _cached_state(self, key):
+        with self._lock:
+            state = self._states.get(key)
+            if state is not None:
+                self._states.move_to_end(key)
+            return state
+
+    def _store_state(self, key, state):
+        with self._lock:
+            self._states[key] = state
+            while len(self._states) > self.cache_size:
+                self._states.popitem(last=False)
+
+    def _fold(self, state, message, count_tokens):
+        line = "- " + compress_message(message, self.line_tokens, count_tokens)
+        lines = state.lines + (line,)
+        tokens = state.tokens + count_tokens(line) + 1
+        omitted = state.omitted
+        while tokens > self.summary_tokens and lines:
+            tokens -= count_tokens(lines[0]) + 1
+            lines = lines[1:]
+            omitted += 1
+        return _SummaryState(lines, tokens, omitted)
+
+    def summarize(self, history, count_tokens):
+        """Retorna (histórico_comprimido, tokens_estimados). Um histórico que já cabe é devolvido tal como está."""
+        history_tokens = count_tokens(history) if history else 0
+        if history_tokens <= self.max_tokens:
+            return history, history_tokens
+
+        messages = split_messages(history)
+        header_tokens = count_tokens(SUMMARY_HEADER + OMITTED_NOTE.format(count=9999)) + count_tokens(RECENT_HEADER) + 2
+        recent_budget = self.max_tokens - self.summary_tokens - header_tokens
+
+        # Parte recente: as últimas mensagens que cabem, na íntegra
+        split_at = len(messages)
+        recent_tokens = 0
+        while split_at > 0:
+            message_tokens = count_tokens(messages[split_at - 1]) + 1
+            if recent_tokens + message_tokens > recent_budget:
+                break
+            recent_tokens += message_tokens
+            split_at -= 1
+
+        # Hash encadeado de cada prefixo das mensagens a resumir
+        prefix_keys = []
+        digest = b""
+        for message in messages[:split_at]:
+            digest = hashlib.blake2b(digest + message.encode('utf-8'), digest_size=16).digest()
+            prefix_keys.append(digest)
+
+        # Retoma do maior prefixo já resumido e dobra só as mensagens seguintes
+        state, start = _SummaryState(), 0
+        for count in range(split_at, 0, -1):
+            cached = self._cached_state(prefix_keys[count - 1])
+            if cached is not None:
+                state, start = cached, count
+                break
+        for index in range(start, split_at):
+            state = self._fold(state, messages[index], count_tokens)
+        if split_at:
+            self._store_state(prefix_keys[split_at - 1], state)
+
+        with self._lock:
+            self.summarized += 1
+            self.folded_messages += split_at - start
+            self.reused_messages += start
+
+        parts = [SUMMARY_HEADER + (OMITTED_NOTE.format(count=state.omitted) if state.omitted else "")]
+        parts.extend(state.lines)
+        if split_at < len(messages):
+            parts.append(RECENT_HEADER)
+            parts.extend(messages[split_at:])
+        text = "\n".join(parts)
+        return text, count_tokens(text)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cached_summaries": len(self._states),
+                "summarized": self.summarized,
+                "folded_messages": self.folded_messages,
+                "reused_messages": self.reused_messages,
+            }
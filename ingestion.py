@@ -0,0 +1,229 @@
+# /ingestion.py
+
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import multiprocessing
+from multiprocessing.connection import wait
+
+from config import INGEST_WORKERS, INGEST_FILE_TIMEOUT_SECONDS, INGEST_PROGRESS_INTERVAL_SECONDS
+from database import iter_pages_from_file, ingest_pages, file_content_hash, find_document_by_hash
+
+# "spawn" evita copiar por fork um processo com threads ativas (Tk, servidor, SQLite)
+_mp_context = multiprocessing.get_context("spawn")
+
+
+def _extraction_worker(task_queue, result_conn):
+    """
+    Processo de extração: lê cada ficheiro página a página e grava as páginas num
+    ficheiro temporário (JSON por linha), para que o processo principal as leia em
+    streaming sem as receber todas de uma vez. Ficheiros já importados sem alterações
+    não são extraídos.
+    """
+    while True:
+        task = task_queue.get()
+        if task is None:
+            return
+        task_id, file_path, spool_path = task
+        try:
+            content_hash = file_content_hash(file_path)
+            if find_document_by_hash(content_hash) is None:
+                with open(spool_path, 'w', encoding='utf-8') as spool:
+                    for page in iter_pages_from_file(file_path):
+                        spool.write(json.dumps(page, ensure_ascii=False) + "\n")
+            result_conn.send((task_id, None, content_hash))
+        except Exception as e:
+            result_conn.send((task_id, str(e), None))
+
+
+def _iter_spooled_pages(spool_path):
+    if not os.path.exists(spool_path):
+        return
+    with open(spool_path, 'r', encoding='utf-8') as spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+class ProgressThrottle:
+    """Agrupa atualizações de progresso: no máximo uma chamada por intervalo."""
+
+    def __init__(self, callback, min_interval=INGEST_PROGRESS_INTERVAL_SECONDS):
+        self.callback = callback
+        self.min_interval = min_interval
+        self._last_call = 0.0
+
+    def __call__(self, value, text, force=False):
+        if not self.callback:
+            return
+        now = time.monotonic()
+        if force or now - self._last_call >= self.min_interval:
+            self._last_call = now
+            self.callback(value, text)
+
+
+class _Worker:
+    """
+    Processo de extração com a sua própria fila de tarefas e o seu próprio canal de
+    resultados: nada é partilhado com os outros processos, pelo que um processo que
+    morra (ou seja terminado) a meio de uma escrita não deixa locks presos nem mensagens
+    cortadas num canal que os outros usem.
+    """
+
+    def __init__(self, worker_id):
+        self.worker_id = worker_id
+        self.task_queue = _mp_context.Queue()
+        self.results, result_conn = _mp_context.Pipe(duplex=False)
+        self.process = _mp_context.Process(
+            target=_extraction_worker,
+            args=(self.task_queue, result_conn),
+            daemon=True
+        )
+        self.process.start()
+        # Só o processo escreve no canal: sem a cópia do processo principal, a morte
+        # do processo fecha o canal e é vista de imediato (EOF)
+        result_conn.close()
+        self.task_id = None
+        self.started_at = None
+
+    def assign(self, task_id, file_path, spool_path):
+        self.task_id = task_id
+        self.started_at = time.monotonic()
+        self.task_queue.put((task_id, file_path, spool_path))
+
+    def release(self):
+        self.task_id = None
+        self.started_at = None
+
+    def receive(self):
+        """Resultado (tarefa, erro, hash) enviado pelo processo, ou None se ele morreu."""
+        try:
+            return self.results.recv()
+        except (EOFError, OSError):
+            return None
+
+    def stop(self):
+        if self.process.is_alive():
+            self.task_queue.put(None)
+
+    def kill(self):
+        """
+        Termina o processo, mesmo que esteja a meio de uma escrita ou bloqueado na fila de
+        tarefas: os dois canais são só dele e são descartados aqui, com ele.
+        """
+        self.process.terminate()
+        self.process.join(timeout=5)
+        self.results.close()
+        self.task_queue.cancel_join_thread()
+        self.task_queue.close()
+
+
+def ingest_files_parallel(file_paths, workers=None, file_timeout=None, progress_callback=None):
+    """
+    Importa vários ficheiros em paralelo: um conjunto de processos extrai o texto (o
+    PyPDF2 é limitado pelo GIL numa só thread) e a thread que chama esta função é o único
+    escritor na base de dados, gravando em lotes à medida que cada extração termina.
+    Um ficheiro que exceda 'file_timeout' segundos, ou cujo processo morra (ex.: falha
+    de uma biblioteca de PDF ou falta de memória), é dado como falhado e o seu processo
+    é substituído, sem bloquear os restantes.
+    'progress_callback(valor, texto)' é chamado de forma agrupada (ver ProgressThrottle).
+    Retorna (número_de_sucessos, lista_de_ficheiros_falhados).
+    """
+    workers = workers or INGEST_WORKERS or os.cpu_count() or 1
+    workers = max(1, min(workers, len(file_paths)))
+    file_timeout = file_timeout or INGEST_FILE_TIMEOUT_SECONDS
+    report = ProgressThrottle(progress_callback)
+
+    total_files = len(file_paths)
+    pending = list(reversed(range(total_files)))
+    spool_dir = tempfile.mkdtemp(prefix="aitechexpert_ingest_")
+    pool = [_Worker(worker_id) for worker_id in range(workers)]
+    done_count = 0
+    success_count = 0
+    failed_files = []
+
+    def spool_path_for(task_id):
+        return os.path.join(spool_dir, f"{task_id}.jsonl")
+
+    def finish(task_id, succeeded):
+        nonlocal done_count, success_count
+        done_count += 1
+        if succeeded:
+            success_count += 1
+        else:
+            failed_files.append(os.path.basename(file_paths[task_id]))
+        if os.path.exists(spool_path_for(task_id)):
+            os.remove(spool_path_for(task_id))
+        report(done_count / total_files, f"Processados {done_count}/{total_files} ficheiro(s)...")
+
+    def replace_worker(index, timed_out):
+        worker = pool[index]
+        failed_task = worker.task_id
+        worker.kill()
+        filename = os.path.basename(file_paths[failed_task])
+        if timed_out:
+            logging.error(f"Tempo esgotado ao extrair '{filename}' ({file_timeout}s).")
+        else:
+            logging.error(f"O processo de extração terminou inesperadamente (código {worker.process.exitcode}) ao extrair '{filename}'.")
+        pool[index] = _Worker(worker.worker_id)
+        finish(failed_task, False)
+
+    try:
+        while pending or any(worker.task_id is not None for worker in pool):
+            for index, worker in enumerate(pool):
+                if worker.task_id is None and pending:
+                    if not worker.process.is_alive():
+                        # Morreu sem tarefa: não há ficheiro a dar como falhado, só o processo a repor
+                        worker.kill()
+                        pool[index] = worker = _Worker(worker.worker_id)
+                    task_id = pending.pop()
+                    worker.assign(task_id, file_paths[task_id], spool_path_for(task_id))
+
+            # Recolhe todos os resultados disponíveis antes de verificar os tempos esgotados,
+            # para não penalizar extrações que terminaram enquanto o escritor gravava
+            ready = wait([worker.results for worker in pool if worker.task_id is not None], timeout=0.2)
+
+            completed = []
+            now = time.monotonic()
+            for index, worker in enumerate(pool):
+                if worker.task_id is None:
+                    continue
+                result = worker.receive() if worker.results in ready else None
+                if result is not None:
+                    worker.release()
+                    completed.append(result)
+                elif worker.results in ready or not (worker.process.is_alive() or worker.results.poll()):
+                    # Canal fechado ou processo morto sem resultado por ler: não vale a pena esperar
+                    replace_worker(index, timed_out=False)
+                elif now - worker.started_at > file_timeout:
+                    replace_worker(index, timed_out=True)
+
+            for task_id, error, content_hash in completed:
+                filename = os.path.basename(file_paths[task_id])
+                if error:
+                    logging.error(f"Erro ao extrair '{filename}': {error}")
+                    finish(task_id, False)
+                    continue
+
+                def on_page(page, total_pages):
+                    value = (done_count + page / total_pages) / total_files
+                    report(value, f"A gravar {done_count + 1}/{total_files}: {filename[:30]}... (página {page}/{total_pages})")
+
+                doc_id = ingest_pages(
+                    filename, _iter_spooled_pages(spool_path_for(task_id)), on_page,
+                    content_hash=content_hash, source_path=os.path.abspath(file_paths[task_id])
+                )
+                finish(task_id, doc_id is not None)
+    finally:
+        for worker in pool:
+            worker.stop()
+        for worker in pool:
+            worker.process.join(timeout=5)
+            if worker.process.is_alive():
+                worker.kill()
+        shutil.rmtree(spool_dir, ignore_errors=True)
+
+    report(1.0, f"Processados {total_files}/{total_files} ficheiro(s).", force=True)
+    return success_count, failed_files
@@ -2,6 +2,7 @@
 
 import sys
 import threading
+import multiprocessing
 import customtkinter
 import keyring
 import logging
@@ -31,10 +32,10 @@ def main():
             logging.error("Nenhuma chave de API foi fornecida. A sair.")
             sys.exit()
 
-    # 4. Iniciar servidor Flask em background
+    # 4. Iniciar servidor (Quart/Hypercorn) em background
     server_thread = threading.Thread(target=run_server, daemon=True)
     server_thread.start()
-    logging.info("Servidor Flask iniciado em background.")
+    logging.info("Servidor iniciado em background.")
     
     # Adiciona um pequeno delay para garantir que o servidor suba antes da primeira requisição
     threading.Timer(2.0, lambda: logging.info("Servidor pronto.")).start()
@@ -49,4 +50,6 @@ def main():
         sys.exit(1)
 
 if __name__ == "__main__":
+    # Necessário para os processos de extração quando a aplicação é empacotada
+    multiprocessing.freeze_support()
     main()
@@ -0,0 +1,197 @@
+# /metrics.py
+
+import time
+import queue
+import atexit
+import logging
+import threading
+import contextvars
+from contextlib import contextmanager
+from collections import Counter, deque
+
+from config import (
+    METRICS_RECENT_SAMPLES, METRICS_FLUSH_INTERVAL_SECONDS, METRICS_BATCH_SIZE, METRICS_QUEUE_SIZE,
+    METRICS_RETENTION_DAYS, METRICS_PRUNE_INTERVAL_SECONDS
+)
+from database import write_metrics_batch, prune_metrics
+
+# Perfil do pedido em curso, para as etapas medidas longe do servidor (ex.: chamadas ao modelo).
+# As tarefas e threads auxiliares ('asyncio.to_thread') herdam-no.
+current_profile = contextvars.ContextVar("current_profile", default=None)
+# Lista onde se acumulam as etapas do pedido em curso, só quando alguém as quer (ex.: 'profiling.py')
+request_spans = contextvars.ContextVar("request_spans", default=None)
+
+PERCENTILES = {"p50": 0.50, "p95": 0.95, "p99": 0.99}
+
+
+def summarize_samples(samples):
+    """Número de amostras, percentis e máximo (em segundos) de uma lista de durações."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {"count": 0}
+    summary = {"count": len(ordered)}
+    for name, fraction in PERCENTILES.items():
+        summary[name] = ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+    summary["max"] = ordered[-1]
+    return summary
+
+
+class MetricsRecorder:
+    """
+    Tempos por etapa de cada pedido (pesquisa, contagem de tokens, cada tentativa ao
+    modelo, esperas de backoff, ...) e contadores de eventos (tentativas, 429, ...).
+
+    As últimas amostras de cada etapa, no total e por perfil, ficam em memória para os
+    percentis de '/metrics'. Os registos seguem também para a base de dados, mas nunca no
+    caminho do pedido: vão para uma fila que uma thread em segundo plano grava em lotes
+    (uma transação a cada 'flush_interval' segundos ou 'batch_size' registos). Se a fila
+    encher, os registos em excesso são descartados (e contados), em vez de bloquear. A
+    mesma thread apaga, a cada 'prune_interval' segundos, os registos com mais de
+    'retention_days' dias.
+    """
+
+    def __init__(self, recent_samples, flush_interval, batch_size, queue_size, retention_days, prune_interval):
+        self.recent_samples = recent_samples
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.prune_interval = prune_interval
+        self._last_prune = None
+        self._durations = {}  # (etapa, perfil ou None) -> deque de durações
+        self.counters = Counter()
+        self._lock = threading.Lock()
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._writer = None
+        self._write_lock = threading.Lock()
+        self.dropped = 0
+        self.written = 0
+        self.pruned = 0
+
+    # --- Registo ---
+    def record(self, stage, seconds, profile=None):
+        """Regista a duração de uma etapa (o perfil por omissão é o do pedido em curso)."""
+        profile = profile if profile is not None else current_profile.get()
+        with self._lock:
+            for key in ((stage, None), (stage, profile)) if profile is not None else ((stage, None),):
+                samples = self._durations.get(key)
+                if samples is None:
+                    samples = self._durations[key] = deque(maxlen=self.recent_samples)
+                samples.append(seconds)
+        spans = request_spans.get()
+        if spans is not None:
+            spans.append((stage, seconds))
+        self._enqueue(("span", (time.time(), stage, profile, seconds)))
+
+    @contextmanager
+    def span(self, stage, profile=None):
+        """Mede o bloco 'with' como uma etapa (também à volta de 'await')."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, profile)
+
+    def incr(self, name, amount=1):
+        with self._lock:
+            self.counters[name] += amount
+
+    def log_request(self, response_time, used_knowledge_base, profile_used, time_to_first_token=None):
+        """Métrica de um pedido completo (tabela 'metrics'), sem tocar na base de dados."""
+        self.record("total", response_time, profile_used)
+        if time_to_first_token is not None:
+            self.record("first_token", time_to_first_token, profile_used)
+        timestamp = time.strftime("%Y-%m-%d %H:%M:%S")
+        self._enqueue(("request", (timestamp, response_time, used_knowledge_base, profile_used, time_to_first_token)))
+
+    # --- Escrita em segundo plano ---
+    def _enqueue(self, item):
+        if self._writer is None:
+            self._start_writer()
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._lock:
+                self.dropped += 1
+
+    def _start_writer(self):
+        with self._write_lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run_writer, name="metrics-writer", daemon=True)
+                self._writer.start()
+                atexit.register(self.flush)
+
+    def _run_writer(self):
+        while True:
+            try:
+                first = self._queue.get(timeout=self.flush_interval)
+            except queue.Empty:
+                continue
+            # Deixa acumular um lote antes de abrir a transação
+            time.sleep(self.flush_interval)
+            self._write([first] + self._drain())
+            self._prune_if_due()
+
+    def _prune_if_due(self):
+        now = time.monotonic()
+        if self._last_prune is not None and now - self._last_prune < self.prune_interval:
+            return
+        self._last_prune = now
+        try:
+            with self._write_lock:
+                self.pruned += prune_metrics(self.retention_days * 24 * 3600)
+        except Exception as e:
+            logging.error(f"Erro ao apagar métricas antigas: {e}")
+
+    def _drain(self):
+        items = []
+        while True:
+            try:
+                items.append(self._queue.get_nowait())
+            except queue.Empty:
+                return items
+
+    def _write(self, items):
+        with self._write_lock:
+            for start in range(0, len(items), self.batch_size):
+                batch = items[start:start + self.batch_size]
+                request_rows = [row for kind, row in batch if kind == "request"]
+                span_rows = [row for kind, row in batch if kind == "span"]
+                try:
+                    write_metrics_batch(request_rows, span_rows)
+                    self.written += len(batch)
+                except Exception as e:
+                    logging.error(f"Erro ao gravar {len(batch)} métrica(s): {e}")
+
+    def flush(self):
+        """Grava já tudo o que estiver na fila (usado à saída do programa)."""
+        items = self._drain()
+        if items:
+            self._write(items)
+
+    # --- Leitura ---
+    def snapshot(self):
+        """Percentis por etapa (no total e por perfil) e contadores, para '/metrics'."""
+        with self._lock:
+            durations = {key: list(samples) for key, samples in self._durations.items()}
+            counters = dict(self.counters)
+            dropped = self.dropped
+
+        stages = {}
+        profiles = {}
+        for (stage, profile), samples in sorted(durations.items(), key=lambda item: (item[0][0], item[0][1] or "")):
+            if profile is None:
+                stages[stage] = summarize_samples(samples)
+            else:
+                profiles.setdefault(profile, {})[stage] = summarize_samples(samples)
+        return {
+            "stages": stages,
+            "profiles": profiles,
+            "counters": counters,
+            "writer": {"queued": self._queue.qsize(), "written": self.written, "dropped": dropped, "pruned": self.pruned},
+        }
+
+
+metrics = MetricsRecorder(
+    METRICS_RECENT_SAMPLES, METRICS_FLUSH_INTERVAL_SECONDS, METRICS_BATCH_SIZE, METRICS_QUEUE_SIZE,
+    METRICS_RETENTION_DAYS, METRICS_PRUNE_INTERVAL_SECONDS
+)
@@ -0,0 +1,189 @@
+# /model_backends.py
+
+import json
+import math
+import time
+import random
+import asyncio
+import threading
+from abc import ABC, abstractmethod
+from collections import deque
+
+from google.api_core import exceptions as google_exceptions
+
+from config import (
+    FAKE_MODEL_LATENCY_SECONDS, FAKE_MODEL_LATENCY_SIGMA, FAKE_MODEL_STREAM_CHUNKS,
+    FAKE_MODEL_RESPONSE_WORDS, FAKE_MODEL_MALFORMED_RATE, FAKE_MODEL_RATE_LIMIT_RATE,
+    FAKE_MODEL_RATE_LIMIT_RETRY_SECONDS, FAKE_MODEL_QUOTA_PER_MINUTE, FAKE_MODEL_COUNT_TOKENS_SECONDS
+)
+from token_estimator import count_raw_tokens
+
+# Parte da latência de uma resposta em streaming que passa antes do primeiro fragmento
+FIRST_CHUNK_SHARE = 0.3
+_FAKE_WORDS = (
+    "verifique a configuração da interface e confirme que o serviço arrancou sem erros "
+    "no registo depois reinicie o equipamento e teste a ligação com ping e traceroute "
+    "check the firewall rule order the route table and the dns resolver before upgrading"
+).split()
+
+
+class ModelBackend(ABC):
+    """
+    Interface do modelo usado pelo servidor: gerar uma resposta (completa ou em
+    streaming) e contar os tokens de um prompt. Os erros de quota devem ser levantados
+    como 'google_exceptions.TooManyRequests', para passarem pela mesma lógica de retry
+    ('rate_limiter.is_rate_limit_error' / 'retry_delay_from_error').
+    """
+
+    name = "base"
+
+    def configure(self):
+        """Prepara o backend (ex.: chave de API). Retorna False se não puder ser usado."""
+        return True
+
+    @abstractmethod
+    async def generate(self, prompt):
+        """Texto completo da resposta."""
+
+    @abstractmethod
+    def stream(self, prompt):
+        """Gerador assíncrono dos fragmentos de texto da resposta, à medida que chegam."""
+
+    @abstractmethod
+    async def count_tokens(self, prompt):
+        """Número de tokens do prompt segundo o modelo."""
+
+    def stats(self):
+        return {"backend": self.name}
+
+
+class _RetryDelay:
+    """Imita o 'retry_delay' de um RetryInfo nos detalhes de um erro 429."""
+
+    def __init__(self, seconds):
+        self.seconds = int(seconds)
+        self.nanos = int((seconds - self.seconds) * 1e9)
+
+
+class _RetryInfo:
+    def __init__(self, seconds):
+        self.retry_delay = _RetryDelay(seconds)
+
+
+class FakeModelBackend(ModelBackend):
+    """
+    Modelo simulado, sem rede nem chave de API, para testes de carga e desenvolvimento.
+
+    A latência de cada resposta segue uma distribuição log-normal (mediana
+    'latency_seconds', dispersão 'latency_sigma'); em streaming chega em 'stream_chunks'
+    fragmentos. Com 'malformed_rate' a resposta vem com JSON inválido (cortado), com
+    'rate_limit_rate' a chamada falha com um 429 ao acaso e com 'quota_per_minute' há uma
+    quota por minuto como a da API: acima dela, 429 com o atraso até haver quota outra vez.
+    """
+
+    name = "fake"
+
+    def __init__(self, latency_seconds=0.8, latency_sigma=0.5, stream_chunks=8, response_words=120,
+                 malformed_rate=0.0, rate_limit_rate=0.0, rate_limit_retry_seconds=1.0,
+                 quota_per_minute=0, count_tokens_seconds=0.05, seed=None):
+        self.latency_seconds = latency_seconds
+        self.latency_sigma = latency_sigma
+        self.stream_chunks = max(1, stream_chunks)
+        self.response_words = response_words
+        self.malformed_rate = malformed_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.rate_limit_retry_seconds = rate_limit_retry_seconds
+        self.quota_per_minute = quota_per_minute
+        self.count_tokens_seconds = count_tokens_seconds
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent_calls = deque()
+        self.calls = 0
+        self.rate_limited = 0
+        self.malformed = 0
+        self.token_counts = 0
+
+    @classmethod
+    def from_config(cls):
+        """Modelo simulado com as definições FAKE_MODEL_* de 'config.py'."""
+        return cls(
+            FAKE_MODEL_LATENCY_SECONDS, FAKE_MODEL_LATENCY_SIGMA, FAKE_MODEL_STREAM_CHUNKS,
+            FAKE_MODEL_RESPONSE_WORDS, FAKE_MODEL_MALFORMED_RATE, FAKE_MODEL_RATE_LIMIT_RATE,
+            FAKE_MODEL_RATE_LIMIT_RETRY_SECONDS, FAKE_MODEL_QUOTA_PER_MINUTE, FAKE_MODEL_COUNT_TOKENS_SECONDS
+        )
+
+    def _check_quota(self, now):
+        """Levanta um 429 (sorteado ou por falta de quota). Chamar com o lock."""
+        if self.rate_limit_rate and self._random.random() < self.rate_limit_rate:
+            self.rate_limited += 1
+            raise google_exceptions.TooManyRequests(
+                "Quota simulada excedida.", details=[_RetryInfo(self.rate_limit_retry_seconds)]
+            )
+        if self.quota_per_minute:
+            while self._recent_calls and now - self._recent_calls[0] >= 60:
+                self._recent_calls.popleft()
+            if len(self._recent_calls) >= self.quota_per_minute:
+                self.rate_limited += 1
+                retry_after = 60 - (now - self._recent_calls[0])
+                raise google_exceptions.TooManyRequests(
+                    f"Quota simulada de {self.quota_per_minute} pedidos por minuto excedida.",
+                    details=[_RetryInfo(retry_after)]
+                )
+            self._recent_calls.append(now)
+
+    def _plan_call(self, prompt):
+        """Sorteia o resultado de uma chamada: (latência, texto), ou levanta o 429."""
+        with self._lock:
+            self.calls += 1
+            self._check_quota(time.monotonic())
+            latency = self._random.lognormvariate(math.log(self.latency_seconds), self.latency_sigma) \
+                if self.latency_seconds > 0 else 0.0
+            words = [self._random.choice(_FAKE_WORDS) for _ in range(self.response_words)]
+            malformed = self._random.random() < self.malformed_rate
+            if malformed:
+                self.malformed += 1
+
+        text = json.dumps({
+            "solucao": f"Resposta simulada para um prompt de {count_raw_tokens(prompt)} tokens: {' '.join(words)}.",
+            "codigo": "",
+            "verificacao": "Resposta gerada pelo modelo simulado.",
+            "fonte_contexto": "",
+        }, ensure_ascii=False)
+        if malformed:
+            text = text[:len(text) * 2 // 3]  # JSON cortado a meio, como numa resposta truncada
+        return latency, text
+
+    def _chunks(self, text):
+        size = math.ceil(len(text) / self.stream_chunks)
+        return [text[start:start + size] for start in range(0, len(text), size)]
+
+    async def generate(self, prompt):
+        latency, text = self._plan_call(prompt)
+        await asyncio.sleep(latency)
+        return text
+
+    async def stream(self, prompt):
+        latency, text = self._plan_call(prompt)
+        chunks = self._chunks(text)
+        await asyncio.sleep(latency * FIRST_CHUNK_SHARE)
+        interval = latency * (1 - FIRST_CHUNK_SHARE) / max(1, len(chunks) - 1)
+        for index, chunk in enumerate(chunks):
+            if index:
+                await asyncio.sleep(interval)
+            yield chunk
+
+    async def count_tokens(self, prompt):
+        with self._lock:
+            self.token_counts += 1
+        await asyncio.sleep(self.count_tokens_seconds)
+        return count_raw_tokens(prompt)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "backend": self.name,
+                "calls": self.calls,
+                "rate_limited": self.rate_limited,
+                "malformed": self.malformed,
+                "token_counts": self.token_counts,
+            }
@@ -0,0 +1,209 @@
+# /profiling.py
+
+import os
+import sys
+import json
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+from collections import Counter
+
+from config import (
+    PROFILING_ENABLED, PROFILING_SAMPLE_RATE, PROFILING_MODE, PROFILING_SAMPLE_INTERVAL_SECONDS,
+    PROFILES_DIR, PROFILING_MAX_FILES
+)
+from database import get_user_data_path
+from metrics import request_spans
+
+PROFILING_MODES = ("sampling", "cprofile")
+# Ficheiros em que está o código de uma thread parada à espera (não contam como amostra)
+_IDLE_FILES = ("selectors.py", "threading.py", "queue.py", "thread.py")
+# Só um pedido é perfilado de cada vez: o cProfile e as amostras veem a thread inteira
+_active_lock = threading.Lock()
+
+
+def _requested_mode(value):
+    """Interpreta o valor do cabeçalho ou do parâmetro: None se não pede perfilagem."""
+    value = (value or "").strip().lower()
+    if value in ("", "0", "false", "no"):
+        return None
+    return value if value in PROFILING_MODES else PROFILING_MODE
+
+
+def profiler_for_request(header_value=None, query_value=None, label="chat"):
+    """
+    Devolve um RequestProfiler se este pedido deve ser perfilado (pedido pelo cabeçalho
+    ou pelo parâmetro do URL, PROFILING_ENABLED, ou sorteado com PROFILING_SAMPLE_RATE),
+    ou None, caso em que o pedido corre sem qualquer perfilador.
+    """
+    mode = _requested_mode(header_value) or _requested_mode(query_value)
+    if mode is None:
+        if not PROFILING_ENABLED and not (PROFILING_SAMPLE_RATE and random.random() < PROFILING_SAMPLE_RATE):
+            return None
+        mode = PROFILING_MODE
+    if not _active_lock.acquire(blocking=False):
+        logging.info("Perfilagem ignorada: já há outro pedido a ser perfilado.")
+        return None
+    return RequestProfiler(mode, label)
+
+
+def _frame_label(frame):
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def collapse_stack(frame):
+    """Pilha no formato 'collapsed' dos flame graphs (da raiz para a função atual, separada por ';')."""
+    labels = []
+    while frame is not None:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    return ";".join(reversed(labels))
+
+
+class _StackSampler:
+    """
+    Perfilador por amostragem: uma thread lê, a cada 'interval' segundos, a pilha da
+    thread do ciclo de eventos e das threads auxiliares do asyncio ('asyncio.to_thread'),
+    ignorando as que estão paradas à espera de trabalho.
+    """
+
+    def __init__(self, loop_thread_id, interval):
+        self.loop_thread_id = loop_thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _target_ids(self):
+        ids = {self.loop_thread_id}
+        ids.update(thread.ident for thread in threading.enumerate() if thread.name.startswith("asyncio_"))
+        return ids
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in self._target_ids():
+                frame = frames.get(thread_id)
+                if frame is None or os.path.basename(frame.f_code.co_filename) in _IDLE_FILES:
+                    continue
+                self.stacks[collapse_stack(frame)] += 1
+                self.samples += 1
+
+    def save(self, path):
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class RequestProfiler:
+    """
+    Perfila um pedido ('with', ou 'start'/'stop' quando o pedido acaba numa resposta em
+    streaming): no modo "cprofile" com o perfilador determinístico (ficheiro
+    .pstats) e no modo "sampling" por amostragem de pilhas (ficheiro .collapsed, para
+    flame graphs). Ao lado fica um .json com as etapas do pedido ('metrics.py'), a duração
+    e o modo. O perfil cobre a thread do servidor inteira durante o pedido, pelo que
+    inclui o trabalho de outros pedidos concorrentes.
+    """
+
+    def __init__(self, mode, label):
+        self.mode = mode
+        self.label = label
+        self.spans = []
+        self._profiler = None
+        self._spans_token = None
+        self._started_at = None
+        self._start = None
+        self._stopped = False
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.stop()
+        return False
+
+    def start(self):
+        self._started_at = time.time()
+        self._spans_token = request_spans.set(self.spans)
+        if self.mode == "cprofile":
+            self._profiler = cProfile.Profile()
+            self._profiler.enable()
+        else:
+            self._profiler = _StackSampler(threading.get_ident(), PROFILING_SAMPLE_INTERVAL_SECONDS)
+            self._profiler.start()
+        self._start = time.perf_counter()
+
+    def stop(self):
+        """Termina a perfilagem e guarda o perfil. Só a primeira chamada tem efeito."""
+        if self._stopped:
+            return
+        self._stopped = True
+        duration = time.perf_counter() - self._start
+        try:
+            if self.mode == "cprofile":
+                self._profiler.disable()
+            else:
+                self._profiler.stop()
+            try:
+                request_spans.reset(self._spans_token)
+            except ValueError:
+                # Terminado noutro contexto (ex.: no gerador de uma resposta em streaming)
+                request_spans.set(None)
+            self._save(duration)
+        except Exception as e:
+            logging.error(f"Erro ao guardar o perfil do pedido: {e}")
+        finally:
+            _active_lock.release()
+
+    def _save(self, duration):
+        profiles_dir = get_user_data_path(PROFILES_DIR)
+        os.makedirs(profiles_dir, exist_ok=True)
+        base_name = os.path.join(
+            profiles_dir, f"{time.strftime('%Y%m%d-%H%M%S', time.localtime(self._started_at))}-{self.label}-{os.urandom(3).hex()}"
+        )
+
+        if self.mode == "cprofile":
+            profile_path = base_name + ".pstats"
+            pstats.Stats(self._profiler).dump_stats(profile_path)
+            samples = None
+        else:
+            profile_path = base_name + ".collapsed"
+            self._profiler.save(profile_path)
+            samples = self._profiler.samples
+
+        with open(base_name + ".json", "w", encoding="utf-8") as f:
+            json.dump({
+                "label": self.label,
+                "mode": self.mode,
+                "started_at": self._started_at,
+                "duration_seconds": duration,
+                "profile_file": os.path.basename(profile_path),
+                "samples": samples,
+                "stages": [{"stage": stage, "seconds": seconds} for stage, seconds in self.spans],
+            }, f, ensure_ascii=False, indent=2)
+        logging.info(f"Perfil do pedido guardado em '{profile_path}' ({duration:.3f}s).")
+        _prune_profiles(profiles_dir)
+
+
+def _prune_profiles(profiles_dir):
+    """Mantém só os PROFILING_MAX_FILES perfis mais recentes (cada um com o seu .json)."""
+    metadata_files = sorted(name for name in os.listdir(profiles_dir) if name.endswith(".json"))
+    for name in metadata_files[:max(0, len(metadata_files) - PROFILING_MAX_FILES)]:
+        stem = name[:-len(".json")]
+        for extension in (".json", ".pstats", ".collapsed"):
+            path = os.path.join(profiles_dir, stem + extension)
+            if os.path.exists(path):
+                os.remove(path)
@@ -0,0 +1,177 @@
+# /rate_limiter.py
+
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from google.api_core import exceptions as google_exceptions
+
+# Número de esperas recentes usadas nos percentis das métricas
+RECENT_WAITS = 1000
+
+
+def is_rate_limit_error(e):
+    """Indica se a exceção é um 429 (quota ou limite de pedidos) da API."""
+    return isinstance(e, google_exceptions.TooManyRequests)
+
+
+def retry_delay_from_error(e):
+    """Devolve o atraso pedido pelo servidor num erro 429 (RetryInfo), em segundos, ou None."""
+    for detail in getattr(e, 'details', None) or ():
+        retry_delay = getattr(detail, 'retry_delay', None)
+        if retry_delay is not None:
+            return retry_delay.seconds + retry_delay.nanos / 1e9
+    return None
+
+
+class _Bucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.level = self.capacity
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def seconds_until(self, amount):
+        missing = amount - self.level
+        return max(0.0, missing / self.rate)
+
+
+class RateLimiter:
+    """
+    Limitador proativo das chamadas ao Gemini, partilhado por todo o servidor: dois
+    baldes de tokens (pedidos por minuto e tokens por minuto) e uma fila por utilizador,
+    servidas à vez, para que um utilizador com muitos pedidos não atrase os restantes.
+
+    Quando a API responde 429 com um atraso ('pause'), a fila inteira fica parada até lá,
+    em vez de cada pedido repetir por conta própria. Deve ser usado sempre a partir do
+    mesmo ciclo de eventos.
+    """
+
+    def __init__(self, requests_per_minute, tokens_per_minute):
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+        self._queues = OrderedDict()  # utilizador -> deque de (tokens, future)
+        self._paused_until = 0.0
+        self._timer = None
+        self._recent_waits = deque(maxlen=RECENT_WAITS)
+        self.granted = 0
+        self.max_queue_depth = 0
+        self.total_wait_seconds = 0.0
+        self.rate_limited = 0
+        self.paused_seconds = 0.0
+
+    def reconfigure(self, requests_per_minute, tokens_per_minute):
+        """Troca os orçamentos por minuto (ex.: num teste de carga com o modelo simulado)."""
+        self._requests = _Bucket(requests_per_minute)
+        self._tokens = _Bucket(tokens_per_minute)
+
+    @property
+    def queue_depth(self):
+        return sum(len(queue) for queue in self._queues.values())
+
+    async def acquire(self, user, tokens):
+        """
+        Espera pela vez deste pedido e consome 1 pedido e 'tokens' tokens do orçamento.
+        Retorna o tempo de espera, em segundos.
+        """
+        tokens = min(max(int(tokens), 1), int(self._tokens.capacity))
+        future = asyncio.get_running_loop().create_future()
+        entry = (tokens, future)
+        self._queues.setdefault(user, deque()).append(entry)
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+
+        start = time.monotonic()
+        self._dispatch()
+        try:
+            await future
+        except asyncio.CancelledError:
+            queue = self._queues.get(user)
+            if queue is not None and entry in queue:
+                queue.remove(entry)
+                if not queue:
+                    del self._queues[user]
+            raise
+
+        waited = time.monotonic() - start
+        self._recent_waits.append(waited)
+        self.total_wait_seconds += waited
+        if waited >= 1:
+            logging.info(f"Pedido ao Gemini esperou {waited:.1f}s na fila do limitador ({self.queue_depth} em espera).")
+        return waited
+
+    def pause(self, seconds):
+        """Para a fila durante 'seconds' (atraso indicado pelo servidor num erro 429)."""
+        self.rate_limited += 1
+        now = time.monotonic()
+        until = now + seconds
+        if until > self._paused_until:
+            self.paused_seconds += until - max(now, self._paused_until)
+            self._paused_until = until
+        logging.warning(f"Limite da API atingido. Novos pedidos em pausa durante {seconds:.1f}s.")
+        self._dispatch()
+
+    def _dispatch(self):
+        """Liberta os pedidos que cabem no orçamento atual, um utilizador de cada vez."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        while self._queues:
+            now = time.monotonic()
+            if now < self._paused_until:
+                self._schedule(self._paused_until - now)
+                return
+
+            user, queue = next(iter(self._queues.items()))
+            tokens, future = queue[0]
+            if future.done():  # Pedido cancelado entretanto
+                queue.popleft()
+            else:
+                self._requests.refill(now)
+                self._tokens.refill(now)
+                wait = max(self._requests.seconds_until(1), self._tokens.seconds_until(tokens))
+                if wait > 0:
+                    self._schedule(wait)
+                    return
+                self._requests.level -= 1
+                self._tokens.level -= tokens
+                queue.popleft()
+                future.set_result(None)
+                self.granted += 1
+
+            # Passa o utilizador para o fim da ordem (round-robin)
+            del self._queues[user]
+            if queue:
+                self._queues[user] = queue
+
+    def _schedule(self, delay):
+        self._timer = asyncio.get_running_loop().call_later(delay, self._dispatch)
+
+    def stats(self):
+        now = time.monotonic()
+        self._requests.refill(now)
+        self._tokens.refill(now)
+        waits = sorted(self._recent_waits)
+
+        def percentile(p):
+            return waits[min(len(waits) - 1, int(p * len(waits)))] if waits else 0.0
+
+        return {
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+            "waiting_users": len(self._queues),
+            "granted": self.granted,
+            "wait_p50_seconds": percentile(0.50),
+            "wait_p95_seconds": percentile(0.95),
+            "wait_max_seconds": waits[-1] if waits else 0.0,
+            "total_wait_seconds": self.total_wait_seconds,
+            "rate_limited": self.rate_limited,
+            "paused_seconds": self.paused_seconds,
+            "available_requests": self._requests.level,
+            "available_tokens": self._tokens.level,
+        }
@@ -0,0 +1,130 @@
+# /response_cache.py
+
+import re
+import json
+import time
+import hashlib
+import logging
+import threading
+import unicodedata
+
+from database import get_connection, transaction
+from history_summarizer import split_messages
+
+
+def normalize_prompt(prompt):
+    """Normaliza a pergunta para a chave da cache (maiúsculas, espaços e pontuação final)."""
+    text = unicodedata.normalize('NFKC', prompt).casefold()
+    text = re.sub(r'\s+', ' ', text).strip()
+    return text.rstrip('?!.;: ')
+
+
+class ResponseCache:
+    """
+    Cache persistente (tabela 'response_cache' da base de dados) das respostas da IA,
+    para que perguntas repetidas não gastem uma chamada nem quota do Gemini.
+
+    A chave combina a pergunta normalizada, o perfil, o nome do utilizador (as respostas
+    tratam-no pelo nome), o hash do contexto encontrado na base de conhecimento e as
+    últimas mensagens do histórico. Como o contexto faz parte da chave, alterar a base
+    de conhecimento invalida naturalmente as respostas que dependiam dela.
+    Os acessos à base de dados são bloqueantes: no servidor, chamar via 'asyncio.to_thread'.
+    """
+
+    def __init__(self, max_entries, ttl_seconds, history_messages, bypass_profiles=()):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.history_messages = history_messages
+        self.bypass_profiles = set(bypass_profiles)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.bypassed = 0
+
+    def is_enabled_for(self, profile_name):
+        if profile_name in self.bypass_profiles:
+            with self._lock:
+                self.bypassed += 1
+            return False
+        return True
+
+    def make_key(self, prompt, profile_name, user_name, knowledge_context, history):
+        # Últimas mensagens inteiras (uma resposta com código ocupa várias linhas)
+        recent_history = split_messages(history)[-self.history_messages:] if self.history_messages and history else []
+        parts = [
+            normalize_prompt(prompt),
+            profile_name,
+            user_name,
+            hashlib.sha256(knowledge_context.encode('utf-8')).hexdigest(),
+            "\x1e".join(message.strip() for message in recent_history),
+        ]
+        return hashlib.sha256("\x1f".join(parts).encode('utf-8')).hexdigest()
+
+    def get(self, key):
+        """Devolve a resposta guardada para a chave, ou None se não existir ou tiver expirado."""
+        now = time.time()
+        try:
+            cursor = get_connection().cursor()
+            cursor.execute(
+                "SELECT response FROM response_cache WHERE cache_key = ? AND created_at >= ?",
+                (key, now - self.ttl_seconds)
+            )
+            row = cursor.fetchone()
+            if row is not None:
+                with transaction() as cursor:
+                    cursor.execute(
+                        "UPDATE response_cache SET last_hit_at = ?, hit_count = hit_count + 1 WHERE cache_key = ?",
+                        (now, key)
+                    )
+        except Exception as e:
+            logging.error(f"Erro ao ler a cache de respostas: {e}")
+            row = None
+
+        with self._lock:
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, profile_name, response):
+        """Guarda uma resposta válida e remove as entradas expiradas e as menos usadas acima do limite."""
+        if not isinstance(response, dict) or "error" in response:
+            return
+        now = time.time()
+        try:
+            with transaction() as cursor:
+                cursor.execute(
+                    "INSERT OR REPLACE INTO response_cache (cache_key, profile, response, created_at, last_hit_at, hit_count) "
+                    "VALUES (?, ?, ?, ?, ?, 0)",
+                    (key, profile_name, json.dumps(response, ensure_ascii=False), now, now)
+                )
+                cursor.execute("DELETE FROM response_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+                cursor.execute(
+                    "DELETE FROM response_cache WHERE cache_key IN ("
+                    "SELECT cache_key FROM response_cache ORDER BY last_hit_at DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,)
+                )
+        except Exception as e:
+            logging.error(f"Erro ao guardar na cache de respostas: {e}")
+
+    def clear(self):
+        with transaction() as cursor:
+            cursor.execute("DELETE FROM response_cache")
+
+    def stats(self):
+        """Contadores desde o arranque e tamanho atual da cache persistente."""
+        cursor = get_connection().cursor()
+        cursor.execute("SELECT COUNT(*), COALESCE(SUM(hit_count), 0) FROM response_cache")
+        size, stored_hits = cursor.fetchone()
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": size,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "bypassed": self.bypassed,
+                "stored_hits": stored_hits,
+            }
@@ -0,0 +1,75 @@
+# /search_cache.py
+
+import time
+import threading
+from collections import OrderedDict
+
+
+class SearchCache:
+    """
+    Cache LRU de resultados de pesquisa, com expiração por TTL e invalidação por geração:
+    cada entrada guarda a geração da base de conhecimento em que foi calculada e deixa de
+    ser válida assim que uma escrita incrementa a geração.
+    """
+
+    def __init__(self, maxsize, ttl_seconds):
+        self.maxsize = maxsize
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.invalidations = 0
+
+    def get(self, key, generation):
+        """Devolve (True, valor) se houver uma entrada válida para a geração atual, senão (False, None)."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return False, None
+
+            entry_generation, stored_at, value = entry
+            if entry_generation != generation:
+                del self._entries[key]
+                self.invalidations += 1
+                self.misses += 1
+                return False, None
+            if time.monotonic() - stored_at > self.ttl_seconds:
+                del self._entries[key]
+                self.expirations += 1
+                self.misses += 1
+                return False, None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return True, value
+
+    def put(self, key, generation, value):
+        with self._lock:
+            self._entries[key] = (generation, time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        """Contadores para dimensionar a cache."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "invalidations": self.invalidations,
+            }
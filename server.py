@@ -1,51 +1,98 @@
 # /server.py
 
-from flask import Flask, request, jsonify
+from quart import Quart, Response, request, jsonify
+from hypercorn.asyncio import serve
+from hypercorn.config import Config as HypercornConfig
+import asyncio
+import hashlib
+import json
 import logging
 import time
-import sys
-import google.generativeai as genai
 
 # Importa as funções necessárias dos seus outros ficheiros
-from database import init_db, log_metric, search_knowledge_base
-from config import AI_PROFILES
-from gemini_integration import generate_response_from_gemini, configure_gemini_api
+from database import search_knowledge_snippets, search_cache
+from config import (
+    AI_PROFILES, RETRIEVAL_MODE, MAX_PROMPT_TOKENS, CONTEXT_CANDIDATES,
+    TOKEN_ESTIMATE_CACHE_SIZE, TOKEN_ESTIMATE_SAFETY_MARGIN, TOKEN_CALIBRATION_INTERVAL,
+    RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS, RESPONSE_CACHE_HISTORY_MESSAGES,
+    RESPONSE_CACHE_BYPASS_PROFILES, CHAT_WAIT_TIMEOUT_SECONDS, MAX_HISTORY_TOKENS,
+    HISTORY_SUMMARY_TOKENS, HISTORY_SUMMARY_LINE_TOKENS, HISTORY_SUMMARY_CACHE_SIZE,
+    SESSION_MEMORY_BUDGET_BYTES, SESSION_IDLE_TTL_SECONDS, PROFILING_HEADER, PROFILING_QUERY_FLAG,
+    BATCH_CONCURRENCY, BATCH_MAX_CONCURRENCY, BATCH_MAX_ITEMS
+)
+from gemini_integration import (
+    generate_response_from_gemini_async, stream_response_from_gemini_async,
+    extract_partial_solution, build_full_prompt, get_model_backend, rate_limiter
+)
+from token_estimator import TokenEstimator
+from context_packer import pack_prompt
+from history_summarizer import HistorySummarizer
+from sessions import SessionStore
+from metrics import metrics, current_profile, request_spans
+from profiling import profiler_for_request
+from response_cache import ResponseCache
+from singleflight import SingleFlight
 
 # Renomeia a variável da app para evitar conflitos
-server_app = Flask(__name__)
+server_app = Quart(__name__)
+# O cliente já define o seu próprio tempo limite; dá margem ao backoff do Gemini
+server_app.config['RESPONSE_TIMEOUT'] = 180
+
+# --- Estado Partilhado pelos Pedidos ---
+token_estimator = TokenEstimator(TOKEN_ESTIMATE_CACHE_SIZE)
+response_cache = ResponseCache(
+    RESPONSE_CACHE_MAX_ENTRIES, RESPONSE_CACHE_TTL_SECONDS,
+    RESPONSE_CACHE_HISTORY_MESSAGES, RESPONSE_CACHE_BYPASS_PROFILES
+)
+history_summarizer = HistorySummarizer(
+    MAX_HISTORY_TOKENS, HISTORY_SUMMARY_TOKENS, HISTORY_SUMMARY_LINE_TOKENS, HISTORY_SUMMARY_CACHE_SIZE
+)
+session_store = SessionStore(SESSION_MEMORY_BUDGET_BYTES, SESSION_IDLE_TTL_SECONDS)
+# Pedidos com o mesmo prompt final, em simultâneo, partilham uma única chamada ao Gemini
+single_flight = SingleFlight()
+_background_tasks = set()
 
 # --- FUNÇÃO DE GESTÃO DE TOKENS (REVISADA E OTIMIZADA) ---
-def manage_token_limit(payload):
+def build_prompt(p):
+    """Constrói o prompt completo a partir do payload."""
+    return build_full_prompt(p['prompt'], p['knowledge_context'], p['history'], p['user_name'], p['profile_instruction'])
+
+async def _calibrate_token_estimator(prompt):
+    """Contagem real em segundo plano, só para corrigir a estimativa local."""
+    try:
+        with metrics.span("count_tokens_api"):
+            actual_tokens = await get_model_backend().count_tokens(prompt)
+        estimated_tokens = token_estimator.estimate(prompt)
+        token_estimator.calibrate(prompt, actual_tokens)
+        logging.info(f"Estimativa de tokens calibrada: estimados {estimated_tokens}, reais {actual_tokens} (fator {token_estimator.factor:.3f}).")
+    except Exception as e:
+        logging.warning(f"Não foi possível calibrar a estimativa de tokens: {e}")
+
+async def manage_token_limit(payload):
     """
-    Verifica e ajusta o payload para não exceder o limite de tokens da API,
-    usando um método de truncamento mais eficiente.
+    Verifica e ajusta o payload para não exceder o limite de tokens da API, contando
+    localmente e só confirmando com a API quando a estimativa fica perto do limite.
     """
-    MAX_TOKENS = 1000000  # Limite seguro, um pouco abaixo do máximo real de 1,048,575
-
-    # Configura a API para poder usar o contador de tokens
-    if not configure_gemini_api():
-        return payload
-
-    def build_prompt(p):
-        """Função auxiliar para construir o prompt completo para contagem."""
-        return f"""
-        {p['profile_instruction'].format(user_name=p['user_name'])}
-        Histórico da Conversa Atual:
-        {p['history']}
-        Base de Conhecimento Relevante:
-        ---
-        {p['knowledge_context']}
-        ---
-        Pergunta do Utilizador ({p['user_name']}):
-        "{p['prompt']}"
-        """
+    MAX_TOKENS = MAX_PROMPT_TOKENS
 
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Faz uma contagem inicial
         full_prompt_for_counting = build_prompt(payload)
-        total_tokens = model.count_tokens(full_prompt_for_counting).total_tokens
+        estimated_tokens = token_estimator.estimate(full_prompt_for_counting)
+
+        if token_estimator.due_for_calibration(TOKEN_CALIBRATION_INTERVAL):
+            task = asyncio.create_task(_calibrate_token_estimator(full_prompt_for_counting))
+            _background_tasks.add(task)
+            task.add_done_callback(_background_tasks.discard)
+
+        if estimated_tokens < MAX_TOKENS * (1 - TOKEN_ESTIMATE_SAFETY_MARGIN):
+            return payload
+
+        # Perto do limite: confirma com a contagem real da API
+        logging.info(f"Estimativa de {estimated_tokens} tokens perto do limite. A confirmar com a API...")
+        backend = get_model_backend()
+        with metrics.span("count_tokens_api"):
+            total_tokens = await backend.count_tokens(full_prompt_for_counting)
+        token_estimator.calibrate(full_prompt_for_counting, total_tokens)
         logging.info(f"Contagem de tokens inicial: {total_tokens}")
 
         if total_tokens > MAX_TOKENS:
@@ -73,7 +120,8 @@ def manage_token_limit(payload):
 
             # Recalcula para garantir e logar o resultado final
             final_prompt = build_prompt(payload)
-            final_tokens = model.count_tokens(final_prompt).total_tokens
+            with metrics.span("count_tokens_api"):
+                final_tokens = await backend.count_tokens(final_prompt)
             logging.info(f"Nova contagem de tokens após truncar: {final_tokens}")
             if final_tokens > MAX_TOKENS:
                 logging.error("O truncamento não foi suficiente. O prompt inicial pode ser excessivamente grande.")
@@ -84,64 +132,358 @@ def manage_token_limit(payload):
     return payload
 
 
-@server_app.route('/chat', methods=['POST'])
-def chat():
-    """ Endpoint para receber as requisições de chat da interface gráfica. """
+def _search_snippets(query_text, mode):
+    with metrics.span("retrieval"):
+        return search_knowledge_snippets(query_text, mode, CONTEXT_CANDIDATES)
+
+
+async def prepare_chat_request(data):
+    """Valida o pedido e constrói o prompt final; retorna o pedido preparado, a resposta em cache ou um 'error'."""
+    if not data:
+        return {"error": "Requisição inválida", "status": 400}
+
+    user_prompt = data.get('prompt')
+    history = data.get('history', '')
+    user_name = data.get('user_name', 'Utilizador')
+    profile_name = data.get('profile', list(AI_PROFILES.keys())[0])
+    retrieval_mode = data.get('retrieval_mode', RETRIEVAL_MODE)
+
+    if not user_prompt:
+        return {"error": "Prompt é obrigatório", "status": 400}
+    # As etapas medidas daqui em diante (também nas threads e tarefas criadas) ficam associadas ao perfil
+    current_profile.set(profile_name)
+
+    session = None
+    if 'session_id' in data:
+        if data['session_id'] is None:
+            session = session_store.create(history)
+        else:
+            session = session_store.get(data['session_id'])
+            if session is None:
+                return {"error": "Sessão expirada. Reenvie o histórico completo.", "status": 409, "session_expired": True}
+        history = session.history
+    session_id = session.session_id if session else None
+
+    # A pesquisa (SQLite) e a configuração do modelo (keyring) são bloqueantes: correm
+    # em threads auxiliares, em paralelo, sem parar o ciclo de eventos
+    snippets, api_configured = await asyncio.gather(
+        asyncio.to_thread(_search_snippets, user_prompt, retrieval_mode),
+        asyncio.to_thread(get_model_backend().configure)
+    )
+
+    # Seleciona a instrução do perfil
+    profile_instruction = AI_PROFILES.get(profile_name, AI_PROFILES[list(AI_PROFILES.keys())[0]])
+
+    # As mensagens antigas do histórico são dobradas num resumo (incremental entre turnos)
+    with metrics.span("history_summary"):
+        if session:
+            compact_history, _ = session.compact_history(history_summarizer, token_estimator.estimate)
+        else:
+            compact_history, _ = history_summarizer.summarize(history, token_estimator.estimate)
+
+    # Escolhe os trechos e as mensagens do histórico que cabem no orçamento de tokens
+    with metrics.span("context_packing"):
+        prompt_tokens = token_estimator.estimate(user_prompt)
+        fixed_tokens = token_estimator.estimate(build_full_prompt(user_prompt, "", "", user_name, profile_instruction))
+        packed = pack_prompt(fixed_tokens - prompt_tokens, prompt_tokens, compact_history, snippets, token_estimator.estimate)
+    knowledge_context = packed["knowledge_context"]
+    used_kb = bool(knowledge_context)
+    logging.info(
+        f"Prompt empacotado: {packed['token_usage']} tokens estimados "
+        f"({packed['snippets_included']} de {len(snippets)} trecho(s), {packed['snippets_trimmed']} cortado(s))."
+    )
+
+    cache_key = None
+    if response_cache.is_enabled_for(profile_name):
+        cache_key = response_cache.make_key(user_prompt, profile_name, user_name, knowledge_context, history)
+        with metrics.span("response_cache_lookup"):
+            cached_response = await asyncio.to_thread(response_cache.get, cache_key)
+        if cached_response is not None:
+            metrics.incr("cached_responses")
+            logging.info("Resposta obtida da cache de respostas.")
+            return {
+                "cached_response": cached_response, "used_kb": used_kb, "profile_name": profile_name,
+                "user_prompt": user_prompt, "session_id": session_id
+            }
+
+    if not api_configured:
+        return {"error": "Falha ao configurar a API do Gemini. Verifique a sua chave.", "status": 200}
+
+    # Cria um payload para verificação de tokens
+    payload_to_verify = {
+        "prompt": user_prompt,
+        "knowledge_context": knowledge_context,
+        "history": packed["history"],
+        "user_name": user_name,
+        "profile_instruction": profile_instruction
+    }
+
+    # Garante que o payload não exceda o limite de tokens
+    with metrics.span("token_limit"):
+        managed_payload = await manage_token_limit(payload_to_verify)
+
+    full_prompt = build_prompt(managed_payload)
+    return {
+        "full_prompt": full_prompt,
+        "prompt_key": hashlib.sha256(full_prompt.encode('utf-8')).hexdigest(),
+        "estimated_tokens": token_estimator.estimate(full_prompt),
+        "token_usage": packed["token_usage"],
+        "user_name": user_name,
+        "used_kb": used_kb,
+        "profile_name": profile_name,
+        "cache_key": cache_key,
+        "user_prompt": user_prompt,
+        "session_id": session_id
+    }
+
+
+async def _generate_and_cache(prepared):
+    response_data = await generate_response_from_gemini_async(
+        prepared["full_prompt"], prepared["user_name"], prepared["estimated_tokens"]
+    )
+    if prepared["cache_key"]:
+        await asyncio.to_thread(response_cache.put, prepared["cache_key"], prepared["profile_name"], response_data)
+    return response_data
+
+async def _stream_and_cache(prepared):
+    async for kind, value in stream_response_from_gemini_async(
+        prepared["full_prompt"], prepared["user_name"], prepared["estimated_tokens"]
+    ):
+        yield kind, value
+        if kind == "resposta" and prepared["cache_key"]:
+            await asyncio.to_thread(response_cache.put, prepared["cache_key"], prepared["profile_name"], value)
+
+
+def finish_session_turn(prepared, response_data):
+    """Guarda o turno na sessão (se houver) e devolve a resposta com o 'session_id'."""
+    if prepared["session_id"] is None:
+        return response_data
+    session_store.record_turn(prepared["session_id"], prepared["user_prompt"], response_data)
+    return {**response_data, "session_id": prepared["session_id"]}
+
+def error_response(prepared):
+    """Corpo de resposta para um resultado de 'prepare_chat_request' com erro."""
+    return {key: value for key, value in prepared.items() if key != "status"}
+
+
+async def answer_chat_request(data):
+    """Responde a um pedido de '/chat' e retorna (dict_de_resposta, estado_http)."""
     start_time = time.time()
+    metrics.incr("requests")
     try:
-        data = request.get_json()
-        if not data:
-            return jsonify({"error": "Requisição inválida"}), 400
-
-        user_prompt = data.get('prompt')
-        history = data.get('history', '')
-        user_name = data.get('user_name', 'Utilizador')
-        profile_name = data.get('profile', list(AI_PROFILES.keys())[0])
-
-        if not user_prompt:
-            return jsonify({"error": "Prompt é obrigatório"}), 400
-        
-        # O servidor agora é responsável por buscar na base de conhecimento
-        knowledge_context = search_knowledge_base(user_prompt)
-
-        # Seleciona a instrução do perfil
-        profile_instruction = AI_PROFILES.get(profile_name, AI_PROFILES[list(AI_PROFILES.keys())[0]])
-
-        # Cria um payload para verificação de tokens
-        payload_to_verify = {
-            "prompt": user_prompt,
-            "knowledge_context": knowledge_context,
-            "history": history,
-            "user_name": user_name,
-            "profile_instruction": profile_instruction
-        }
-
-        # Garante que o payload não exceda o limite de tokens
-        managed_payload = manage_token_limit(payload_to_verify)
-
-        # Chama a função centralizada para obter a resposta da IA com o payload ajustado
-        response_data = generate_response_from_gemini(
-            managed_payload["prompt"],
-            managed_payload["knowledge_context"],
-            managed_payload["history"],
-            managed_payload["user_name"],
-            managed_payload["profile_instruction"]
-        )
-
-        # Loga a métrica de desempenho
+        with metrics.span("prepare"):
+            prepared = await prepare_chat_request(data)
+        if "error" in prepared:
+            return error_response(prepared), prepared["status"]
+
+        if "cached_response" in prepared:
+            response_data = prepared["cached_response"]
+        else:
+            # Obtém a resposta da IA com o payload ajustado (partilhada com pedidos idênticos em curso)
+            response_data = await single_flight.call(
+                ("chat", prepared["prompt_key"]),
+                lambda: _generate_and_cache(prepared),
+                timeout=CHAT_WAIT_TIMEOUT_SECONDS
+            )
+
+        # Loga a métrica de desempenho (gravada em segundo plano)
         end_time = time.time()
         response_time = end_time - start_time
-        used_kb = bool(knowledge_context)
-        log_metric(response_time, used_kb, profile_name)
+        metrics.log_request(response_time, prepared["used_kb"], prepared["profile_name"])
 
-        return jsonify(response_data)
+        return finish_session_turn(prepared, response_data), 200
 
+    except TimeoutError:
+        metrics.incr("timeouts")
+        logging.error(f"Tempo esgotado à espera da resposta da IA ({CHAT_WAIT_TIMEOUT_SECONDS}s).")
+        return {"error": "Tempo esgotado à espera da resposta da IA. Tente novamente."}, 504
     except Exception as e:
+        metrics.incr("server_errors")
         logging.error(f"Erro no servidor ao processar a requisição: {e}", exc_info=True)
-        return jsonify({"error": f"Erro interno no servidor: {e}"}), 500
+        return {"error": f"Erro interno no servidor: {e}"}, 500
+
+
+@server_app.route('/chat', methods=['POST'])
+async def chat():
+    """Endpoint para receber as requisições de chat da interface gráfica."""
+    profiler = profiler_for_request(request.headers.get(PROFILING_HEADER), request.args.get(PROFILING_QUERY_FLAG))
+    if profiler is None:
+        response_data, status = await answer_chat_request(await request.get_json())
+    else:
+        with profiler:
+            response_data, status = await answer_chat_request(await request.get_json())
+    return jsonify(response_data), status
+
+
+async def answer_batch(items, concurrency=None):
+    """Gera (índice, resposta) de cada pedido do lote, pela ordem em que ficam prontas."""
+    semaphore = asyncio.Semaphore(concurrency or BATCH_CONCURRENCY)
+
+    async def answer(index, item):
+        async with semaphore:
+            response_data, status = await answer_chat_request(item)
+            return index, response_data
+
+    tasks = [asyncio.create_task(answer(index, item)) for index, item in enumerate(items)]
+    try:
+        for next_answer in asyncio.as_completed(tasks):
+            yield await next_answer
+    finally:
+        # Se quem consome desistir (ex.: ligação fechada), as perguntas por responder são canceladas
+        for task in tasks:
+            task.cancel()
+
+
+def run_batch(items, concurrency=None):
+    """Versão síncrona de 'answer_batch' para scripts: devolve as respostas pela ordem dos pedidos."""
+    async def collect():
+        results = [None] * len(items)
+        async for index, response_data in answer_batch(items, concurrency):
+            results[index] = response_data
+        return results
+
+    return asyncio.run(collect())
+
+
+@server_app.route('/chat/batch', methods=['POST'])
+async def chat_batch():
+    """Responde a várias perguntas em paralelo, em NDJSON, uma linha por pergunta."""
+    data = await request.get_json()
+    items = data.get('items') if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "'items' deve ser uma lista não vazia"}), 400
+    if len(items) > BATCH_MAX_ITEMS:
+        return jsonify({"error": f"Máximo de {BATCH_MAX_ITEMS} perguntas por lote"}), 400
+
+    defaults = {key: data[key] for key in ('user_name', 'profile', 'history', 'retrieval_mode') if key in data}
+    requests_data = [
+        {**defaults, **(item if isinstance(item, dict) else {"prompt": item})}
+        for item in items
+    ]
+    try:
+        concurrency = max(1, min(int(data.get('concurrency') or BATCH_CONCURRENCY), BATCH_MAX_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'concurrency' deve ser um número inteiro"}), 400
+    logging.info(f"Lote de {len(items)} pergunta(s) recebido (paralelismo {concurrency}).")
+
+    async def lines():
+        errors = 0
+        async for index, response_data in answer_batch(requests_data, concurrency):
+            if isinstance(response_data, dict) and "error" in response_data:
+                errors += 1
+            yield json.dumps({"index": index, "response": response_data}, ensure_ascii=False) + "\n"
+        yield json.dumps({"done": True, "count": len(items), "errors": errors}) + "\n"
+
+    response = Response(lines(), mimetype="application/x-ndjson")
+    response.timeout = None  # Um lote pode demorar muito mais do que um pedido isolado
+    return response
+
+
+def format_sse(event, data):
+    """Formata um evento 'server-sent events' com dados em JSON."""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+@server_app.route('/chat/stream', methods=['POST'])
+async def chat_stream():
+    """Variante em streaming de '/chat': eventos 'delta' com o texto novo e um 'done' final."""
+    start_time = time.time()
+    metrics.incr("requests")
+    profiler = profiler_for_request(
+        request.headers.get(PROFILING_HEADER), request.args.get(PROFILING_QUERY_FLAG), label="stream"
+    )
+    if profiler is not None:
+        profiler.start()
+        # Se o cliente desligar antes de o corpo começar a ser enviado, o 'finally' de
+        # 'events' nunca corre; o fim da tarefa do pedido para o perfilador em qualquer caso
+        asyncio.current_task().add_done_callback(lambda task: profiler.stop())
+    try:
+        with metrics.span("prepare"):
+            prepared = await prepare_chat_request(await request.get_json())
+    except Exception as e:
+        metrics.incr("server_errors")
+        logging.error(f"Erro no servidor ao processar a requisição: {e}", exc_info=True)
+        prepared = {"error": f"Erro interno no servidor: {e}", "status": 500}
+    if "error" in prepared:
+        if profiler is not None:
+            profiler.stop()
+        return jsonify(error_response(prepared)), prepared["status"]
+
+    async def events():
+        raw_text = ""
+        shown_text = ""
+        time_to_first_token = None
+        if profiler is not None:
+            request_spans.set(profiler.spans)  # O gerador pode correr noutro contexto
+        try:
+            if "cached_response" in prepared:
+                time_to_first_token = time.time() - start_time
+                yield format_sse("done", finish_session_turn(prepared, prepared["cached_response"]))
+            else:
+                shared_events = single_flight.stream(
+                    ("stream", prepared["prompt_key"]),
+                    lambda: _stream_and_cache(prepared),
+                    timeout=CHAT_WAIT_TIMEOUT_SECONDS
+                )
+                async for kind, value in shared_events:
+                    if kind == "resposta":
+                        yield format_sse("done", finish_session_turn(prepared, value))
+                        break
+                    if time_to_first_token is None:
+                        time_to_first_token = time.time() - start_time
+                    raw_text += value
+                    # Envia apenas o que foi acrescentado ao texto visível desde o último evento
+                    preview = extract_partial_solution(raw_text) or ""
+                    if preview.startswith(shown_text) and len(preview) > len(shown_text):
+                        yield format_sse("delta", {"text": preview[len(shown_text):]})
+                        shown_text = preview
+        except TimeoutError:
+            metrics.incr("timeouts")
+            logging.error(f"Tempo esgotado à espera da resposta da IA ({CHAT_WAIT_TIMEOUT_SECONDS}s).")
+            yield format_sse("done", finish_session_turn(
+                prepared, {"error": "Tempo esgotado à espera da resposta da IA. Tente novamente."}
+            ))
+        except Exception as e:
+            metrics.incr("server_errors")
+            logging.error(f"Erro no servidor durante o streaming: {e}", exc_info=True)
+            yield format_sse("done", finish_session_turn(prepared, {"error": f"Erro interno no servidor: {e}"}))
+        finally:
+            if profiler is not None:
+                profiler.stop()
+
+        response_time = time.time() - start_time
+        metrics.log_request(response_time, prepared["used_kb"], prepared["profile_name"], time_to_first_token)
+
+    return Response(events(), mimetype="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+@server_app.route('/metrics', methods=['GET'])
+async def metrics_report():
+    """Tempos por etapa, contadores e estado das caches, do limitador e do backend do modelo."""
+    report = metrics.snapshot()
+    report.update({
+        "search_cache": search_cache.stats(),
+        "response_cache": await asyncio.to_thread(response_cache.stats),
+        "token_estimator": token_estimator.stats(),
+        "history_summarizer": history_summarizer.stats(),
+        "single_flight": single_flight.stats(),
+        "rate_limiter": rate_limiter.stats(),
+        "sessions": session_store.stats(),
+        "model_backend": get_model_backend().stats(),
+    })
+    return jsonify(report)
+
+
+def run_server(host="127.0.0.1", port=5000):
+    """Função principal para iniciar o servidor ASGI (Hypercorn)."""
+    log = logging.getLogger('hypercorn.error')
+    log.setLevel(logging.ERROR) # Oculta os logs padrão do servidor para um terminal mais limpo
+    config = HypercornConfig()
+    config.bind = [f"{host}:{port}"]
+    config.accesslog = None
+    config.errorlog = log
+
+    async def serve_forever():
+        # Sem 'shutdown_trigger' o Hypercorn instalaria handlers de sinais, o que falha fora da thread principal
+        await serve(server_app, config, shutdown_trigger=asyncio.Event().wait)
 
-def run_server():
-    """ Função principal para iniciar o servidor Flask. """
-    log = logging.getLogger('werkzeug')
-    log.setLevel(logging.ERROR) # Oculta os logs padrão do Flask para um terminal mais limpo
-    server_app.run(host='127.0.0.1', port=5000, debug=False)
+    asyncio.run(serve_forever())
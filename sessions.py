@@ -0,0 +1,140 @@
+# /sessions.py
+
+import sys
+import time
+import uuid
+import logging
+import threading
+from collections import OrderedDict
+
+from history_summarizer import split_messages
+
+
+def format_user_message(prompt):
+    return f"Utilizador: {prompt}"
+
+
+def format_ai_message(response_data):
+    """Formata uma resposta da IA tal como a interface a envia no histórico ('get_formatted_history')."""
+    parts = []
+    if response_data.get("solucao"):
+        parts.append(response_data["solucao"])
+    if response_data.get("codigo"):
+        parts.append(f"```\n{response_data['codigo']}\n```")
+    if response_data.get("verificacao"):
+        parts.append(f"**Verificação:**\n{response_data['verificacao']}")
+    if response_data.get("fonte_contexto"):
+        parts.append(f"*{response_data['fonte_contexto']}*")
+    return "IA: " + (" ".join(parts) or "Não obtive uma resposta válida.")
+
+
+class ChatSession:
+    """
+    Estado de uma conversa guardado no servidor: as mensagens (só acrescentadas, nunca
+    alteradas), o histórico já formatado e o histórico comprimido do último turno.
+    """
+
+    __slots__ = ("session_id", "messages", "history", "size_bytes", "last_used", "_compact")
+
+    def __init__(self, session_id, messages):
+        self.session_id = session_id
+        self.messages = list(messages)
+        self.history = "\n".join(self.messages)
+        self.size_bytes = sum(sys.getsizeof(message) for message in self.messages) + sys.getsizeof(self.history)
+        self.last_used = time.monotonic()
+        self._compact = None
+
+    def append(self, message):
+        self.messages.append(message)
+        self.history = f"{self.history}\n{message}" if self.history else message
+        self.size_bytes += 2 * sys.getsizeof(message)
+
+    def compact_history(self, summarizer, count_tokens):
+        """Histórico comprimido ('HistorySummarizer'), recalculado só quando chegam mensagens novas."""
+        if self._compact is None or self._compact[0] != len(self.messages):
+            text, tokens = summarizer.summarize(self.history, count_tokens)
+            if self._compact is not None:
+                self.size_bytes -= sys.getsizeof(self._compact[1])
+            self._compact = (len(self.messages), text, tokens)
+            self.size_bytes += sys.getsizeof(text)
+        return self._compact[1], self._compact[2]
+
+
+class SessionStore:
+    """
+    Sessões de chat em memória, para que o cliente envie só a mensagem nova em cada
+    turno. As sessões paradas há mais de 'idle_ttl_seconds' são removidas e, acima de
+    'memory_budget_bytes' (estimativa), saem primeiro as usadas há mais tempo. Um
+    cliente cuja sessão já não existe volta a enviar o histórico completo.
+    """
+
+    def __init__(self, memory_budget_bytes, idle_ttl_seconds):
+        self.memory_budget_bytes = memory_budget_bytes
+        self.idle_ttl_seconds = idle_ttl_seconds
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def create(self, history=""):
+        """Cria uma sessão, opcionalmente com o histórico que o cliente já tinha."""
+        session = ChatSession(uuid.uuid4().hex, split_messages(history) if history else [])
+        with self._lock:
+            self._sessions[session.session_id] = session
+            self.created += 1
+            self._evict()
+        return session
+
+    def get(self, session_id):
+        """Devolve a sessão (e marca-a como usada), ou None se não existir ou tiver expirado."""
+        with self._lock:
+            self._evict()
+            session = self._sessions.get(session_id)
+            if session is not None:
+                session.last_used = time.monotonic()
+                self._sessions.move_to_end(session_id)
+            return session
+
+    def record_turn(self, session_id, user_prompt, response_data):
+        """Acrescenta a pergunta e a resposta à sessão. Os turnos com erro não ficam no histórico."""
+        if not isinstance(response_data, dict) or "error" in response_data:
+            return
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            session.append(format_user_message(user_prompt))
+            session.append(format_ai_message(response_data))
+            session.last_used = time.monotonic()
+            self._sessions.move_to_end(session_id)
+            self._evict()
+
+    def _evict(self):
+        now = time.monotonic()
+        memory_bytes = self._memory_bytes()
+        while self._sessions:
+            session = next(iter(self._sessions.values()))
+            if now - session.last_used > self.idle_ttl_seconds:
+                self.expired += 1
+            elif len(self._sessions) > 1 and memory_bytes > self.memory_budget_bytes:
+                self.evicted += 1
+            else:
+                break
+            del self._sessions[session.session_id]
+            memory_bytes -= session.size_bytes
+            logging.info(f"Sessão de chat {session.session_id} removida da memória.")
+
+    def _memory_bytes(self):
+        return sum(session.size_bytes for session in self._sessions.values())
+
+    def stats(self):
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "memory_bytes": self._memory_bytes(),
+                "memory_budget_bytes": self.memory_budget_bytes,
+                "created": self.created,
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
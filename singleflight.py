@@ -0,0 +1,114 @@
+# /singleflight.py
+
+import asyncio
+
+
+async def _wait_for(awaitable, timeout):
+    """'asyncio.wait_for' que levanta sempre o TimeoutError embutido (no Python 3.10 são classes diferentes)."""
+    try:
+        return await asyncio.wait_for(awaitable, timeout)
+    except asyncio.TimeoutError:
+        raise TimeoutError from None
+
+
+class _SharedStream:
+    """
+    Consome um gerador assíncrono uma única vez e guarda os itens produzidos, para que
+    vários subscritores os recebam todos, incluindo os que chegaram depois do início.
+    """
+
+    def __init__(self, agen):
+        self.items = []
+        self.done = False
+        self.error = None
+        self._changed = asyncio.Condition()
+        self.task = asyncio.ensure_future(self._pump(agen))
+
+    async def _pump(self, agen):
+        try:
+            async for item in agen:
+                self.items.append(item)
+                async with self._changed:
+                    self._changed.notify_all()
+        except Exception as e:
+            self.error = e
+        finally:
+            self.done = True
+            async with self._changed:
+                self._changed.notify_all()
+
+    async def subscribe(self, deadline=None):
+        index = 0
+        loop = asyncio.get_running_loop()
+        while True:
+            async with self._changed:
+                remaining = None if deadline is None else deadline - loop.time()
+                await _wait_for(self._changed.wait_for(lambda: index < len(self.items) or self.done), remaining)
+            while index < len(self.items):
+                yield self.items[index]
+                index += 1
+            if self.done and index == len(self.items):
+                if self.error is not None:
+                    raise self.error
+                return
+
+
+class SingleFlight:
+    """
+    Junta pedidos idênticos em curso numa única chamada: o primeiro pedido com uma chave
+    inicia a chamada e os seguintes, enquanto ela não terminar, esperam pelo mesmo
+    resultado. O tempo limite e o cancelamento são de cada pedido: um pedido que desiste
+    não cancela a chamada partilhada, e um erro da chamada chega a todos os que esperam.
+    Deve ser usado sempre a partir do mesmo ciclo de eventos.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._streams = {}
+        self.started = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def _forget_when_done(registry, key, entry, task):
+        def forget(_):
+            if registry.get(key) is entry:
+                del registry[key]
+        task.add_done_callback(forget)
+
+    async def call(self, key, coroutine_factory, timeout=None):
+        """Devolve o resultado de 'await coroutine_factory()', partilhado com os pedidos iguais em curso."""
+        task = self._calls.get(key)
+        if task is None:
+            task = asyncio.ensure_future(coroutine_factory())
+            self._calls[key] = task
+            self._forget_when_done(self._calls, key, task, task)
+            self.started += 1
+        else:
+            self.coalesced += 1
+        # 'shield' impede que o tempo limite deste pedido cancele a chamada partilhada
+        return await _wait_for(asyncio.shield(task), timeout)
+
+    async def stream(self, key, generator_factory, timeout=None):
+        """
+        Gera os itens de 'generator_factory()', partilhado com os pedidos iguais em curso.
+        Quem chega depois recebe primeiro os itens já produzidos. 'timeout' limita o tempo
+        total de espera deste subscritor (levanta TimeoutError só para ele).
+        """
+        shared = self._streams.get(key)
+        if shared is None:
+            shared = _SharedStream(generator_factory())
+            self._streams[key] = shared
+            self._forget_when_done(self._streams, key, shared, shared.task)
+            self.started += 1
+        else:
+            self.coalesced += 1
+        deadline = asyncio.get_running_loop().time() + timeout if timeout else None
+        async for item in shared.subscribe(deadline):
+            yield item
+
+    def stats(self):
+        return {
+            "in_flight": len(self._calls) + len(self._streams),
+            "started": self.started,
+            "coalesced": self.coalesced,
+        }
@@ -0,0 +1,9 @@
+# /tests/conftest.py
+
+import os
+import sys
+import tempfile
+
+# Os módulos da aplicação estão na raiz do repositório; os dados vão para uma pasta temporária
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("AITECHEXPERT_DATA_DIR", tempfile.mkdtemp(prefix="aitechexpert-tests-"))
@@ -0,0 +1,35 @@
+# /tests/test_ingestion.py
+
+import os
+import time
+import signal
+import threading
+import multiprocessing
+
+import pytest
+
+from database import init_db
+from ingestion import ingest_files_parallel
+
+
+def _kill_extraction_workers(delay):
+    time.sleep(delay)
+    for child in multiprocessing.active_children():
+        os.kill(child.pid, signal.SIGKILL)
+
+
+@pytest.mark.skipif(not hasattr(os, "mkfifo"), reason="Precisa de um FIFO para bloquear a extração")
+def test_dead_worker_fails_its_file_without_waiting_for_the_timeout(tmp_path):
+    init_db()
+    # Ler um FIFO sem escritor bloqueia o processo de extração, que é então morto (como num OOM)
+    blocked = tmp_path / "bloqueia.txt"
+    os.mkfifo(blocked)
+    document = tmp_path / "documento.txt"
+    document.write_text("configuração da firewall e da tabela de rotas " * 20, encoding="utf-8")
+
+    threading.Thread(target=_kill_extraction_workers, args=(2,), daemon=True).start()
+    started = time.monotonic()
+    result = ingest_files_parallel([str(blocked), str(document)], workers=1, file_timeout=60)
+
+    assert result == (1, ["bloqueia.txt"])
+    assert time.monotonic() - started < 30
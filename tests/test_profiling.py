@@ -0,0 +1,70 @@
+# /tests/test_profiling.py
+
+import asyncio
+import json
+
+import pytest
+
+import profiling
+import server
+from config import PROFILING_HEADER
+from database import init_db
+from gemini_integration import set_model_backend
+from model_backends import FakeModelBackend
+
+
+@pytest.fixture(autouse=True)
+def fake_backend():
+    init_db()
+    set_model_backend(FakeModelBackend(latency_seconds=0, count_tokens_seconds=0, seed=1))
+
+
+def _scope(path):
+    return {
+        "type": "http", "asgi": {"version": "3.0"}, "http_version": "1.1", "method": "POST",
+        "scheme": "http", "path": path, "raw_path": path.encode(), "query_string": b"", "root_path": "",
+        "headers": [(b"content-type", b"application/json"), (PROFILING_HEADER.lower().encode(), b"sampling")],
+        "client": ("127.0.0.1", 1234), "server": ("127.0.0.1", 5000),
+    }
+
+
+async def _abandoned_stream():
+    """Pedido a '/chat/stream' cujo cliente desliga antes de receber o primeiro fragmento."""
+    disconnected = asyncio.Event()
+    messages = [{"type": "http.request", "body": json.dumps({"prompt": "firewall"}).encode(), "more_body": False}]
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await disconnected.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        if message["type"] == "http.response.start":
+            disconnected.set()
+            await asyncio.Event().wait()  # O cliente já não lê nada
+
+    await asyncio.wait_for(server.server_app(_scope("/chat/stream"), receive, send), timeout=10)
+
+
+def _profiling_lock_is_free():
+    if not profiling._active_lock.acquire(blocking=False):
+        return False
+    profiling._active_lock.release()
+    return True
+
+
+def test_abandoned_stream_releases_profiler():
+    asyncio.run(_abandoned_stream())
+    assert _profiling_lock_is_free()
+
+
+def test_completed_stream_releases_profiler():
+    async def request():
+        response = await server.server_app.test_client().post(
+            "/chat/stream", json={"prompt": "firewall"}, headers={PROFILING_HEADER: "sampling"}
+        )
+        return await response.get_data(as_text=True)
+
+    assert "event: done" in asyncio.run(request())
+    assert _profiling_lock_is_free()
@@ -0,0 +1,104 @@
+# /token_estimator.py
+
+import re
+import math
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Palavras e sinais de pontuação, aproximando a pré-tokenização do modelo
+_PIECE_RE = re.compile(r"\w+|[^\w\s]")
+# Caracteres médios por token dentro de uma palavra longa (antes da calibração)
+CHARS_PER_WORD_TOKEN = 4
+# Linhas mais curtas do que isto são contadas diretamente (o hash custaria o mesmo)
+MIN_CACHED_LINE_CHARS = 64
+# Peso de cada nova contagem real na correção calibrada
+CALIBRATION_WEIGHT = 0.2
+
+
+def count_raw_tokens(text):
+    """Contagem local, sem calibração: um token por sinal e ~4 caracteres por token nas palavras."""
+    total = 0
+    for piece in _PIECE_RE.findall(text):
+        total += math.ceil(len(piece) / CHARS_PER_WORD_TOKEN) if len(piece) > CHARS_PER_WORD_TOKEN else 1
+    return total
+
+
+class TokenEstimator:
+    """
+    Estimativa local do número de tokens de um prompt, sem chamadas de rede.
+
+    O texto é contado linha a linha e a contagem de cada linha fica em cache (LRU), pelo
+    que os segmentos que não mudam entre pedidos (instruções do perfil, mensagens antigas
+    do histórico, trechos repetidos do contexto) não são recontados. O resultado é
+    multiplicado por um fator corrigido com as contagens reais da API ('calibrate').
+    """
+
+    def __init__(self, maxsize):
+        self.maxsize = maxsize
+        self.factor = 1.0
+        self.calibrations = 0
+        self._checks = 0
+        self._lines = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def _line_tokens(self, line):
+        if len(line) < MIN_CACHED_LINE_CHARS:
+            return count_raw_tokens(line)
+        key = hashlib.blake2b(line.encode('utf-8'), digest_size=16).digest()
+        with self._lock:
+            tokens = self._lines.get(key)
+            if tokens is not None:
+                self._lines.move_to_end(key)
+                self.hits += 1
+                return tokens
+            self.misses += 1
+        tokens = count_raw_tokens(line)
+        with self._lock:
+            self._lines[key] = tokens
+            while len(self._lines) > self.maxsize:
+                self._lines.popitem(last=False)
+        return tokens
+
+    def count_raw(self, text):
+        """Contagem local (não calibrada) de um texto, usando a cache por linha."""
+        lines = text.split("\n")
+        return sum(self._line_tokens(line) for line in lines) + len(lines) - 1
+
+    def estimate(self, text):
+        """Número estimado de tokens do texto, já corrigido pela calibração."""
+        return math.ceil(self.count_raw(text) * self.factor)
+
+    def calibrate(self, text, actual_tokens):
+        """Ajusta o fator de correção com a contagem real de um texto devolvida pela API."""
+        raw_tokens = self.count_raw(text)
+        if raw_tokens <= 0 or actual_tokens <= 0:
+            return
+        ratio = actual_tokens / raw_tokens
+        with self._lock:
+            if self.calibrations == 0:
+                self.factor = ratio
+            else:
+                self.factor += CALIBRATION_WEIGHT * (ratio - self.factor)
+            self.calibrations += 1
+
+    def due_for_calibration(self, interval):
+        """Indica se este pedido deve ser usado para calibrar (o primeiro e depois um em cada 'interval')."""
+        with self._lock:
+            self._checks += 1
+            return (self._checks - 1) % interval == 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "cached_lines": len(self._lines),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "factor": self.factor,
+                "calibrations": self.calibrations,
+            }
@@ -0,0 +1,145 @@
+# /vector_index.py
+
+import os
+import math
+import hashlib
+import threading
+from collections import Counter
+
+import numpy as np
+
+from config import VECTOR_DIM
+
+# Linhas convertidas para float32 de cada vez durante a pesquisa (limita a memória temporária)
+SCORE_BLOCK_ROWS = 32768
+STEM_PREFIX_CHARS = 5
+
+
+def _feature_slot(feature):
+    """Mapeia uma característica para (posição, sinal) de forma determinística entre processos."""
+    digest = hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest()
+    value = int.from_bytes(digest, 'little')
+    return value % VECTOR_DIM, 1.0 if (value >> 63) & 1 else -1.0
+
+
+def embed_terms(terms):
+    """
+    Converte uma lista de termos num vetor denso normalizado (feature hashing de
+    unigramas, prefixos e bigramas com frequência sublinear). Não faz nenhuma chamada de rede.
+    """
+    features = Counter(terms)
+    # Prefixos aproximam radicais ("configurar" / "configuração") sem depender de um stemmer
+    features.update(f"{term[:STEM_PREFIX_CHARS]}~" for term in terms if len(term) > STEM_PREFIX_CHARS)
+    features.update(f"{a} {b}" for a, b in zip(terms, terms[1:]))
+
+    vector = np.zeros(VECTOR_DIM, dtype=np.float32)
+    for feature, count in features.items():
+        slot, sign = _feature_slot(feature)
+        vector[slot] += sign * (1.0 + math.log(count))
+
+    norm = np.linalg.norm(vector)
+    if norm > 0:
+        vector /= norm
+    return vector
+
+
+class VectorIndex:
+    """
+    Matriz contígua de vetores float16 num ficheiro memory-mapped, ao lado da base de dados.
+    Cada linha pertence a um fragmento ('chunks.vector_row'); linhas removidas são zeradas
+    e deixam de pontuar até à próxima compactação.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._matrix = None
+        self._mapped_rows = 0
+        self._next_row = None
+
+    @property
+    def row_bytes(self):
+        return VECTOR_DIM * np.dtype(np.float16).itemsize
+
+    def row_count(self):
+        if not os.path.exists(self.path):
+            return 0
+        return os.path.getsize(self.path) // self.row_bytes
+
+    def _mapped_matrix(self):
+        """Devolve o memmap atual, reabrindo-o apenas se o ficheiro cresceu desde a última pesquisa."""
+        rows = self.row_count()
+        with self._lock:
+            if rows != self._mapped_rows or self._matrix is None:
+                self._matrix = (
+                    np.memmap(self.path, dtype=np.float16, mode='r', shape=(rows, VECTOR_DIM))
+                    if rows else None
+                )
+                self._mapped_rows = rows
+            return self._matrix
+
+    def reserve(self, count):
+        """Reserva 'count' linhas no fim do ficheiro e devolve a primeira (os vetores são escritos com 'write_rows')."""
+        with self._lock:
+            if self._next_row is None or self._next_row < self.row_count():
+                self._next_row = self.row_count()
+            start_row = self._next_row
+            self._next_row += count
+            return start_row
+
+    def write_rows(self, start_row, vectors):
+        """Escreve vetores a partir de uma linha reservada. Linhas reservadas e nunca escritas ficam a zero."""
+        if not len(vectors):
+            return
+        with self._lock:
+            with open(self.path, 'r+b' if os.path.exists(self.path) else 'wb') as f:
+                f.seek(start_row * self.row_bytes)
+                f.write(np.asarray(vectors, dtype=np.float16).tobytes())
+
+    def clear_rows(self, rows):
+        """Zera as linhas de fragmentos removidos."""
+        rows = [row for row in rows if row is not None]
+        if not rows:
+            return
+        with self._lock:
+            self._matrix = None  # Liberta o memmap de leitura antes de escrever
+            total_rows = self.row_count()
+            matrix = np.memmap(self.path, dtype=np.float16, mode='r+', shape=(total_rows, VECTOR_DIM))
+            matrix[[row for row in rows if row < total_rows]] = 0
+            matrix.flush()
+            del matrix
+
+    def write_replacement(self, vectors):
+        """Escreve os vetores dados num ficheiro temporário, instalado depois com 'install_replacement'."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            for vector in vectors:
+                f.write(np.asarray(vector, dtype=np.float16).tobytes())
+        return tmp_path
+
+    def install_replacement(self, tmp_path):
+        """Substitui o ficheiro inteiro pelo escrito em 'write_replacement' (compactação ou reconstrução)."""
+        with self._lock:
+            self._matrix = None
+            self._next_row = None
+            os.replace(tmp_path, self.path)
+
+    def search(self, query_vector, k):
+        """
+        Pontua todas as linhas contra o vetor da pergunta com um produto matriz-vetor
+        vetorizado (em blocos convertidos para float32) e devolve [(linha, pontuação)].
+        """
+        matrix = self._mapped_matrix()
+        if matrix is None or not np.any(query_vector):
+            return []
+
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = np.empty(matrix.shape[0], dtype=np.float32)
+        for start in range(0, matrix.shape[0], SCORE_BLOCK_ROWS):
+            block = np.asarray(matrix[start:start + SCORE_BLOCK_ROWS], dtype=np.float32)
+            scores[start:start + len(block)] = block @ query
+
+        k = min(k, len(scores))
+        top_rows = np.argpartition(-scores, k - 1)[:k]
+        top_rows = top_rows[np.argsort(-scores[top_rows])]
+        return [(int(row), float(scores[row])) for row in top_rows if scores[row] > 0]